@@ -4,8 +4,8 @@ from django.contrib.auth.backends import ModelBackend
 from rest_framework.authentication import BaseAuthentication
 from config import custom_exception
 from .models import User
-from .utils import decode_jwt
-from django.core.cache import caches
+from .token_cache import token_cache
+from .utils import decode_jwt, session_exists, asession_exists
 
 
 class AbstractTokenAuthentication(ABC, BaseAuthentication):
@@ -34,9 +34,7 @@ class AbstractTokenAuthentication(ABC, BaseAuthentication):
 
     @staticmethod
     def validate_jti_token(payload):
-        jti = payload.get('jti')
-        user_id = payload.get('user_id')
-        if not caches['auth'].keys(f"user_{user_id} || {jti}"):
+        if not session_exists(payload.get('user_id'), payload.get('jti')):
             raise custom_exception.InvalidTokenError
 
 
@@ -52,6 +50,11 @@ class AccessTokenAuthentication(AbstractTokenAuthentication):
 
         access_token = self.get_access_token(authorization_header)
 
+        cached, generation = token_cache.get(access_token)
+        if cached:
+            payload, user = cached
+            return user, payload
+
         try:
             payload = self.get_payload(access_token)
         except jwt.ExpiredSignatureError:
@@ -63,6 +66,7 @@ class AccessTokenAuthentication(AbstractTokenAuthentication):
 
         user = self.get_user_from_payload(payload)
 
+        token_cache.put(access_token, payload, user, generation)
         return user, payload
 
     def get_authorization_header(self, request):
@@ -84,6 +88,55 @@ class AccessTokenAuthentication(AbstractTokenAuthentication):
         raise custom_exception.NotFoundAccessToken
 
 
+class AsyncAccessTokenAuthentication(AccessTokenAuthentication):
+    """AccessTokenAuthentication for async views, the jti check and user lookup don't block the event loop"""
+
+    async def authenticate(self, request):
+
+        authorization_header = self.get_authorization_header(request)
+
+        self.check_prefix_exists(authorization_header)
+
+        access_token = self.get_access_token(authorization_header)
+
+        cached, generation = token_cache.get(access_token)
+        if cached:
+            payload, user = cached
+            return user, payload
+
+        try:
+            payload = self.get_payload(access_token)
+        except jwt.ExpiredSignatureError:
+            raise custom_exception.ExpiredAccessTokenError
+        except Exception as e:
+            raise custom_exception.CommonError(str(e))
+
+        await self.avalidate_jti_token(payload)
+
+        user = await self.aget_user_from_payload(payload)
+
+        token_cache.put(access_token, payload, user, generation)
+        return user, payload
+
+    @staticmethod
+    async def avalidate_jti_token(payload):
+        if not await asession_exists(payload.get('user_id'), payload.get('jti')):
+            raise custom_exception.InvalidTokenError
+
+    @staticmethod
+    async def aget_user_from_payload(payload):
+        user_id = payload.get('user_id')
+        try:
+            user = await User.objects.aget(id=user_id)
+        except:
+            raise custom_exception.UserNotFound
+
+        if not user.is_active:
+            raise custom_exception.NotActiveUserError
+
+        return user
+
+
 class RefreshTokenAuthentication(AbstractTokenAuthentication):
 
     def authenticate(self, request):
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts.utils import index_existing_sessions
+
+
+class Command(BaseCommand):
+    help = "Adds the sessions stored before the per-user session index to it, run once after deploying it"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Keys per SCAN step and pipeline")
+
+    def handle(self, *args, **options):
+        count = index_existing_sessions(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} sessions"))
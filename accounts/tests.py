@@ -1,3 +1,172 @@
-from django.test import TestCase
+import asyncio
+import os
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.urls import reverse
+from django.test import SimpleTestCase
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from .models import User
+from .token_cache import TokenCache
+from .utils import (cache_key_setter, session_index_key, list_sessions, index_existing_sessions,
+                    get_async_redis_client, delete_all_sessions, store_session, session_cache_key)
+
+
+class SessionIndexTest(APITestCase):
+    def setUp(self):
+        caches['auth'].clear()
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+
+    def login(self, user_agent):
+        response = self.client.post(reverse("tabdil:accounts:login"), {
+            "user_identifier": "2700110595",
+            "password": "testpassword1"
+        }, HTTP_USER_AGENT=user_agent)
+        return response.data["data"]
+
+    def test_sessions_are_listed_from_the_index(self):
+        tokens = self.login("phone")
+        self.login("laptop")
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {tokens['access']}")
+        response = self.client.get(reverse("tabdil:accounts:active_login"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(session["user_agent"] for session in response.data), ["laptop", "phone"])
+
+    def test_expired_sessions_are_pruned_from_the_index(self):
+        self.login("phone")
+        jti = next(iter(list_sessions(self.user.id)))
+        caches['auth'].delete(cache_key_setter(self.user.id, jti))
+
+        self.assertEqual(list_sessions(self.user.id), {})
+        index_key = caches['auth'].make_key(session_index_key(self.user.id))
+        self.assertEqual(caches['auth'].client.get_client().scard(index_key), 0)
+
+    def test_logout_all_ends_every_session(self):
+        tokens = self.login("phone")
+        self.login("laptop")
+
+        response = self.client.delete(reverse("tabdil:accounts:logout_all"), {"refresh_token": tokens["refresh"]},
+                                      format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list_sessions(self.user.id), {})
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {tokens['access']}")
+        self.assertNotEqual(self.client.get(reverse("tabdil:accounts:active_login")).status_code,
+                            status.HTTP_200_OK)
+
+    def test_a_session_stored_while_ending_all_sessions_is_ended_too(self):
+        self.login("phone")
+        racing = []
+
+        def store_while_deleting(user_id, jti):
+            if not racing:
+                racing.append(jti)
+                store_session(user_id, "racing", "laptop")
+            return session_cache_key(user_id, jti)
+
+        with mock.patch("accounts.utils.session_cache_key", side_effect=store_while_deleting):
+            delete_all_sessions(self.user.id)
+
+        self.assertEqual(list_sessions(self.user.id), {})
+        self.assertIsNone(caches['auth'].get(cache_key_setter(self.user.id, "racing")))
+
+    def test_sessions_stored_before_the_index_are_indexed(self):
+        caches['auth'].set(cache_key_setter(self.user.id, "legacy"), "phone")
+        self.assertEqual(list_sessions(self.user.id), {})
+
+        self.assertEqual(index_existing_sessions(), 1)
+        self.assertEqual(list_sessions(self.user.id), {"legacy": "phone"})
+
+    def test_logout_revokes_a_cached_token(self):
+        tokens = self.login("phone")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {tokens['access']}")
+        self.assertEqual(self.client.get(reverse("tabdil:accounts:active_login")).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(reverse("tabdil:accounts:active_login")).status_code, status.HTTP_200_OK)
+
+        self.client.delete(reverse("tabdil:accounts:logout"), {"refresh_token": tokens["refresh"]}, format="json")
+        self.assertNotEqual(self.client.get(reverse("tabdil:accounts:active_login")).status_code,
+                            status.HTTP_200_OK)
+
+
+class AsyncRedisClientTest(SimpleTestCase):
+    async def get_clients(self):
+        return get_async_redis_client(), get_async_redis_client()
+
+    def test_every_event_loop_gets_its_own_client(self):
+        first, same = asyncio.run(self.get_clients())
+        second, _ = asyncio.run(self.get_clients())
+
+        self.assertIs(first, same)
+        self.assertIsNot(first, second)
+
+
+class TokenCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.cache = TokenCache(max_size=2, ttl=30, stats_interval=0)
+        # Stands in for the revocation listener
+        self.cache.listener_pid = os.getpid()
+        self.cache.subscribed = True
+        self.user = User(id=1, email='testemail1@yahoo.com', national_id="2700110595")
+
+    def payload(self, jti, user_id=1):
+        return {"user_id": user_id, "jti": jti, "exp": time.time() + 3600}
+
+    def cache_token(self, token, payload):
+        _, generation = self.cache.get(token)
+        self.cache.put(token, payload, self.user, generation)
+
+    def test_validated_tokens_are_served_from_the_cache(self):
+        self.cache_token("token-a", self.payload("a"))
+
+        (payload, user), _ = self.cache.get("token-a")
+        self.assertEqual((payload["jti"], user.id), ("a", 1))
+        self.assertEqual((self.cache.stats()["hits"], self.cache.stats()["misses"]), (1, 1))
+
+    def test_every_hit_gets_its_own_user_instance(self):
+        self.user._state.fields_cache["seller"] = "stale seller"
+        self.cache_token("token-a", self.payload("a"))
+
+        (_, first), _ = self.cache.get("token-a")
+        (_, second), _ = self.cache.get("token-a")
+        self.assertIsNot(first, second)
+        self.assertEqual((first.id, first.email), (1, 'testemail1@yahoo.com'))
+        self.assertNotIn("seller", first._state.fields_cache)
+        self.assertFalse(first._state.adding)
+
+    def test_revocations_drop_the_session_or_all_sessions(self):
+        self.cache_token("token-a", self.payload("a"))
+        self.cache_token("token-b", self.payload("b"))
+
+        self.cache.invalidate(1, "a")
+        self.assertIsNone(self.cache.get("token-a")[0])
+        self.assertIsNotNone(self.cache.get("token-b")[0])
+
+        self.cache.invalidate(1)
+        self.assertIsNone(self.cache.get("token-b")[0])
+
+    def test_a_validation_racing_a_revocation_is_not_cached(self):
+        _, generation = self.cache.get("token-a")
+        self.cache.invalidate(1, "a")
+        self.cache.put("token-a", self.payload("a"), self.user, generation)
+
+        self.assertIsNone(self.cache.get("token-a")[0])
+
+    def test_nothing_is_served_while_unsubscribed(self):
+        self.cache_token("token-a", self.payload("a"))
+        self.cache.subscribed = False
+
+        self.assertIsNone(self.cache.get("token-a")[0])
+
+    def test_the_cache_is_bounded_and_expires_entries(self):
+        for jti in ("a", "b", "c"):
+            self.cache_token(f"token-{jti}", self.payload(jti))
+        self.assertIsNone(self.cache.get("token-a")[0])
+        self.assertEqual(self.cache.stats()["size"], 2)
+
+        self.cache_token("token-d", {**self.payload("d"), "exp": time.time()})
+        self.assertIsNone(self.cache.get("token-d")[0])
@@ -0,0 +1,176 @@
+"""
+Per-process cache of validated access tokens.
+
+AccessTokenAuthentication remembers, for a bounded LRU of access tokens and at most
+TOKEN_CACHE_TTL seconds, the payload and the field values of the user it validated
+them to, so a hot token costs no JWT decode, Redis round trip or user query; every
+hit gets a fresh user instance, related objects are never shared between requests.
+Revoking sessions publishes the user and jti on the auth Redis; every process
+listens in a daemon thread and drops the matching entries, so a revoked token stops
+working everywhere within the pub/sub latency, or within the TTL when the publish
+itself fails. A process that isn't subscribed, before its listener connects or
+after it lost the connection, serves no cached tokens at all, since it could have
+missed a revocation. Changes of the user itself, such as a ban, show after the TTL.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger('elastic_logger')
+
+REVOCATION_CHANNEL = "auth_token_revocations"
+
+
+def get_redis_client():
+    return caches['auth'].client.get_client(write=True)
+
+
+def snapshot_user(user):
+    """The user's own field values, none of the related objects a request loaded into it"""
+    fields = [field.attname for field in user._meta.concrete_fields]
+    return type(user), user._state.db, fields, [getattr(user, field) for field in fields]
+
+
+def restore_user(snapshot):
+    """A fresh instance per request, relations like user.seller are loaded anew"""
+    model, db, fields, values = snapshot
+    return model.from_db(db, fields, values)
+
+
+class TokenCache:
+    def __init__(self, max_size, ttl, stats_interval):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats_interval = stats_interval
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # Bumped by every invalidation, a validation that raced one is not cached
+        self.generation = 0
+        self.subscribed = False
+        self.listener_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, token):
+        """The cached (payload, user) of the token or None, and the generation to put a validation at"""
+        if not self.ttl:
+            return None, None
+        self.start_listener()
+
+        with self.lock:
+            entry = self.entries.get(token) if self.subscribed else None
+            if entry and entry[2] <= time.monotonic():
+                del self.entries[token]
+                entry = None
+            if entry:
+                self.entries.move_to_end(token)
+                self.hits += 1
+            else:
+                self.misses += 1
+            lookups = self.hits + self.misses
+            generation = self.generation
+
+        if self.stats_interval and lookups % self.stats_interval == 0:
+            logger.info("token_cache", extra=self.stats())
+        if entry:
+            return (entry[0], restore_user(entry[1])), generation
+        return None, generation
+
+    def put(self, token, payload, user, generation):
+        if generation is None:
+            return
+        expires_at = time.monotonic() + min(self.ttl, payload['exp'] - time.time())
+        with self.lock:
+            if generation != self.generation or not self.subscribed:
+                return
+            self.entries[token] = (payload, snapshot_user(user), expires_at)
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id, jti=None):
+        """Drops the cached tokens of the user's session jti, or of all its sessions"""
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            for token, (payload, _, _) in list(self.entries.items()):
+                if payload['user_id'] == user_id and jti in (None, payload['jti']):
+                    del self.entries[token]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "size": len(self.entries),
+                "subscribed": self.subscribed,
+            }
+
+    def start_listener(self):
+        # Threads don't survive a fork, every worker process starts its own
+        if self.listener_pid == os.getpid():
+            return
+        with self.lock:
+            if self.listener_pid == os.getpid():
+                return
+            self.listener_pid = os.getpid()
+            self.subscribed = False
+            self.entries.clear()
+        threading.Thread(target=self.listen, name="token-cache-listener", daemon=True).start()
+
+    def listen(self):
+        delay = 0.1
+        while True:
+            try:
+                pubsub = get_redis_client().pubsub()
+                pubsub.subscribe(REVOCATION_CHANNEL)
+                for message in pubsub.listen():
+                    if message["type"] == "subscribe":
+                        with self.lock:
+                            self.subscribed = True
+                        delay = 0.1
+                    elif message["type"] == "message":
+                        revocation = json.loads(message["data"])
+                        self.invalidate(revocation["user_id"], revocation["jti"])
+            except Exception as e:
+                logger.warning(f"Token cache lost its revocation subscription: {e}")
+            with self.lock:
+                self.subscribed = False
+                self.generation += 1
+                self.entries.clear()
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
+
+
+token_cache = TokenCache(
+    max_size=settings.TOKEN_CACHE_SIZE,
+    ttl=settings.TOKEN_CACHE_TTL,
+    stats_interval=settings.TOKEN_CACHE_STATS_INTERVAL,
+)
+
+
+def publish_revocation(user_id, jti=None):
+    """Drops the session jti of the user, or all of its sessions, from the token cache of every process"""
+    token_cache.invalidate(user_id, jti)
+    try:
+        get_redis_client().publish(REVOCATION_CHANNEL, json.dumps({"user_id": user_id, "jti": jti}))
+    except Exception as e:
+        logger.warning(f"Could not publish token revocation: {e}")
@@ -1,9 +1,16 @@
+import asyncio
 import datetime
+import weakref
+
 import jwt
+import redis.asyncio
 
 from django.conf import settings
+from django.core.cache import caches
 from uuid import uuid4
 
+from .token_cache import publish_revocation
+
 
 def generate_access_token(user_id, jti):
     access_token_payload = {
@@ -65,12 +72,116 @@ def get_client_ip_address(request):
     return ip_addr
 
 
-def set_token(request, user, caches):
+def session_cache_key(user_id, jti):
+    """The session's key as stored in Redis, prefixed by the auth cache"""
+    return caches['auth'].make_key(cache_key_setter(user_id, jti))
+
+
+def session_index_key(user_id):
+    """A Redis set of the jtis of the user's sessions, so they are found without scanning the keyspace"""
+    return f"sessions_of_user_{user_id}"
+
+
+def store_session(user_id, jti, value):
+    """
+    Writes the session key and adds its jti to the user's index in one MULTI; the
+    index lives as long as the user's newest session, listing prunes expired jtis.
+    """
+    cache = caches['auth']
+    index_key = cache.make_key(session_index_key(user_id))
+    pipeline = cache.client.get_client(write=True).pipeline()
+    pipeline.set(session_cache_key(user_id, jti), cache.client.encode(value), ex=cache.default_timeout)
+    pipeline.sadd(index_key, jti)
+    pipeline.expire(index_key, cache.default_timeout)
+    pipeline.execute()
+
+
+def session_exists(user_id, jti):
+    return caches['auth'].has_key(cache_key_setter(user_id, jti))
+
+
+# An asyncio client is bound to the event loop it first ran on, every loop gets its own
+async_redis_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_redis_client():
+    loop = asyncio.get_running_loop()
+    client = async_redis_clients.get(loop)
+    if client is None:
+        client = async_redis_clients[loop] = redis.asyncio.from_url(settings.CACHES['auth']['LOCATION'])
+    return client
+
+
+async def asession_exists(user_id, jti):
+    return bool(await get_async_redis_client().exists(session_cache_key(user_id, jti)))
+
+
+def list_sessions(user_id):
+    """{jti: user agent} of the user's live sessions"""
+    cache = caches['auth']
+    client = cache.client.get_client(write=True)
+    index_key = cache.make_key(session_index_key(user_id))
+    jtis = [jti.decode() for jti in client.smembers(index_key)]
+    values = cache.get_many([cache_key_setter(user_id, jti) for jti in jtis])
+    sessions = {cache_key_parser(key)[1]: value for key, value in values.items()}
+
+    expired = [jti for jti in jtis if jti not in sessions]
+    if expired:
+        client.srem(index_key, *expired)
+    return sessions
+
+
+def delete_session(user_id, jti):
+    cache = caches['auth']
+    pipeline = cache.client.get_client(write=True).pipeline()
+    pipeline.delete(session_cache_key(user_id, jti))
+    pipeline.srem(cache.make_key(session_index_key(user_id)), jti)
+    pipeline.execute()
+    publish_revocation(user_id, jti)
+
+
+def delete_all_sessions(user_id):
+    """
+    Reads the index and deletes its sessions with it in one WATCH/MULTI transaction,
+    a session stored in between makes it start over instead of being left unindexed
+    """
+    cache = caches['auth']
+    index_key = cache.make_key(session_index_key(user_id))
+
+    def delete_indexed_sessions(pipeline):
+        jtis = [jti.decode() for jti in pipeline.smembers(index_key)]
+        pipeline.multi()
+        pipeline.delete(index_key, *[session_cache_key(user_id, jti) for jti in jtis])
+
+    cache.client.get_client(write=True).transaction(delete_indexed_sessions, index_key)
+    publish_revocation(user_id)
+
+
+def set_token(request, user):
     jti = jti_maker()
     access_token = generate_access_token(user.id, jti)
     refresh_token = generate_refresh_token(user.id, jti)
 
-    key = cache_key_setter(user.id, jti)
-    value = cache_value_setter(request)
-    caches['auth'].set(key, value)
+    store_session(user.id, jti, cache_value_setter(request))
     return access_token, refresh_token
+
+
+def index_existing_sessions(batch_size=1000):
+    """
+    Adds the sessions stored before the per-user index existed to it, walking the
+    keyspace with SCAN so Redis keeps serving; safe to run again. Returns the
+    number of sessions indexed.
+    """
+    cache = caches['auth']
+    pipeline = cache.client.get_client(write=True).pipeline(transaction=False)
+    count = 0
+    for key in cache.iter_keys(cache_key_setter("*", "*"), itersize=batch_size):
+        user, jti = cache_key_parser(key)
+        index_key = cache.make_key(session_index_key(user.removeprefix("user_")))
+        pipeline.sadd(index_key, jti)
+        pipeline.expire(index_key, cache.default_timeout)
+        count += 1
+        if count % batch_size == 0:
+            pipeline.execute()
+    pipeline.execute()
+    return count
@@ -1,5 +1,4 @@
 from django.contrib.auth import authenticate
-from django.core.cache import caches
 from django.db import transaction
 from django.db.models import Q
 from rest_framework import status
@@ -10,7 +9,7 @@ from rest_framework.views import APIView
 from .authentication import RefreshTokenAuthentication, AccessTokenAuthentication
 from .models import User
 from .serializers import SellerRegisterSerializer, SellerLoginSerializer
-from .utils import set_token, cache_key_parser
+from .utils import set_token, list_sessions, delete_session, delete_all_sessions
 from charging.models import Seller
 from permissions import IsSuperuser
 
@@ -47,7 +46,7 @@ class SellerLogin(APIView):
         elif not user.is_active:
             return Response({'message': "User is Banned"}, status=status.HTTP_404_NOT_FOUND)
 
-        access_token, refresh_token = set_token(request, user, caches)
+        access_token, refresh_token = set_token(request, user)
         data = {"access": access_token, "refresh": refresh_token}
         request.user = user
         return Response({"message": "Logged in successfully", "data": data}, status=status.HTTP_201_CREATED)
@@ -61,10 +60,9 @@ class RefreshToken(APIView):
         user = request.user
         payload = request.auth
 
-        jti = payload["jti"]
-        caches['auth'].delete(f'user_{user.id} || {jti}')
+        delete_session(user.id, payload["jti"])
 
-        access_token, refresh_token = set_token(request, user, caches)
+        access_token, refresh_token = set_token(request, user)
         data = {"access": access_token, "refresh": refresh_token}
 
         return Response(data, status=status.HTTP_201_CREATED)
@@ -77,8 +75,7 @@ class LogoutView(APIView):
     def delete(self, request):
         payload = request.auth
         user = request.user
-        jti = payload["jti"]
-        caches['auth'].delete(f'user_{user.id} || {jti}')
+        delete_session(user.id, payload["jti"])
 
         return Response({"message": "Logged out successfully"}, status=status.HTTP_200_OK)
 
@@ -91,9 +88,7 @@ class CheckAllActiveLogin(APIView):
         user = request.user
 
         active_login_data = []
-        for key, value in caches['auth'].get_many(caches['auth'].keys(f'user_{user.id} || *')).items():
-            jti = cache_key_parser(key)[1]
-
+        for jti, value in list_sessions(user.id).items():
             active_login_data.append({
                 "jti": jti,
                 "user_agent": value,
@@ -108,7 +103,7 @@ class LogoutAll(APIView):
 
     def delete(self, request):
         user = request.user
-        caches['auth'].delete_many(caches['auth'].keys(f'user_{user.id} || *'))
+        delete_all_sessions(user.id)
 
         return Response({"message": "All accounts logged out"}, status=status.HTTP_200_OK)
 
@@ -120,7 +115,7 @@ class SelectedLogout(APIView):
     def delete(self, request):
         user = request.user
         jti = request.data.get("jti")
-        caches['auth'].delete(f'user_{user.id} || {jti}')
+        delete_session(user.id, jti)
 
         return Response({"message": "Chosen account was successfully logged out"}, status=status.HTTP_200_OK)
 
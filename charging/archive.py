@@ -0,0 +1,182 @@
+"""
+Cold storage of old ledger rows.
+
+archive_ledger moves a seller's ledger rows of months older than the retention window
+into zstd compressed NDJSON parts in the archive storage, recording each part in a
+LedgerArchive manifest entry, and deletes them from the hot table in the same
+database transaction as the manifest insert. Only rows already covered by the
+seller's latest reconciliation checkpoint and by the daily rollups are archived, so
+neither has to read them again.
+
+Readers merge the archived parts with the hot rows, see archived_page_rows and
+iter_archived_rows. Archived rows are all older than the retention window, so a page
+of hot rows younger than that never looks at the manifest.
+"""
+import heapq
+import io
+import json
+import tempfile
+
+import zstandard
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import get_storage_class
+from django.db import transaction
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from charging.models import Transaction, LedgerArchive, ReconciliationCheckpoint
+from charging.partitions import month_start, add_months
+from charging.rollups import rolled_up_to_tx_id
+
+ARCHIVE_FIELDS = ("id", "timestamp", "transaction_type", "amount", "phone", "idempotency_key")
+
+
+def archive_storage():
+    return get_storage_class(settings.LEDGER_ARCHIVE_STORAGE)()
+
+
+def archive_path(seller_id, month, first_tx_id):
+    return f"ledger_archive/seller_{seller_id}/{month:%Y-%m}/{first_tx_id}.ndjson.zst"
+
+
+def archive_horizon(now=None):
+    """Rows from this moment on are never archived"""
+    return add_months(month_start(now or timezone.now()), -settings.LEDGER_ARCHIVE_RETENTION_MONTHS)
+
+
+def archivable_months(horizon):
+    """(seller_id, month, up_to_tx_id) of every seller month holding rows ready to be archived"""
+    checkpoint_tx_id = ReconciliationCheckpoint.objects.filter(seller_id=OuterRef("seller_id")). \
+        order_by("-last_tx_id").values("last_tx_id")[:1]
+    return Transaction.objects.filter(timestamp__lt=horizon, id__lte=rolled_up_to_tx_id()). \
+        filter(id__lte=Subquery(checkpoint_tx_id)). \
+        values("seller_id", month=TruncMonth("timestamp")). \
+        annotate(up_to_tx_id=Max("id")). \
+        order_by("seller_id", "month"). \
+        values_list("seller_id", "month", "up_to_tx_id")
+
+
+def write_part(rows, file):
+    """Writes the rows as zstd compressed NDJSON, returns the row count and the first and last rows"""
+    count, first, last = 0, None, None
+    with zstandard.ZstdCompressor(level=10).stream_writer(file, closefd=False) as writer:
+        for row in rows:
+            record = dict(zip(ARCHIVE_FIELDS, row))
+            record["timestamp"] = record["timestamp"].isoformat()
+            writer.write((json.dumps(record) + "\n").encode())
+            count, first, last = count + 1, first or record, record
+    return count, first, last
+
+
+def archive_month(seller_id, month, up_to_tx_id, storage):
+    """Archives one seller month, returns its manifest entry or None when nothing was left to archive"""
+    month = month_start(month)
+    month_rows = Transaction.objects.filter(seller_id=seller_id, timestamp__gte=month,
+                                            timestamp__lt=add_months(month, 1), id__lte=up_to_tx_id)
+    bounds = month_rows.aggregate(first_tx_id=Min("id"), last_tx_id=Max("id"), row_count=Count("id"))
+    if not bounds["row_count"]:
+        return None
+
+    path = archive_path(seller_id, month, bounds["first_tx_id"])
+    with tempfile.TemporaryFile() as file:
+        rows = month_rows.order_by("timestamp", "id").values_list(*ARCHIVE_FIELDS).iterator(chunk_size=5000)
+        row_count, first, last = write_part(rows, file)
+        file.seek(0)
+        # A part left behind by a run that failed before its manifest was committed is replaced
+        if storage.exists(path):
+            storage.delete(path)
+        saved_path = storage.save(path, File(file))
+
+    with transaction.atomic():
+        deleted, _ = month_rows.delete()
+        if deleted != row_count:
+            raise ValueError(f"Archived {row_count} ledger rows of seller {seller_id} for {month:%Y-%m} "
+                             f"but {deleted} were deleted")
+        return LedgerArchive.objects.create(
+            seller_id=seller_id,
+            month=month.date(),
+            path=saved_path,
+            row_count=row_count,
+            first_tx_id=bounds["first_tx_id"],
+            last_tx_id=bounds["last_tx_id"],
+            first_timestamp=parse_datetime(first["timestamp"]),
+            last_timestamp=parse_datetime(last["timestamp"]),
+        )
+
+
+def archive_ledger(horizon=None, progress=None):
+    """Archives every seller month ready for it, returns the created manifest entries"""
+    storage = archive_storage()
+    archives = []
+    for seller_id, month, up_to_tx_id in archivable_months(horizon or archive_horizon()):
+        archive = archive_month(seller_id, month, up_to_tx_id, storage)
+        if archive:
+            archives.append(archive)
+            if progress:
+                progress(archive)
+    return archives
+
+
+def read_part(archive, storage=None):
+    """The archived rows of a manifest entry in (timestamp, id) order, as unsaved Transactions"""
+    with (storage or archive_storage()).open(archive.path, "rb") as file:
+        reader = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(file), encoding="utf-8")
+        for line in reader:
+            record = json.loads(line)
+            record["timestamp"] = parse_datetime(record["timestamp"])
+            yield Transaction(seller_id=archive.seller_id, **record)
+
+
+def row_matches(row, filters):
+    """Applies the ledger filters of utils.get_transaction_filters to an archived row"""
+    for lookup, value in filters.items():
+        if lookup == "transaction_type" and row.transaction_type != value:
+            return False
+        if lookup == "timestamp__gte" and row.timestamp < value:
+            return False
+        if lookup == "timestamp__lt" and row.timestamp >= value:
+            return False
+    return True
+
+
+def archived_parts(seller_id, filters):
+    archives = LedgerArchive.objects.filter(seller_id=seller_id)
+    if "timestamp__gte" in filters:
+        archives = archives.filter(last_timestamp__gte=filters["timestamp__gte"])
+    if "timestamp__lt" in filters:
+        archives = archives.filter(first_timestamp__lt=filters["timestamp__lt"])
+    return archives
+
+
+def iter_archived_rows(seller_id, filters):
+    """Every archived row of the seller matching the filters, in (timestamp, id) order"""
+    storage = archive_storage()
+    parts = [
+        (row for row in read_part(archive, storage) if row_matches(row, filters))
+        for archive in archived_parts(seller_id, filters).order_by("first_timestamp")
+    ]
+    return heapq.merge(*parts, key=lambda row: (row.timestamp, row.id))
+
+
+def archived_page_rows(seller_id, filters, cursor, limit):
+    """
+    Up to limit archived rows of the seller coming after cursor, a (timestamp, id)
+    pair or None, in (timestamp, id) descending order.
+    """
+    archives = archived_parts(seller_id, filters).order_by("-last_timestamp")
+    if cursor:
+        archives = archives.filter(first_timestamp__lte=cursor[0])
+
+    storage = archive_storage()
+    rows = []
+    for archive in archives:
+        # Parts come newest first, one ending before the limit-th row found so far can't contribute
+        if len(rows) >= limit and archive.last_timestamp < rows[limit - 1].timestamp:
+            break
+        rows += [row for row in read_part(archive, storage)
+                 if row_matches(row, filters) and (not cursor or (row.timestamp, row.id) < tuple(cursor))]
+        rows.sort(key=lambda row: (row.timestamp, row.id), reverse=True)
+    return rows[:limit]
@@ -0,0 +1,116 @@
+"""
+Async-native versions of the hot seller endpoints, served by the ASGI application.
+
+DRF views are sync only, so these are plain Django async views sharing the
+serializers and services of their DRF counterparts in views.py.
+"""
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError
+from django.db.models import Sum
+from django.http import JsonResponse, HttpResponseNotAllowed
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+
+from accounts.authentication import AsyncAccessTokenAuthentication
+from .coalescer import ChargeCoalescingTimeout
+from .models import Seller, Transaction
+from .retry import ConcurrentUpdate
+from .serializers import SellerSellingChargeCreateSerializer
+from .services import perform_charge, InsufficientCredit
+from .utils import get_idempotency_key, aget_stored_response, astore_response, request_fingerprint, \
+    is_same_request, IDEMPOTENCY_KEY_REUSED
+
+
+def async_api_view(http_method_names):
+    """
+    Restricts the methods and authenticates the access token like the DRF views do.
+    Django's own view decorators are sync only in 4.2, so this one covers csrf_exempt too.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in http_method_names:
+                return HttpResponseNotAllowed(http_method_names)
+            try:
+                request.user, request.auth = await AsyncAccessTokenAuthentication().authenticate(request)
+                return await view(request, *args, **kwargs)
+            except APIException as e:
+                return JsonResponse({"detail": e.detail}, status=e.status_code)
+
+        wrapper.csrf_exempt = True
+        return wrapper
+
+    return decorator
+
+
+def get_request_data(request):
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError as e:
+            # The message of DRF's JSONParser
+            raise ParseError(f"JSON parse error - {e}")
+    return request.POST
+
+
+@async_api_view(["POST"])
+async def sell_charge(request):
+    user = request.user
+    idempotency_key = get_idempotency_key(request)
+
+    serializer = SellerSellingChargeCreateSerializer(data=get_request_data(request))
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    amount = serializer.validated_data["amount"]
+    phone = serializer.validated_data["phone"]
+
+    fingerprint = request_fingerprint(phone=phone, amount=amount)
+    if idempotency_key:
+        stored_response = await aget_stored_response("sell_charge", user.id, idempotency_key)
+        if stored_response:
+            if not is_same_request(stored_response, fingerprint):
+                return JsonResponse(IDEMPOTENCY_KEY_REUSED, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return JsonResponse(stored_response["data"], status=stored_response["status"])
+
+    data, status_code = {'success': True, 'message': 'Selling charge has been done successfully'}, status.HTTP_200_OK
+    charged = idempotency_key and await Transaction.objects.filter(
+        seller__user=user, idempotency_key=idempotency_key).values_list("phone", "amount").afirst()
+    if charged and charged != (phone, amount):
+        return JsonResponse(IDEMPOTENCY_KEY_REUSED, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if not charged:
+        seller = await Seller.objects.only("id", "credit_stripes").aget(user=user)
+        try:
+            # The ASGI handler gives every request its own thread for thread sensitive calls,
+            # so concurrent charges don't queue behind each other here
+            await sync_to_async(perform_charge)(seller.id, phone, amount, idempotency_key,
+                                                striped=bool(seller.credit_stripes))
+        except IntegrityError:
+            # A concurrent request with the same idempotency key has been charged first
+            pass
+        except ChargeCoalescingTimeout:
+            return JsonResponse({'success': False,
+                                 'message': 'Charge result is unknown, retry with the same Idempotency-Key'},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except ConcurrentUpdate:
+            return JsonResponse({'success': False, 'message': 'Seller credit is busy, retry the charge'},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except InsufficientCredit:
+            data, status_code = {'success': False, 'message': 'Insufficient credit'}, status.HTTP_400_BAD_REQUEST
+
+    if idempotency_key:
+        await astore_response("sell_charge", user.id, idempotency_key, data, status_code, fingerprint)
+    return JsonResponse(data, status=status_code)
+
+
+@async_api_view(["GET"])
+async def show_credit(request):
+    seller = await Seller.objects.select_related("user").aget(user=request.user)
+    credit = seller.credit
+    if seller.credit_stripes:
+        credit += (await seller.credit_buckets.aaggregate(total=Sum("credit")))["total"] or 0
+
+    return JsonResponse({"user": str(seller.user), "credit": credit})
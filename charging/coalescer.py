@@ -0,0 +1,200 @@
+"""
+Group commit for charges of the same seller.
+
+Concurrent charges for one seller are gathered for a short window and applied by a
+single leader with services.apply_charges, so the seller row is locked once per
+batch instead of once per charge. The local backend coalesces threads of one
+worker process, the redis backend coalesces across all workers.
+"""
+import json
+import logging
+import threading
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+
+from charging.services import apply_charges
+
+logger = logging.getLogger('elastic_logger')
+
+BATCH_SIZE_HISTOGRAM_KEY = "charge_batch_sizes"
+
+
+class ChargeCoalescingTimeout(Exception):
+    """The charge was handed to a batch but its outcome was not reported in time"""
+
+
+def get_redis_client():
+    return caches['default'].client.get_client(write=True)
+
+
+def record_batch_size(size):
+    try:
+        get_redis_client().hincrby(BATCH_SIZE_HISTOGRAM_KEY, str(size), 1)
+    except Exception as e:
+        logger.warning(f"Could not record charge batch size: {e}")
+
+
+def get_batch_size_histogram():
+    histogram = get_redis_client().hgetall(BATCH_SIZE_HISTOGRAM_KEY)
+    return {int(size): int(count) for size, count in histogram.items()}
+
+
+def reset_batch_size_histogram():
+    get_redis_client().delete(BATCH_SIZE_HISTOGRAM_KEY)
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class LocalChargeCoalescer:
+    def __init__(self, window, max_batch, timeout):
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def submit(self, seller_id, charge):
+        entry = {"charge": charge, "done": threading.Event(), "applied": False, "error": None}
+        with self.lock:
+            is_leader = seller_id not in self.pending
+            self.pending.setdefault(seller_id, []).append(entry)
+
+        if is_leader:
+            time.sleep(self.window)
+            with self.lock:
+                batch = self.pending.pop(seller_id)
+            for entries in chunked(batch, self.max_batch):
+                self.flush(seller_id, entries)
+
+        if not entry["done"].wait(self.timeout):
+            raise ChargeCoalescingTimeout
+        if entry["error"] is not None:
+            raise entry["error"]
+        return entry["applied"]
+
+    @staticmethod
+    def flush(seller_id, entries):
+        try:
+            applied = apply_charges(seller_id, [entry["charge"] for entry in entries])
+        except Exception as e:
+            applied = [False] * len(entries)
+            for entry in entries:
+                entry["error"] = e
+        record_batch_size(len(entries))
+        for entry, is_applied in zip(entries, applied):
+            entry["applied"] = is_applied
+            entry["done"].set()
+
+
+class RedisChargeCoalescer:
+    """
+    Every charge is pushed to the seller's queue; whoever holds the seller's leader
+    lock drains the queue in batches and pushes each outcome to a per-charge result
+    list the submitter is blocked on. A submitter whose leader died takes over once
+    the lock expires.
+    """
+    release_lock_script = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, window, max_batch, timeout):
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.lock_ttl = max(int(timeout * 1000), 1000)
+        self.poll_interval = max(self.window * 4, 0.01)
+
+    @staticmethod
+    def queue_key(seller_id):
+        return f"charge_queue_{seller_id}"
+
+    @staticmethod
+    def leader_key(seller_id):
+        return f"charge_leader_{seller_id}"
+
+    @staticmethod
+    def result_key(entry_id):
+        return f"charge_result_{entry_id}"
+
+    def submit(self, seller_id, charge):
+        client = get_redis_client()
+        entry_id = uuid4().hex
+        client.rpush(self.queue_key(seller_id), json.dumps({"id": entry_id, **charge}))
+
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if client.set(self.leader_key(seller_id), entry_id, nx=True, px=self.lock_ttl):
+                try:
+                    time.sleep(self.window)
+                    self.drain(client, seller_id, entry_id)
+                finally:
+                    client.eval(self.release_lock_script, 1, self.leader_key(seller_id), entry_id)
+
+            result = client.blpop(self.result_key(entry_id), timeout=self.poll_interval)
+            if result:
+                outcome = json.loads(result[1])
+                if outcome.get("error"):
+                    raise ValueError(outcome["error"])
+                return outcome["applied"]
+
+        raise ChargeCoalescingTimeout
+
+    def drain(self, client, seller_id, entry_id):
+        """Applies queued batches until the leader's own charge has been handled or the queue is empty"""
+        while True:
+            pipe = client.pipeline()
+            pipe.lrange(self.queue_key(seller_id), 0, self.max_batch - 1)
+            pipe.ltrim(self.queue_key(seller_id), self.max_batch, -1)
+            raw_entries, _ = pipe.execute()
+            if not raw_entries:
+                return
+
+            entries = [json.loads(raw_entry) for raw_entry in raw_entries]
+            charges = [{"phone": entry["phone"], "amount": entry["amount"],
+                        "idempotency_key": entry.get("idempotency_key")} for entry in entries]
+            try:
+                outcomes = [{"applied": is_applied} for is_applied in apply_charges(seller_id, charges)]
+            except Exception as e:
+                logger.error(f"Charge batch of seller {seller_id} failed: {e}")
+                outcomes = [{"applied": False, "error": str(e)}] * len(entries)
+            record_batch_size(len(entries))
+
+            pipe = client.pipeline()
+            for entry, outcome in zip(entries, outcomes):
+                pipe.rpush(self.result_key(entry["id"]), json.dumps(outcome))
+                pipe.expire(self.result_key(entry["id"]), int(self.timeout) + 60)
+            pipe.execute()
+
+            if any(entry["id"] == entry_id for entry in entries):
+                return
+
+
+CHARGE_COALESCER_BACKEND = {
+    "local": LocalChargeCoalescer,
+    "redis": RedisChargeCoalescer,
+}
+
+_charge_coalescers = {}
+
+
+def get_charge_coalescer():
+    # Keyed by the settings too, so a changed window or batch size takes effect
+    key = (settings.CHARGE_COALESCER_BACKEND, settings.CHARGE_COALESCE_WINDOW,
+           settings.CHARGE_COALESCE_MAX_BATCH, settings.CHARGE_COALESCE_TIMEOUT)
+    if key not in _charge_coalescers:
+        backend, window, max_batch, timeout = key
+        _charge_coalescers[key] = CHARGE_COALESCER_BACKEND[backend](
+            window=window,
+            max_batch=max_batch,
+            timeout=timeout,
+        )
+    return _charge_coalescers[key]
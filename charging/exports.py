@@ -0,0 +1,113 @@
+"""
+Streaming ledger exports.
+
+Rows are read through a server-side cursor and encoded, and optionally compressed,
+chunk by chunk, so an export starts sending at once and holds one chunk in memory
+whatever the size of the history.
+"""
+import csv
+import json
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+EXPORT_FIELDS = ("id", "timestamp", "transaction_type", "amount", "phone")
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class Echo:
+    """A file-like object csv.writer writes a row into and gets it straight back"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row_id, timestamp, *values in rows:
+        yield writer.writerow((row_id, timestamp.isoformat(), *values))
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        record = dict(zip(EXPORT_FIELDS, row))
+        record["timestamp"] = record["timestamp"].isoformat()
+        yield json.dumps(record) + "\n"
+
+
+EXPORT_ENCODERS = {
+    "csv": csv_lines,
+    "ndjson": ndjson_lines,
+}
+
+
+class GzipCompressor:
+    """Flushes every chunk, so the client can decode what it got so far"""
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self):
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+def available_compressors():
+    compressors = {"gzip": GzipCompressor}
+    if brotli is not None:
+        compressors["br"] = BrotliCompressor
+    return compressors
+
+
+def negotiate_compression(accept_encoding):
+    """The content coding to use for an Accept-Encoding header, brotli preferred, None for identity"""
+    accepted = {coding.split(";")[0].strip() for coding in accept_encoding.split(",")
+                if not coding.strip().endswith(";q=0")}
+    for coding in ("br", "gzip"):
+        if coding in accepted and coding in available_compressors():
+            return coding
+    return None
+
+
+def stream_export(rows, export_format, compression=None, chunk_size=2000):
+    """
+    Encodes the (id, timestamp, transaction_type, amount, phone) rows, yielding
+    roughly one chunk of rows per piece of output.
+    """
+    compressor = available_compressors()[compression]() if compression else None
+    buffer = []
+    for count, line in enumerate(EXPORT_ENCODERS[export_format](rows), start=1):
+        buffer.append(line)
+        if count % chunk_size == 0:
+            data = "".join(buffer).encode()
+            buffer = []
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+
+    data = "".join(buffer).encode()
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
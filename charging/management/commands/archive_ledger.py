@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from charging.archive import archive_ledger, archive_horizon
+
+
+class Command(BaseCommand):
+    help = "Moves reconciled and rolled up ledger rows older than the retention window to the archive storage"
+
+    def progress(self, archive):
+        self.stdout.write(f"Archived {archive.row_count} rows of seller {archive.seller_id} "
+                          f"for {archive.month:%Y-%m} to {archive.path}")
+
+    def handle(self, *args, **options):
+        horizon = archive_horizon()
+        self.stdout.write(f"Archiving ledger rows before {horizon:%Y-%m-%d} "
+                          f"({settings.LEDGER_ARCHIVE_RETENTION_MONTHS} months retention)")
+        archives = archive_ledger(horizon, progress=self.progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {sum(archive.row_count for archive in archives)} rows in {len(archives)} parts"))
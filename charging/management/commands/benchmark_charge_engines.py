@@ -0,0 +1,86 @@
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from charging.models import Seller
+from charging.retry import local_retry_stats
+from charging.services import CHARGE_STRATEGY, perform_charge
+
+User = get_user_model()
+
+BENCHMARK_EMAIL_DOMAIN = "charge-benchmark.invalid"
+
+
+def benchmark_worker(args):
+    """Worker function charging random sellers of the scenario on its own connection"""
+    engine, seller_ids, charges, seed = args
+
+    connection.close()
+    local_retry_stats.clear()
+
+    rng = random.Random(seed)
+    failed = 0
+    try:
+        with override_settings(CHARGE_ENGINE=engine):
+            for index in range(charges):
+                try:
+                    perform_charge(rng.choice(seller_ids), f"0912{seed % 1000:03d}{index % 10000:04d}", 1)
+                except Exception:
+                    failed += 1
+        return charges - failed, failed, local_retry_stats["charge:retries"]
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Compares the charge throughput of charge engines under low and high contention. " \
+           "Creates throwaway sellers, run it against a disposable database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--engines", nargs="+", default=["locking", "optimistic"], choices=sorted(CHARGE_STRATEGY))
+        parser.add_argument("--processes", type=int, default=8)
+        parser.add_argument("--charges", type=int, default=500, help="Charges per process")
+        parser.add_argument("--low-contention-sellers", type=int, default=64,
+                            help="Sellers the charges are spread over under low contention, high contention uses one")
+
+    def create_sellers(self, count):
+        return [
+            Seller.objects.create(user=User.objects.create_user(
+                email=f"seller{index}@{BENCHMARK_EMAIL_DOMAIN}", national_id=f"99{index:08d}", password=None,
+            ), credit=10 ** 9).id
+            for index in range(count)
+        ]
+
+    def run(self, engine, seller_ids, processes, charges):
+        Seller.objects.filter(id__in=seller_ids).update(credit=10 ** 9)
+        connection.close()
+
+        start_time = time.monotonic()
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(benchmark_worker, [(engine, seller_ids, charges, seed)
+                                                           for seed in range(processes)]))
+        elapsed = time.monotonic() - start_time
+        done, failed, retries = (sum(values) for values in zip(*results))
+        return done / elapsed, failed, retries
+
+    def handle(self, *args, **options):
+        if options["processes"] < 1 or options["charges"] < 1 or options["low_contention_sellers"] < 1:
+            raise CommandError("--processes, --charges and --low-contention-sellers must be positive")
+
+        User.objects.filter(email__endswith=f"@{BENCHMARK_EMAIL_DOMAIN}").delete()
+        try:
+            seller_ids = self.create_sellers(options["low_contention_sellers"])
+            scenarios = {"low": seller_ids, "high": seller_ids[:1]}
+            for scenario, scenario_seller_ids in scenarios.items():
+                for engine in options["engines"]:
+                    throughput, failed, retries = self.run(engine, scenario_seller_ids, options["processes"],
+                                                           options["charges"])
+                    self.stdout.write(f"{scenario:>4} contention, {engine:>11}: {throughput:8.0f} charges/s, "
+                                      f"{retries} retries, {failed} failed")
+        finally:
+            User.objects.filter(email__endswith=f"@{BENCHMARK_EMAIL_DOMAIN}").delete()
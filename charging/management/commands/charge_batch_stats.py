@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from charging.coalescer import get_batch_size_histogram, reset_batch_size_histogram
+
+
+class Command(BaseCommand):
+    help = "Reports the batch size distribution of the charge coalescer, used to tune CHARGE_COALESCE_WINDOW"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Clear the distribution after reporting it")
+
+    def handle(self, *args, **options):
+        histogram = get_batch_size_histogram()
+        total_batches = sum(histogram.values())
+        if not total_batches:
+            self.stdout.write("No charge batches recorded")
+            return
+
+        total_charges = sum(size * count for size, count in histogram.items())
+        self.stdout.write(f"Batches: {total_batches}")
+        self.stdout.write(f"Charges: {total_charges}")
+        self.stdout.write(f"Mean batch size: {total_charges / total_batches:.2f}")
+        for fraction in (0.5, 0.9, 0.99):
+            self.stdout.write(f"p{int(fraction * 100)} batch size: {self.percentile(histogram, fraction)}")
+        self.stdout.write(f"Max batch size: {max(histogram)}")
+
+        self.stdout.write("Distribution:")
+        for size in sorted(histogram):
+            self.stdout.write(f"  {size:>4}: {histogram[size]}")
+
+        if options["reset"]:
+            reset_batch_size_histogram()
+
+    @staticmethod
+    def percentile(histogram, fraction):
+        threshold = fraction * sum(histogram.values())
+        seen = 0
+        for size in sorted(histogram):
+            seen += histogram[size]
+            if seen >= threshold:
+                return size
+        return max(histogram)
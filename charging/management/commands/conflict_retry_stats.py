@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from charging.retry import get_retry_stats, reset_retry_stats
+
+
+class Command(BaseCommand):
+    help = "Reports how often optimistic and serializable ledger operations were retried, per operation"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Clear the counts after reporting them")
+
+    def handle(self, *args, **options):
+        stats = get_retry_stats()
+        if not stats:
+            self.stdout.write("No conflict retries recorded")
+            return
+
+        operations = sorted({field.split(":")[0] for field in stats})
+        for operation in operations:
+            self.stdout.write(f"{operation}: {stats.get(f'{operation}:retries', 0)} retries, "
+                              f"{stats.get(f'{operation}:exhausted', 0)} gave up")
+
+        if options["reset"]:
+            reset_retry_stats()
@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from charging.reservations import flush_reservations, get_redis_client, retry_failed_reservations, \
+    refund_failed_reservations, FLUSHER_LOCK_KEY
+
+
+class Command(BaseCommand):
+    help = "Writes credit reserved in Redis behind to Seller.credit and the Transaction ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Drain the journal once and exit")
+        parser.add_argument("--batch-size", type=int, default=settings.CREDIT_RESERVATION_FLUSH_BATCH)
+        parser.add_argument("--interval", type=float, default=settings.CREDIT_RESERVATION_FLUSH_INTERVAL,
+                            help="Seconds to sleep when the journal is empty")
+        parser.add_argument("--retry-failed", action="store_true",
+                            help="Move the reservations that failed to flush back to the journal first")
+        parser.add_argument("--refund-failed", action="store_true",
+                            help="Drop the reservations that failed to flush and return their credit, then exit")
+
+    def handle(self, *args, **options):
+        if options["refund_failed"]:
+            self.stdout.write(f"Refunded {refund_failed_reservations()} failed reservations")
+            return
+
+        client = get_redis_client()
+        lock_ttl = max(int(options["interval"] * 1000) * 50, 10000)
+        if not client.set(FLUSHER_LOCK_KEY, 1, nx=True, px=lock_ttl):
+            raise CommandError("Another flusher is running")
+
+        try:
+            if options["retry_failed"]:
+                self.stdout.write(f"Retrying {retry_failed_reservations()} failed reservations")
+            while True:
+                client.pexpire(FLUSHER_LOCK_KEY, lock_ttl)
+                flushed = flush_reservations(options["batch_size"])
+                if flushed:
+                    self.stdout.write(f"Flushed {flushed} reservations")
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        finally:
+            client.delete(FLUSHER_LOCK_KEY)
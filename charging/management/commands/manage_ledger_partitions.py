@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from charging.partitions import create_upcoming_partitions
+
+
+class Command(BaseCommand):
+    help = "Pre-creates the upcoming monthly partitions of the Transaction ledger, archive_ledger retires old rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months-ahead", type=int, default=3,
+                            help="Months after the current one that must have a partition")
+
+    def handle(self, *args, **options):
+        for name in create_upcoming_partitions(options["months_ahead"]):
+            self.stdout.write(self.style.SUCCESS(f"Created partition {name}"))
@@ -0,0 +1,83 @@
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Min, Max
+from django.utils import timezone
+
+from charging.models import Seller
+from charging.reconciliation import reconcile_seller_range
+
+
+def reconcile_range_worker(args):
+    """Worker function reconciling one seller id range on its own connection"""
+    first_id, last_id, advance = args
+
+    connection.close()
+
+    try:
+        return first_id, last_id, reconcile_seller_range(first_id, last_id, advance)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Reconciles every seller with the ledger, one grouped aggregate per seller id range across processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--range-size", type=int, default=10000, help="Seller ids per aggregate")
+        parser.add_argument("--advance", action="store_true",
+                            help="Record a checkpoint for every seller that reconciled")
+        parser.add_argument("--report", default="reconciliation_report.json", help="Where to write the summary")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["range_size"] < 1:
+            raise CommandError("--workers and --range-size must be positive")
+
+        bounds = Seller.objects.aggregate(first_id=Min("id"), last_id=Max("id"))
+        if bounds["first_id"] is None:
+            self.stdout.write("There are no sellers")
+            return
+        ranges = [(first_id, min(first_id + options["range_size"] - 1, bounds["last_id"]), options["advance"])
+                  for first_id in range(bounds["first_id"], bounds["last_id"] + 1, options["range_size"])]
+        connection.close()
+
+        started_at = timezone.now()
+        start_time = time.monotonic()
+        sellers = summed_rows = 0
+        mismatches = []
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            futures = [executor.submit(reconcile_range_worker, args) for args in ranges]
+            for done, future in enumerate(as_completed(futures), start=1):
+                first_id, last_id, result = future.result()
+                sellers += result["sellers"]
+                summed_rows += result["summed_rows"]
+                mismatches += result["mismatches"]
+
+                elapsed = time.monotonic() - start_time
+                self.stdout.write(f"[{done}/{len(ranges)}] sellers {first_id}-{last_id}: "
+                                  f"{len(result['mismatches'])} mismatches | "
+                                  f"{sellers / elapsed:.0f} sellers/s, {summed_rows / elapsed:.0f} rows/s")
+
+        elapsed = time.monotonic() - start_time
+        report = {
+            "started_at": started_at.isoformat(),
+            "duration_seconds": round(elapsed, 3),
+            "sellers": sellers,
+            "summed_rows": summed_rows,
+            "ranges": len(ranges),
+            "workers": options["workers"],
+            "mismatch_count": len(mismatches),
+            "mismatches": sorted(mismatches, key=lambda mismatch: mismatch["seller_id"]),
+        }
+        with open(options["report"], "w") as file:
+            json.dump(report, file, indent=2)
+
+        summary = f"Reconciled {sellers} sellers and {summed_rows} ledger rows in {elapsed:.1f}s, " \
+                  f"report written to {options['report']}"
+        if mismatches:
+            raise CommandError(f"{summary}; {len(mismatches)} sellers did not reconcile")
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from charging.models import Seller
+from charging.reconciliation import reconcile_seller
+from charging.reservations import get_redis_client, credit_mirror_snapshot, reset_credit_mirror, mirror_key, \
+    FAILED_KEY
+
+
+class Command(BaseCommand):
+    help = "Compares the Redis credit mirrors against the ledger balance minus the unflushed reservations"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repair", action="store_true", help="Reset mismatching mirrors to the expected credit")
+        parser.add_argument("--clear", action="store_true", help="Delete every mirror, e.g. after leaving the "
+                                                                 "reserved charge engine")
+
+    def handle(self, *args, **options):
+        client = get_redis_client()
+        seller_ids = [int(key.decode().rsplit("_", 1)[1]) for key in client.scan_iter(match=mirror_key("*"))]
+
+        if options["clear"]:
+            for seller_id in seller_ids:
+                client.delete(mirror_key(seller_id))
+            self.stdout.write(f"Deleted {len(seller_ids)} credit mirrors")
+            return
+
+        failed = client.llen(FAILED_KEY)
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{failed} reservations failed to flush, see {FAILED_KEY} and "
+                                                 f"flush_credit_reservations --retry-failed or --refund-failed"))
+
+        mismatches = 0
+        for seller_id in sorted(seller_ids):
+            with transaction.atomic():
+                # Holding the seller keeps deposits and flushes of its reservations out
+                Seller.objects.select_for_update().get(id=seller_id)
+                # The checkpoint plus the ledger after it, archived rows are covered by the checkpoint
+                report = reconcile_seller(seller_id, advance=False)
+                ledger_balance = report["ledger"]["balance"]
+                mirror, pending = credit_mirror_snapshot(client, seller_id)
+                if mirror is None:
+                    continue
+                pending_amount = sum(entry["amount"] for entry in pending)
+                expected_mirror = ledger_balance - pending_amount
+
+                if mirror == expected_mirror and report["equal"]:
+                    continue
+
+                mismatches += 1
+                self.stdout.write(self.style.ERROR(
+                    f"Seller {seller_id}: mirror {mirror}, expected {expected_mirror} "
+                    f"(ledger {ledger_balance} - pending {pending_amount}), "
+                    f"Seller.credit {report['current']['balance']}"))
+                if not (options["repair"] and report["equal"]):
+                    continue
+                # Reservations don't take the seller lock, the mirror is only set if none was made since the snapshot
+                if reset_credit_mirror(client, seller_id, mirror, expected_mirror):
+                    self.stdout.write(f"Seller {seller_id}: mirror reset to {expected_mirror}")
+                else:
+                    self.stdout.write(self.style.WARNING(f"Seller {seller_id}: mirror changed while checking, "
+                                                         f"not reset, run again"))
+
+        self.stdout.write(f"Checked {len(seller_ids)} credit mirrors, {mismatches} mismatches")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from charging.models import Seller
+from charging.reconciliation import reconcile_seller
+
+
+class Command(BaseCommand):
+    help = "Reconciles seller balances with the ledger rows after their last reconciliation checkpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument("seller_ids", nargs="*", type=int, help="Sellers to reconcile, all of them by default")
+        parser.add_argument("--dry-run", action="store_true", help="Don't advance the checkpoints")
+
+    def handle(self, *args, **options):
+        seller_ids = options["seller_ids"] or Seller.objects.order_by("id").values_list("id", flat=True)
+
+        mismatches = 0
+        for seller_id in seller_ids:
+            try:
+                report = reconcile_seller(seller_id, advance=not options["dry_run"])
+            except Seller.DoesNotExist:
+                raise CommandError(f"Seller {seller_id} does not exist")
+
+            if report["totals_match"]:
+                self.stdout.write(f"Seller {seller_id}: {report['summed_rows']} rows after "
+                                  f"ledger id {report['checkpoint_tx_id']} verified")
+                continue
+
+            mismatches += 1
+            first_tx_id, last_tx_id = report["diverged_tx_ids"]
+            self.stdout.write(self.style.ERROR(
+                f"Seller {seller_id}: ledger ids {first_tx_id} to {last_tx_id} diverged, "
+                f"ledger {report['ledger']} != current {report['current']}"))
+
+        if mismatches:
+            raise CommandError(f"{mismatches} sellers did not reconcile")
+        self.stdout.write(self.style.SUCCESS("All sellers reconciled"))
@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from charging.rollups import rollup_ledger
+
+
+class Command(BaseCommand):
+    help = "Folds new ledger rows into the daily per-seller rollups, the first run backfills the whole ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=settings.LEDGER_ROLLUP_CHUNK_SIZE,
+                            help="Ledger ids rolled up per transaction")
+        parser.add_argument("--lag", type=int, default=settings.LEDGER_ROLLUP_LAG,
+                            help="Seconds a ledger row must have settled before it is rolled up")
+        parser.add_argument("--loop", action="store_true", help="Keep rolling up every --interval seconds")
+        parser.add_argument("--interval", type=float, default=60)
+
+    def progress(self, last_tx_id, up_to_tx_id):
+        self.stdout.write(f"Rolled up to ledger id {last_tx_id} of {up_to_tx_id}")
+
+    def handle(self, *args, **options):
+        while True:
+            last_tx_id = rollup_ledger(options["chunk_size"], options["lag"], progress=self.progress)
+            self.stdout.write(self.style.SUCCESS(f"Rollups are up to date with ledger id {last_tx_id}"))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
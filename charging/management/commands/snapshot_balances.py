@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from charging.snapshots import snapshot_balances
+
+
+class Command(BaseCommand):
+    help = "Records every seller's balance at each UTC midnight since the last run"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lag", type=int, default=settings.LEDGER_ROLLUP_LAG,
+                            help="Seconds a midnight must have settled before it is snapshotted")
+        parser.add_argument("--loop", action="store_true", help="Keep snapshotting every --interval seconds")
+        parser.add_argument("--interval", type=float, default=600)
+
+    def progress(self, as_of, count):
+        self.stdout.write(f"Snapshotted {count} sellers as of {as_of:%Y-%m-%d %H:%M}")
+
+    def handle(self, *args, **options):
+        while True:
+            times = snapshot_balances(options["lag"], progress=self.progress)
+            self.stdout.write(self.style.SUCCESS(f"Balance snapshots are up to date, {len(times)} taken"))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
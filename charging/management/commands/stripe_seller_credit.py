@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from charging.models import Seller
+from charging.services import enable_credit_striping, disable_credit_striping
+
+
+class Command(BaseCommand):
+    help = "Splits a seller's credit across bucket rows so its charges stop contending on one row lock"
+
+    def add_arguments(self, parser):
+        parser.add_argument("seller_id", type=int)
+        parser.add_argument("--stripes", type=int, default=8, help="Number of credit buckets")
+        parser.add_argument("--disable", action="store_true", help="Collapse the buckets back into Seller.credit")
+
+    def handle(self, *args, **options):
+        seller_id = options["seller_id"]
+        try:
+            if options["disable"]:
+                disable_credit_striping(seller_id)
+                self.stdout.write(self.style.SUCCESS(f"Credit of seller {seller_id} is no longer striped"))
+            else:
+                if options["stripes"] < 2:
+                    raise CommandError("--stripes must be at least 2")
+                enable_credit_striping(seller_id, options["stripes"])
+                self.stdout.write(self.style.SUCCESS(
+                    f"Credit of seller {seller_id} is striped across {options['stripes']} buckets"))
+        except Seller.DoesNotExist:
+            raise CommandError(f"Seller {seller_id} does not exist")
+        except ValueError as e:
+            raise CommandError(str(e))
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charging', '0004_remove_creditrequest_approved_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='creditrequest',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='creditrequest',
+            constraint=models.UniqueConstraint(fields=('seller', 'idempotency_key'), name='charging_creditrequest_unique_idempotency_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.UniqueConstraint(fields=('seller', 'idempotency_key'), name='charging_transaction_unique_idempotency_key'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charging', '0005_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seller',
+            name='credit_stripes',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='SellerCreditBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('credit', models.PositiveIntegerField(default=0, editable=False)),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credit_buckets', to='charging.seller')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='sellercreditbucket',
+            constraint=models.UniqueConstraint(fields=('seller', 'index'), name='charging_sellercreditbucket_unique_index'),
+        ),
+    ]
@@ -0,0 +1,136 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:20
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+MONTHS_AHEAD = 2
+
+
+def add_months(month, count):
+    month_index = month.month - 1 + count
+    return month.replace(year=month.year + month_index // 12, month=month_index % 12 + 1)
+
+
+def partition_ledger(apps, schema_editor):
+    """
+    Recreates charging_transaction as a table range partitioned by month on timestamp
+    and copies the existing ledger into it. Partitioned tables can't have identity
+    columns and their primary key must include the partition key, so id gets a plain
+    sequence and the primary key becomes (id, timestamp).
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("ALTER TABLE charging_transaction RENAME TO charging_transaction_unpartitioned")
+        cursor.execute("ALTER TABLE charging_transaction_unpartitioned ALTER COLUMN id DROP IDENTITY IF EXISTS")
+        cursor.execute("CREATE SEQUENCE charging_transaction_id_seq")
+        cursor.execute("""
+            CREATE TABLE charging_transaction (
+                id bigint NOT NULL DEFAULT nextval('charging_transaction_id_seq'),
+                phone varchar(11) NULL,
+                transaction_type varchar(1) NOT NULL,
+                amount integer NOT NULL CONSTRAINT charging_transaction_amount_check CHECK (amount >= 0),
+                timestamp timestamp with time zone NOT NULL,
+                idempotency_key varchar(64) NULL,
+                seller_id bigint NOT NULL
+                    CONSTRAINT charging_transaction_seller_id_e1030555_fk_charging_seller_id
+                    REFERENCES charging_seller (id) DEFERRABLE INITIALLY DEFERRED,
+                CONSTRAINT charging_transaction_pkey PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+        """)
+        cursor.execute("ALTER SEQUENCE charging_transaction_id_seq OWNED BY charging_transaction.id")
+        cursor.execute("CREATE TABLE charging_transaction_default PARTITION OF charging_transaction DEFAULT")
+
+        cursor.execute("SELECT MIN(timestamp) FROM charging_transaction_unpartitioned")
+        oldest = cursor.fetchone()[0]
+        now = datetime.datetime.now(datetime.timezone.utc)
+        month = datetime.datetime((oldest or now).year, (oldest or now).month, 1, tzinfo=datetime.timezone.utc)
+        last_month = add_months(datetime.datetime(now.year, now.month, 1, tzinfo=datetime.timezone.utc), MONTHS_AHEAD)
+        while month <= last_month:
+            cursor.execute(f"""
+                CREATE TABLE charging_transaction_y{month.year:04d}m{month.month:02d}
+                PARTITION OF charging_transaction FOR VALUES FROM (%s) TO (%s)
+            """, [month, add_months(month, 1)])
+            month = add_months(month, 1)
+
+        cursor.execute("""
+            INSERT INTO charging_transaction (id, phone, transaction_type, amount, timestamp, idempotency_key, seller_id)
+            SELECT id, phone, transaction_type, amount, timestamp, idempotency_key, seller_id
+            FROM charging_transaction_unpartitioned
+        """)
+        cursor.execute("""
+            INSERT INTO charging_transactionidempotencykey (seller_id, idempotency_key, transaction_id, created_at)
+            SELECT seller_id, idempotency_key, MIN(id), MIN(timestamp)
+            FROM charging_transaction
+            WHERE idempotency_key IS NOT NULL
+            GROUP BY seller_id, idempotency_key
+        """)
+        cursor.execute("""
+            SELECT setval('charging_transaction_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM charging_transaction
+        """)
+        cursor.execute("DROP TABLE charging_transaction_unpartitioned")
+        cursor.execute("CREATE INDEX charging_transaction_seller_id_e1030555 ON charging_transaction (seller_id)")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('charging', '0006_seller_credit_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionIdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotency_key', models.CharField(editable=False, max_length=64)),
+                ('transaction_id', models.BigIntegerField(editable=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('seller', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='charging.seller')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='transactionidempotencykey',
+            constraint=models.UniqueConstraint(fields=('seller', 'idempotency_key'), name='charging_transactionidempotencykey_unique'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='transaction',
+            name='charging_transaction_unique_idempotency_key',
+        ),
+        migrations.RunPython(partition_ledger),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('idempotency_key__isnull', False)), fields=['seller', 'idempotency_key'], name='charging_transaction_idem_key'),
+        ),
+        migrations.RunSQL(
+            sql="""
+                CREATE FUNCTION charging_transaction_claim_idempotency_key() RETURNS trigger AS $$
+                DECLARE
+                    claimed integer;
+                BEGIN
+                    IF NEW.idempotency_key IS NOT NULL THEN
+                        -- A row moved to another partition is inserted again, its own claim is kept
+                        INSERT INTO charging_transactionidempotencykey (seller_id, idempotency_key, transaction_id, created_at)
+                        VALUES (NEW.seller_id, NEW.idempotency_key, NEW.id, now())
+                        ON CONFLICT (seller_id, idempotency_key) DO UPDATE SET transaction_id = EXCLUDED.transaction_id
+                        WHERE charging_transactionidempotencykey.transaction_id = EXCLUDED.transaction_id;
+                        GET DIAGNOSTICS claimed = ROW_COUNT;
+                        IF claimed = 0 THEN
+                            RAISE unique_violation USING
+                                MESSAGE = format('duplicate idempotency key %s of seller %s', NEW.idempotency_key, NEW.seller_id),
+                                CONSTRAINT = 'charging_transactionidempotencykey_unique';
+                        END IF;
+                    END IF;
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql;
+
+                CREATE TRIGGER charging_transaction_claim_idempotency_key
+                BEFORE INSERT ON charging_transaction
+                FOR EACH ROW EXECUTE FUNCTION charging_transaction_claim_idempotency_key();
+            """,
+            reverse_sql="""
+                DROP TRIGGER charging_transaction_claim_idempotency_key ON charging_transaction;
+                DROP FUNCTION charging_transaction_claim_idempotency_key();
+            """,
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charging', '0007_partition_transaction'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['seller', '-timestamp', '-id'], include=('phone', 'amount', 'transaction_type'), name='charging_transaction_history'),
+        ),
+    ]
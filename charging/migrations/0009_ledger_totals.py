@@ -0,0 +1,73 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charging', '0008_transaction_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seller',
+            name='last_tx_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='total_deposit',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='total_sell',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='tx_count',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='sellercreditbucket',
+            name='last_tx_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='sellercreditbucket',
+            name='total_deposit',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='sellercreditbucket',
+            name='total_sell',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='sellercreditbucket',
+            name='tx_count',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE charging_seller
+                SET total_deposit = totals.total_deposit,
+                    total_sell = totals.total_sell,
+                    tx_count = totals.tx_count,
+                    last_tx_id = totals.last_tx_id
+                FROM (
+                    SELECT seller_id,
+                           COALESCE(SUM(amount) FILTER (WHERE transaction_type = 'C'), 0) AS total_deposit,
+                           COALESCE(SUM(amount) FILTER (WHERE transaction_type = 'S'), 0) AS total_sell,
+                           COUNT(*) AS tx_count,
+                           MAX(id) AS last_tx_id
+                    FROM charging_transaction
+                    GROUP BY seller_id
+                ) totals
+                WHERE charging_seller.id = totals.seller_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
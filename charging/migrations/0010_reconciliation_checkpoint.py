@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charging', '0009_ledger_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_tx_id', models.BigIntegerField(editable=False)),
+                ('balance', models.BigIntegerField(editable=False)),
+                ('total_deposit', models.PositiveBigIntegerField(editable=False)),
+                ('total_sell', models.PositiveBigIntegerField(editable=False)),
+                ('tx_count', models.PositiveBigIntegerField(editable=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reconciliation_checkpoints', to='charging.seller')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['seller', '-last_tx_id'], name='charging_checkpoint_latest')],
+            },
+        ),
+    ]
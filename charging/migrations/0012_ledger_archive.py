@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charging', '0011_daily_seller_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('row_count', models.PositiveIntegerField()),
+                ('first_tx_id', models.BigIntegerField()),
+                ('last_tx_id', models.BigIntegerField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_archives', to='charging.seller')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['seller', '-last_timestamp'], name='charging_ledgerarchive_recent')],
+            },
+        ),
+    ]
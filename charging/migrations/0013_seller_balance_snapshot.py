@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charging', '0012_ledger_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField()),
+                ('balance', models.BigIntegerField()),
+                ('tx_count', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='charging.seller')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='sellerbalancesnapshot',
+            constraint=models.UniqueConstraint(fields=('seller', 'as_of'), include=('balance',), name='charging_sellerbalancesnapshot_unique'),
+        ),
+    ]
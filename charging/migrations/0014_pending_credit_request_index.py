@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charging', '0013_seller_balance_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='creditrequest',
+            index=models.Index(condition=models.Q(('is_processed', False)), fields=['created_at', 'id'], name='charging_creditrequest_pending'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charging', '0014_pending_credit_request_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='creditrequest',
+            name='charging_creditrequest_pending',
+        ),
+        migrations.AddField(
+            model_name='creditrequest',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='creditrequest',
+            index=models.Index(condition=models.Q(('is_processed', False), ('queued_at__isnull', True)), fields=['created_at', 'id'], name='charging_creditrequest_pending'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charging', '0015_credit_request_queue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='creditrequest',
+            name='status',
+            field=models.CharField(choices=[('P', 'Pending'), ('A', 'Approved'), ('R', 'Rejected')], default='P', max_length=10),
+        ),
+        # Requests used to be created with the literal default 'pending' instead of the 'P' choice
+        migrations.RunSQL(
+            sql="UPDATE charging_creditrequest SET status = 'P' WHERE status = 'pending'",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
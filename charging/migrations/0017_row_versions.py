@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charging', '0016_credit_request_pending_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='creditrequest',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            sql="""
+                CREATE FUNCTION charging_bump_version() RETURNS trigger AS $$
+                BEGIN
+                    -- Whichever path updates the row, a compare-and-swap on the version it read misses
+                    NEW.version := OLD.version + 1;
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql;
+
+                CREATE TRIGGER charging_seller_bump_version
+                BEFORE UPDATE ON charging_seller
+                FOR EACH ROW EXECUTE FUNCTION charging_bump_version();
+
+                CREATE TRIGGER charging_creditrequest_bump_version
+                BEFORE UPDATE ON charging_creditrequest
+                FOR EACH ROW EXECUTE FUNCTION charging_bump_version();
+            """,
+            reverse_sql="""
+                DROP TRIGGER charging_creditrequest_bump_version ON charging_creditrequest;
+                DROP TRIGGER charging_seller_bump_version ON charging_seller;
+                DROP FUNCTION charging_bump_version();
+            """,
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charging', '0017_row_versions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='creditrequest',
+            index=models.Index(condition=models.Q(('is_processed', False), ('queued_at__isnull', False)), fields=['queued_at'], name='charging_creditrequest_queued'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.core.exceptions import ValidationError
 from django.db import models, transaction
+from django.db.models.functions import Greatest
 from django.utils import timezone
 
 from accounts.models import User
@@ -7,17 +8,79 @@ from accounts.models import User
 # Create your models here.
 
 
-class Seller(models.Model):
+class LedgerTotals(models.Model):
+    """
+    Running totals of the ledger rows written against a row, updated in the same
+    database transaction as the ledger insert (see ledger_totals_update).
+    """
+    total_deposit = models.PositiveBigIntegerField(default=0, editable=False)
+    total_sell = models.PositiveBigIntegerField(default=0, editable=False)
+    tx_count = models.PositiveBigIntegerField(default=0, editable=False)
+    last_tx_id = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+
+class Seller(LedgerTotals):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     credit = models.PositiveIntegerField(default=0, editable=False) #Todo: Decimal
+    credit_stripes = models.PositiveSmallIntegerField(default=0, editable=False)
+    # Bumped by a trigger on every update, see charging.retry
+    version = models.PositiveBigIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Seller: {self.user.national_id} - Balance: {self.credit}"
 
+    @property
+    def balance(self):
+        if not self.credit_stripes:
+            return self.credit
+        return self.credit + (self.credit_buckets.aggregate(total=models.Sum("credit"))["total"] or 0)
+
+    def ledger_totals(self):
+        """The seller's running ledger totals, including the ones kept on its credit buckets"""
+        totals = {
+            "credit": self.credit,
+            "total_deposit": self.total_deposit,
+            "total_sell": self.total_sell,
+            "tx_count": self.tx_count,
+            "last_tx_id": self.last_tx_id,
+        }
+        if self.credit_stripes:
+            buckets = self.credit_buckets.aggregate(credit=models.Sum("credit"),
+                                                    total_deposit=models.Sum("total_deposit"),
+                                                    total_sell=models.Sum("total_sell"),
+                                                    tx_count=models.Sum("tx_count"),
+                                                    last_tx_id=models.Max("last_tx_id"))
+            for name in ("credit", "total_deposit", "total_sell", "tx_count"):
+                totals[name] += buckets[name] or 0
+            totals["last_tx_id"] = max(filter(None, (totals["last_tx_id"], buckets["last_tx_id"])), default=None)
+        return totals
+
+
+class SellerCreditBucket(LedgerTotals):
+    """One stripe of a striped seller's credit, see services.enable_credit_striping"""
+    seller = models.ForeignKey(Seller, on_delete=models.CASCADE, related_name='credit_buckets')
+    index = models.PositiveSmallIntegerField()
+    credit = models.PositiveIntegerField(default=0, editable=False) #Todo: Decimal
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=("seller", "index"), name="charging_sellercreditbucket_unique_index"),
+        ]
+
+    def __str__(self):
+        return f"{self.seller} - Bucket {self.index}: {self.credit}"
+
 
 class Transaction(models.Model):
+    """
+    The ledger, range partitioned by month on timestamp (see charging.partitions). The
+    table's primary key is (id, timestamp), so no foreign key may point to it.
+    """
     DEPOSIT = 'C'
     SELLING = 'S'
 
@@ -31,16 +94,162 @@ class Transaction(models.Model):
     transaction_type = models.CharField(max_length=1, choices=TRANSACTION_CHOICES, editable=False)
     amount = models.PositiveIntegerField() #Todo: Decimal
     timestamp = models.DateTimeField(auto_now_add=True, editable=False)
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=("seller", "-timestamp", "-id"), include=("phone", "amount", "transaction_type"),
+                         name="charging_transaction_history"),
+            models.Index(fields=("seller", "idempotency_key"), name="charging_transaction_idem_key",
+                         condition=models.Q(idempotency_key__isnull=False)),
+        ]
 
     def __str__(self):
         return f"{self.get_transaction_type_display()} by {self.seller}"
 
 
+def ledger_totals_update(ledger):
+    """
+    Update kwargs adding ledger rows, already inserted, to the running totals of the
+    Seller or SellerCreditBucket row they were written against.
+    """
+    deposit = sum(row.amount for row in ledger if row.transaction_type == Transaction.DEPOSIT)
+    sell = sum(row.amount for row in ledger if row.transaction_type == Transaction.SELLING)
+    return {
+        "total_deposit": models.F("total_deposit") + deposit,
+        "total_sell": models.F("total_sell") + sell,
+        "tx_count": models.F("tx_count") + len(ledger),
+        # Postgres' GREATEST ignores nulls, so the first row of a seller sets it
+        "last_tx_id": Greatest(models.F("last_tx_id"), models.Value(max(row.id for row in ledger)),
+                               output_field=models.BigIntegerField()),
+    }
+
+
+class TransactionIdempotencyKey(models.Model):
+    """
+    Unique constraints of a partitioned table must include its partition key, so a
+    trigger on the ledger claims every idempotency key here; a second transaction with
+    the same key of the same seller raises an IntegrityError as before.
+    """
+    seller = models.ForeignKey(Seller, on_delete=models.CASCADE, editable=False)
+    idempotency_key = models.CharField(max_length=64, editable=False)
+    transaction_id = models.BigIntegerField(editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=("seller", "idempotency_key"),
+                                    name="charging_transactionidempotencykey_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.seller} - {self.idempotency_key}"
+
+
+class ReconciliationCheckpoint(models.Model):
+    """
+    A seller's balance and ledger totals verified against the ledger up to and
+    including last_tx_id, see charging.reconciliation.
+    """
+    seller = models.ForeignKey(Seller, on_delete=models.CASCADE, related_name='reconciliation_checkpoints')
+    last_tx_id = models.BigIntegerField(editable=False)
+    balance = models.BigIntegerField(editable=False)
+    total_deposit = models.PositiveBigIntegerField(editable=False)
+    total_sell = models.PositiveBigIntegerField(editable=False)
+    tx_count = models.PositiveBigIntegerField(editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=("seller", "-last_tx_id"), name="charging_checkpoint_latest"),
+        ]
+
+    def __str__(self):
+        return f"{self.seller} - Verified up to {self.last_tx_id}"
+
+
+class DailySellerRollup(models.Model):
+    """Sum and count of a seller's ledger rows of one type on one UTC day, see charging.rollups"""
+    seller = models.ForeignKey(Seller, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    transaction_type = models.CharField(max_length=1, choices=Transaction.TRANSACTION_CHOICES)
+    amount_sum = models.PositiveBigIntegerField(default=0)
+    tx_count = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=("seller", "day", "transaction_type"),
+                                    name="charging_dailysellerrollup_unique_day"),
+        ]
+
+    def __str__(self):
+        return f"{self.seller} - {self.day} {self.get_transaction_type_display()}: {self.amount_sum}"
+
+
+class RollupWatermark(models.Model):
+    """The last ledger id a rollup job has processed"""
+    name = models.CharField(max_length=64, unique=True)
+    last_tx_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_tx_id}"
+
+
+class LedgerArchive(models.Model):
+    """
+    Manifest entry of one archived part of a seller's ledger month, a zstd compressed
+    NDJSON file in the archive storage; see charging.archive.
+    """
+    seller = models.ForeignKey(Seller, on_delete=models.CASCADE, related_name='ledger_archives')
+    month = models.DateField()
+    path = models.CharField(max_length=255, unique=True)
+    row_count = models.PositiveIntegerField()
+    first_tx_id = models.BigIntegerField()
+    last_tx_id = models.BigIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=("seller", "-last_timestamp"), name="charging_ledgerarchive_recent"),
+        ]
+
+    def __str__(self):
+        return f"{self.seller} - {self.month:%Y-%m}: {self.row_count} rows"
+
+
+class SellerBalanceSnapshot(models.Model):
+    """
+    A seller's ledger balance and row count over its ledger rows older than as_of, a
+    UTC midnight; see charging.snapshots.
+    """
+    seller = models.ForeignKey(Seller, on_delete=models.CASCADE, related_name='balance_snapshots')
+    as_of = models.DateTimeField()
+    balance = models.BigIntegerField()
+    tx_count = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # The nearest snapshot before a moment is a backward scan of this index, with the balance read from it
+            models.UniqueConstraint(fields=("seller", "as_of"), include=("balance",),
+                                    name="charging_sellerbalancesnapshot_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.seller} - {self.balance} as of {self.as_of}"
+
+
 class CreditRequest(models.Model):
     PENDING = "P"
     APPROVED = "A"
     REJECT = "R"
 
+    MAX_AMOUNT = 2147483647  # of the amount column, requests merged up to it
+
     STATUS_CHOICES = [
         (PENDING, 'Pending'),
         (APPROVED, 'Approved'),
@@ -49,16 +258,40 @@ class CreditRequest(models.Model):
 
     seller = models.ForeignKey(Seller, on_delete=models.CASCADE, related_name='credit_requests')
     amount = models.PositiveIntegerField(default=0) #Todo: Decimal
-    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
     admin_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
                                    related_name='approved_requests')
     created_at = models.DateTimeField(auto_now_add=True)
     change_status_at = models.DateTimeField(null=True, blank=True)
     is_processed = models.BooleanField(default=False)
+    queued_at = models.DateTimeField(null=True, blank=True, editable=False)
+    version = models.PositiveBigIntegerField(default=0, editable=False)
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=("seller", "idempotency_key"),
+                                    name="charging_creditrequest_unique_idempotency_key"),
+        ]
+        indexes = [
+            # The admin queue of pending requests, oldest first; queued and processed ones never enter the index
+            models.Index(fields=("created_at", "id"), condition=models.Q(is_processed=False, queued_at__isnull=True),
+                         name="charging_creditrequest_pending"),
+            # Queued actions not applied yet, swept when their message got lost
+            models.Index(fields=("queued_at",), condition=models.Q(is_processed=False, queued_at__isnull=False),
+                         name="charging_creditrequest_queued"),
+        ]
 
     def __str__(self):
         return f"{self.seller.user.national_id} - {self.amount}"
 
+    @property
+    def state(self):
+        """pending, queued for the deposit workers, or the applied approved or rejected"""
+        if self.is_processed:
+            return "approved" if self.status == self.APPROVED else "rejected"
+        return "queued" if self.queued_at else "pending"
+
 
 class PhoneNumber(models.Model):
     phone_number = models.CharField(max_length=11, unique=True)
@@ -0,0 +1,113 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination seeking past the last row of the previous page on the whole
+    ordering, so every page is an index range scan of page_size rows and no count
+    query runs. The ordering must be unique, end it with the primary key.
+    """
+    ordering = ("-timestamp", "-id")
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.fields = [(field.lstrip("-"), field.startswith("-")) for field in self.ordering]
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        cursor_values = None
+        if cursor:
+            cursor_values = self.decode_cursor(cursor, queryset.model)
+            queryset = queryset.filter(self.seek_filter(cursor_values))
+
+        rows = list(queryset[:self.page_size + 1])
+        # Views may add rows living outside the queryset, like archived ones, that belong on the page
+        get_extra_page_rows = getattr(view, "get_extra_page_rows", None)
+        if get_extra_page_rows:
+            rows = self.sort_rows(rows + get_extra_page_rows(cursor_values, rows, self.page_size + 1))
+            rows = rows[:self.page_size + 1]
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def sort_rows(self, rows):
+        for name, descending in reversed(self.fields):
+            rows = sorted(rows, key=lambda row: getattr(row, name), reverse=descending)
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def seek_filter(self, values):
+        """
+        Rows after the cursor in (a, b, ...) order: a past the cursor, or a equal and
+        b past it, and so on. The leading bound on a alone lets the planner use the
+        index range, and prune partitions when a is the partition key.
+        """
+        (first_name, first_descending), first_value = self.fields[0], values[0]
+        seek = Q()
+        for position, ((name, descending), value) in enumerate(zip(self.fields, values)):
+            condition = Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+            for (prior_name, _), prior_value in zip(self.fields[:position], values[:position]):
+                condition &= Q(**{prior_name: prior_value})
+            seek |= condition
+        return Q(**{f"{first_name}__{'lte' if first_descending else 'gte'}": first_value}) & seek
+
+    def encode_cursor(self, row):
+        # isoformat keeps the microseconds DjangoJSONEncoder would drop, ties would be skipped without them
+        values = [getattr(row, name) for name, _ in self.fields]
+        return base64.urlsafe_b64encode(json.dumps(values, default=lambda value: value.isoformat()).encode()).decode()
+
+    def decode_cursor(self, cursor, model):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [model._meta.get_field(name).to_python(value) for (name, _), value in zip(self.fields, values)]
+        except (TypeError, ValueError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class PendingCreditRequestPagination(KeysetPagination):
+    ordering = ("created_at", "id")
@@ -0,0 +1,90 @@
+"""
+Monthly range partitions of the Transaction ledger.
+
+charging_transaction is partitioned by timestamp, one partition per month named
+charging_transaction_yYYYYmMM, plus a default partition catching rows no monthly
+partition covers. Monthly partitions are created ahead of time by the
+manage_ledger_partitions command; rows that landed in the default partition are moved
+into a month's partition when it is created.
+"""
+import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from charging.models import Transaction
+
+PARENT_TABLE = Transaction._meta.db_table
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+
+
+def month_start(value):
+    return datetime.datetime(value.year, value.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def add_months(month, count):
+    month_index = month.month - 1 + count
+    return month.replace(year=month.year + month_index // 12, month=month_index % 12 + 1)
+
+
+def partition_name(month):
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_month(name):
+    """The month a partition name covers, None for tables that are not monthly partitions"""
+    prefix = f"{PARENT_TABLE}_y"
+    if not name.startswith(prefix):
+        return None
+    try:
+        year, month = name[len(prefix):].split("m")
+        return datetime.datetime(int(year), int(month), 1, tzinfo=datetime.timezone.utc)
+    except ValueError:
+        return None
+
+
+def list_partitions():
+    """Names of the monthly partitions currently attached to the ledger, oldest first"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+        """, [PARENT_TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+    return sorted(name for name in names if partition_month(name))
+
+
+def create_partition(month):
+    """
+    Creates the partition of the given month unless it exists. Rows of that month
+    sitting in the default partition are moved into it before it is attached.
+    Returns whether a partition was created.
+    """
+    month = month_start(month)
+    name = partition_name(month)
+    if name in list_partitions():
+        return False
+
+    bounds = [month, add_months(month, 1)]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {DEFAULT_PARTITION} IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= %s AND timestamp < %s RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """, bounds)
+        cursor.execute(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", bounds)
+    return True
+
+
+def create_upcoming_partitions(months_ahead, now=None):
+    """Makes sure the current month and the next months_ahead months have a partition"""
+    current_month = month_start(now or timezone.now())
+    return [partition_name(add_months(current_month, offset))
+            for offset in range(months_ahead + 1)
+            if create_partition(add_months(current_month, offset))]
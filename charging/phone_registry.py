@@ -0,0 +1,91 @@
+"""
+Registry of the phone numbers charges were sold to.
+
+Numbers are inserted with INSERT ... ON CONFLICT DO NOTHING, outside the seller's
+balance transaction; a failed insert is logged, never raised to the charge that
+already committed. Registered numbers are remembered in a bounded per-process LRU
+so repeat customers cost no query at all.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from charging.models import PhoneNumber
+
+logger = logging.getLogger('elastic_logger')
+
+
+class PhoneNumberRegistry:
+    def __init__(self, max_size, stats_interval):
+        self.max_size = max_size
+        self.stats_interval = stats_interval
+        self.lock = threading.Lock()
+        self.known = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, phone_numbers):
+        unknown = []
+        with self.lock:
+            # Sorted, concurrent inserts of overlapping numbers take their row locks in the same order
+            for phone_number in sorted(set(phone_numbers)):
+                if phone_number in self.known:
+                    self.known.move_to_end(phone_number)
+                    self.hits += 1
+                else:
+                    unknown.append(phone_number)
+                    self.misses += 1
+            lookups = self.hits + self.misses
+
+        if unknown:
+            # Runs after the charge committed, outside any transaction; a failure here must not
+            # look like a failed charge
+            try:
+                PhoneNumber.objects.bulk_create(
+                    [PhoneNumber(phone_number=phone_number) for phone_number in unknown],
+                    ignore_conflicts=True,
+                )
+            except DatabaseError as e:
+                logger.error(f"Phone numbers could not be registered: {e}")
+            else:
+                transaction.on_commit(lambda: self.remember(unknown))
+
+        if self.stats_interval and lookups % self.stats_interval == 0:
+            logger.info("phone_number_registry", extra=self.stats())
+
+    def remember(self, phone_numbers):
+        with self.lock:
+            for phone_number in phone_numbers:
+                self.known[phone_number] = None
+                self.known.move_to_end(phone_number)
+            while len(self.known) > self.max_size:
+                self.known.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.known.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self.known),
+            }
+
+
+phone_number_registry = PhoneNumberRegistry(
+    max_size=settings.PHONE_REGISTRY_CACHE_SIZE,
+    stats_interval=settings.PHONE_REGISTRY_STATS_INTERVAL,
+)
+
+
+def register_phone_numbers(phone_numbers):
+    phone_number_registry.register(phone_numbers)
@@ -0,0 +1,183 @@
+"""
+Checkpointed reconciliation of seller balances against the Transaction ledger.
+
+Every ledger path allocates a seller's ledger ids while holding its seller row or
+one of its credit buckets, so once reconcile_seller holds all of them every ledger
+id of the seller up to the current one is committed. Only the rows after the
+seller's latest ReconciliationCheckpoint are summed; a matching result becomes the
+next checkpoint, a mismatch reports the ledger ids after the last verified one.
+Without advancing nothing is locked; the seller, its buckets and the ledger are read
+from one snapshot, which sees every charge's ledger row and credit change together.
+"""
+from django.db import transaction, connection
+from django.db.models import Sum, Count, Min, Max, Q
+
+from charging.models import Seller, SellerCreditBucket, Transaction, ReconciliationCheckpoint
+
+
+def latest_checkpoint(seller_id):
+    return ReconciliationCheckpoint.objects.filter(seller_id=seller_id).order_by("-last_tx_id").first()
+
+
+def ledger_delta(seller_id, after_tx_id):
+    """Sums of the seller's ledger rows with ids after after_tx_id"""
+    delta = Transaction.objects.filter(seller_id=seller_id, id__gt=after_tx_id).aggregate(
+        deposit=Sum("amount", filter=Q(transaction_type=Transaction.DEPOSIT)),
+        sell=Sum("amount", filter=Q(transaction_type=Transaction.SELLING)),
+        tx_count=Count("id"),
+        first_tx_id=Min("id"),
+        last_tx_id=Max("id"),
+    )
+    delta["deposit"] = delta["deposit"] or 0
+    delta["sell"] = delta["sell"] or 0
+    return delta
+
+
+def reconcile_seller(seller_id, advance=True):
+    """
+    Verifies the seller's balance and running totals against its checkpoint plus the
+    ledger rows after it, and records a new checkpoint when they match and advance is
+    set. Returns a report dict; diverged_tx_ids is the (first, last) range of ledger
+    ids that could not be verified, (None, None) when the balance changed without
+    any ledger row after the checkpoint.
+    """
+    # Inside an outer transaction the isolation level is already set by its first query
+    snapshot = not advance and not connection.in_atomic_block
+    with transaction.atomic():
+        if snapshot:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        sellers = Seller.objects.select_for_update() if advance else Seller.objects
+        seller = sellers.get(id=seller_id)
+        buckets = []
+        if seller.credit_stripes:
+            seller_buckets = SellerCreditBucket.objects.select_for_update() if advance else SellerCreditBucket.objects
+            buckets = list(seller_buckets.filter(seller=seller).order_by("index"))
+
+        checkpoint = latest_checkpoint(seller_id)
+        verified = {
+            "last_tx_id": checkpoint.last_tx_id if checkpoint else 0,
+            "balance": checkpoint.balance if checkpoint else 0,
+            "total_deposit": checkpoint.total_deposit if checkpoint else 0,
+            "total_sell": checkpoint.total_sell if checkpoint else 0,
+            "tx_count": checkpoint.tx_count if checkpoint else 0,
+        }
+        delta = ledger_delta(seller_id, verified["last_tx_id"])
+
+        ledger = {
+            "balance": verified["balance"] + delta["deposit"] - delta["sell"],
+            "total_deposit": verified["total_deposit"] + delta["deposit"],
+            "total_sell": verified["total_sell"] + delta["sell"],
+            "tx_count": verified["tx_count"] + delta["tx_count"],
+        }
+        current = {
+            "balance": seller.credit + sum(bucket.credit for bucket in buckets),
+            "total_deposit": seller.total_deposit + sum(bucket.total_deposit for bucket in buckets),
+            "total_sell": seller.total_sell + sum(bucket.total_sell for bucket in buckets),
+            "tx_count": seller.tx_count + sum(bucket.tx_count for bucket in buckets),
+        }
+
+        balance_matches = ledger["balance"] == current["balance"]
+        totals_match = ledger == current
+        if advance and totals_match and delta["tx_count"]:
+            ReconciliationCheckpoint.objects.create(seller=seller, last_tx_id=delta["last_tx_id"], **ledger)
+
+    return {
+        "seller_id": seller_id,
+        "equal": balance_matches,
+        "totals_match": totals_match,
+        "checkpoint_tx_id": verified["last_tx_id"],
+        "summed_rows": delta["tx_count"],
+        "ledger": ledger,
+        "current": current,
+        "diverged_tx_ids": None if totals_match else (delta["first_tx_id"], delta["last_tx_id"]),
+    }
+
+
+RANGE_RECONCILIATION_SQL = f"""
+    WITH checkpoints AS (
+        SELECT DISTINCT ON (seller_id) seller_id, last_tx_id, balance, total_deposit, total_sell, tx_count
+        FROM {ReconciliationCheckpoint._meta.db_table}
+        WHERE seller_id BETWEEN %(first_id)s AND %(last_id)s
+        ORDER BY seller_id, last_tx_id DESC
+    ), delta AS (
+        SELECT ledger.seller_id,
+               COALESCE(SUM(ledger.amount) FILTER (WHERE ledger.transaction_type = %(deposit)s), 0) AS deposit,
+               COALESCE(SUM(ledger.amount) FILTER (WHERE ledger.transaction_type = %(selling)s), 0) AS sell,
+               COUNT(*) AS tx_count,
+               MIN(ledger.id) AS first_tx_id,
+               MAX(ledger.id) AS last_tx_id
+        FROM {Transaction._meta.db_table} ledger
+        LEFT JOIN checkpoints ON checkpoints.seller_id = ledger.seller_id
+        WHERE ledger.seller_id BETWEEN %(first_id)s AND %(last_id)s
+          AND ledger.id > COALESCE(checkpoints.last_tx_id, 0)
+        GROUP BY ledger.seller_id
+    ), buckets AS (
+        SELECT seller_id, SUM(credit) AS credit, SUM(total_deposit) AS total_deposit,
+               SUM(total_sell) AS total_sell, SUM(tx_count) AS tx_count
+        FROM {SellerCreditBucket._meta.db_table}
+        WHERE seller_id BETWEEN %(first_id)s AND %(last_id)s
+        GROUP BY seller_id
+    )
+    SELECT seller.id,
+           seller.credit_stripes,
+           COALESCE(checkpoints.last_tx_id, 0),
+           COALESCE(checkpoints.balance, 0) + COALESCE(delta.deposit, 0) - COALESCE(delta.sell, 0),
+           COALESCE(checkpoints.total_deposit, 0) + COALESCE(delta.deposit, 0),
+           COALESCE(checkpoints.total_sell, 0) + COALESCE(delta.sell, 0),
+           COALESCE(checkpoints.tx_count, 0) + COALESCE(delta.tx_count, 0),
+           seller.credit + COALESCE(buckets.credit, 0),
+           seller.total_deposit + COALESCE(buckets.total_deposit, 0),
+           seller.total_sell + COALESCE(buckets.total_sell, 0),
+           seller.tx_count + COALESCE(buckets.tx_count, 0),
+           COALESCE(delta.tx_count, 0),
+           delta.first_tx_id,
+           delta.last_tx_id
+    FROM {Seller._meta.db_table} seller
+    LEFT JOIN checkpoints ON checkpoints.seller_id = seller.id
+    LEFT JOIN delta ON delta.seller_id = seller.id
+    LEFT JOIN buckets ON buckets.seller_id = seller.id
+    WHERE seller.id BETWEEN %(first_id)s AND %(last_id)s
+"""
+
+
+def reconcile_seller_range(first_id, last_id, advance=False):
+    """
+    Reconciles every seller with an id in [first_id, last_id] in one statement, whose
+    snapshot keeps sellers and ledger consistent without locking anything. Returns the
+    counts and the mismatch reports of the range. With advance, matching sellers get
+    a new checkpoint; not striped ones only, since concurrent charges on different
+    buckets may commit their ledger ids out of order.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(RANGE_RECONCILIATION_SQL, {
+            "first_id": first_id,
+            "last_id": last_id,
+            "deposit": Transaction.DEPOSIT,
+            "selling": Transaction.SELLING,
+        })
+        rows = cursor.fetchall()
+
+    mismatches = []
+    checkpoints = []
+    summed_rows = 0
+    for (seller_id, credit_stripes, checkpoint_tx_id, *totals, delta_count, first_tx_id, last_tx_id) in rows:
+        ledger = dict(zip(("balance", "total_deposit", "total_sell", "tx_count"), totals[:4]))
+        current = dict(zip(("balance", "total_deposit", "total_sell", "tx_count"), totals[4:]))
+        summed_rows += delta_count
+        if ledger != current:
+            mismatches.append({
+                "seller_id": seller_id,
+                "equal": ledger["balance"] == current["balance"],
+                "checkpoint_tx_id": checkpoint_tx_id,
+                "ledger": ledger,
+                "current": current,
+                "diverged_tx_ids": (first_tx_id, last_tx_id),
+            })
+        elif advance and delta_count and not credit_stripes:
+            checkpoints.append(ReconciliationCheckpoint(seller_id=seller_id, last_tx_id=last_tx_id, **ledger))
+
+    if checkpoints:
+        ReconciliationCheckpoint.objects.bulk_create(checkpoints)
+
+    return {"sellers": len(rows), "summed_rows": summed_rows, "mismatches": mismatches}
@@ -0,0 +1,287 @@
+"""
+Redis-reserved credit with write-behind to Postgres.
+
+Each seller has a credit mirror in the 'credit' cache. A charge atomically checks and
+decrements the mirror and appends a reservation to the journal list; flush_reservations
+later drains the journal into Seller.credit and the Transaction ledger in batches.
+Entries being flushed are kept in a processing list, so a crashed flusher's batch is
+retried on the next run; reservations already in the ledger are skipped by their key.
+An entry the ledger refuses is moved to a failed list and keeps holding its credit
+until flush_credit_reservations --retry-failed or --refund-failed resolves it.
+
+A deposit doesn't add to the mirror, it drops it while holding the seller lock; the
+next reservation reloads it from Seller.credit under that lock, so a deposit
+transaction that rolls back or is retried can't count twice.
+
+The mirror keys must never be evicted (maxmemory-policy noeviction), reconcile them
+with the reconcile_credit_mirror command. Charges of other engines don't touch the
+mirrors, so clear them with reconcile_credit_mirror --clear when leaving this engine.
+"""
+import json
+import logging
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from charging.models import Seller, Transaction, ledger_totals_update
+from charging.phone_registry import register_phone_numbers
+
+logger = logging.getLogger('elastic_logger')
+
+JOURNAL_KEY = "credit_reservations"
+PROCESSING_KEY = "credit_reservations_processing"
+FAILED_KEY = "credit_reservations_failed"
+FLUSHER_LOCK_KEY = "credit_reservations_flusher"
+
+MIRROR_MISSING = -1
+INSUFFICIENT_CREDIT = -2
+DUPLICATE_RESERVATION = -3
+
+RESERVE_SCRIPT = """
+    if #KEYS == 3 and redis.call('EXISTS', KEYS[3]) == 1 then
+        return -3
+    end
+    local credit = redis.call('GET', KEYS[1])
+    if not credit then
+        return -1
+    end
+    credit = tonumber(credit)
+    local amount = tonumber(ARGV[1])
+    if credit < amount then
+        return -2
+    end
+    redis.call('DECRBY', KEYS[1], amount)
+    redis.call('RPUSH', KEYS[2], ARGV[2])
+    if #KEYS == 3 then
+        redis.call('SET', KEYS[3], 1, 'EX', ARGV[3])
+    end
+    return credit - amount
+"""
+
+SNAPSHOT_SCRIPT = """
+    local entries = redis.call('LRANGE', KEYS[2], 0, -1)
+    for i = 3, #KEYS do
+        for _, entry in ipairs(redis.call('LRANGE', KEYS[i], 0, -1)) do
+            table.insert(entries, entry)
+        end
+    end
+    return {redis.call('GET', KEYS[1]), entries}
+"""
+
+RETRY_FAILED_SCRIPT = """
+    local entries = redis.call('LRANGE', KEYS[1], 0, -1)
+    if #entries > 0 then
+        redis.call('RPUSH', KEYS[2], unpack(entries))
+        redis.call('DEL', KEYS[1])
+    end
+    return #entries
+"""
+
+RESET_MIRROR_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        redis.call('SET', KEYS[1], ARGV[2])
+        return 1
+    end
+    return 0
+"""
+
+CLAIM_BATCH_SCRIPT = """
+    local entries = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    if #entries > 0 then
+        redis.call('RPUSH', KEYS[2], unpack(entries))
+        redis.call('LTRIM', KEYS[1], #entries, -1)
+    end
+    return entries
+"""
+
+
+def get_redis_client():
+    return caches['credit'].client.get_client(write=True)
+
+
+def mirror_key(seller_id):
+    return f"seller_credit_{seller_id}"
+
+
+def reservation_marker_key(seller_id, idempotency_key):
+    return f"credit_reservation_{seller_id} || {idempotency_key}"
+
+
+def load_entries(raw_entries):
+    return [json.loads(raw_entry) for raw_entry in raw_entries]
+
+
+def pending_reservations(client, seller_id=None):
+    # All lists in one MULTI, a batch claimed or failed in between would be missed
+    pipe = client.pipeline()
+    for key in (PROCESSING_KEY, JOURNAL_KEY, FAILED_KEY):
+        pipe.lrange(key, 0, -1)
+    entries = load_entries([raw_entry for raw_entries in pipe.execute() for raw_entry in raw_entries])
+    if seller_id is not None:
+        entries = [entry for entry in entries if entry["seller_id"] == seller_id]
+    return entries
+
+
+def unflushed_reservations(client, seller_id=None):
+    """Pending reservations minus the ones a flusher committed but did not clear yet"""
+    return without_flushed(pending_reservations(client, seller_id))
+
+
+def without_flushed(entries):
+    flushed = set(Transaction.objects.filter(seller_id__in={entry["seller_id"] for entry in entries},
+                                             idempotency_key__in=[entry["key"] for entry in entries]).
+                  values_list("seller_id", "idempotency_key"))
+    return [entry for entry in entries if (entry["seller_id"], entry["key"]) not in flushed]
+
+
+def credit_mirror_snapshot(client, seller_id):
+    """
+    The seller's mirror, None when it isn't loaded, and its unflushed reservations,
+    read at one instant so no reservation is counted in one but not the other.
+    """
+    mirror, raw_entries = client.eval(SNAPSHOT_SCRIPT, 4, mirror_key(seller_id), PROCESSING_KEY, JOURNAL_KEY,
+                                      FAILED_KEY)
+    entries = [entry for entry in load_entries(raw_entries) if entry["seller_id"] == seller_id]
+    return (int(mirror) if mirror is not None else None), without_flushed(entries)
+
+
+def reset_credit_mirror(client, seller_id, mirror, credit):
+    """Sets the mirror to credit unless a reservation changed it from mirror meanwhile, returns whether it did"""
+    return bool(client.eval(RESET_MIRROR_SCRIPT, 1, mirror_key(seller_id), mirror, credit))
+
+
+def prime_credit_mirror(seller_id):
+    client = get_redis_client()
+    with transaction.atomic():
+        seller = Seller.objects.select_for_update().get(id=seller_id)
+        pending_amount = sum(entry["amount"] for entry in unflushed_reservations(client, seller_id))
+        client.set(mirror_key(seller_id), seller.credit - pending_amount, nx=True)
+
+
+def reserve_credit(seller_id, phone_number, amount, idempotency_key=None):
+    """Returns False when the seller's credit does not cover the amount"""
+    client = get_redis_client()
+    reservation = json.dumps({
+        "key": idempotency_key or f"rsv-{uuid4().hex}",
+        "seller_id": seller_id,
+        "phone": phone_number,
+        "amount": amount,
+    })
+    keys = [mirror_key(seller_id), JOURNAL_KEY]
+    if idempotency_key:
+        keys.append(reservation_marker_key(seller_id, idempotency_key))
+
+    for _ in range(2):
+        result = client.eval(RESERVE_SCRIPT, len(keys), *keys, amount, reservation, settings.IDEMPOTENCY_KEY_TTL)
+        if result != MIRROR_MISSING:
+            return result != INSUFFICIENT_CREDIT
+        prime_credit_mirror(seller_id)
+
+    raise ValueError(f"Credit mirror of seller {seller_id} could not be loaded")
+
+
+def invalidate_credit_mirror(seller_id):
+    """
+    Must run inside the transaction holding the seller lock, after the deposit is
+    written; prime_credit_mirror waits for that lock, so it reloads the mirror from
+    the committed credit, or from the old one when the transaction rolls back.
+    """
+    get_redis_client().delete(mirror_key(seller_id))
+
+
+def apply_reservations(entries):
+    """Writes one seller's reservations to the ledger; entries already in the ledger are skipped"""
+    seller_id = entries[0]["seller_id"]
+    with transaction.atomic():
+        seller = Seller.objects.select_for_update().get(id=seller_id)
+        flushed_keys = set(Transaction.objects.filter(seller=seller, idempotency_key__in=[e["key"] for e in entries]).
+                           values_list("idempotency_key", flat=True))
+        entries = [entry for entry in entries if entry["key"] not in flushed_keys]
+        if not entries:
+            return
+
+        ledger = Transaction.objects.bulk_create([
+            Transaction(
+                seller=seller,
+                amount=entry["amount"],
+                phone=entry["phone"],
+                transaction_type=Transaction.SELLING,
+                idempotency_key=entry["key"],
+            )
+            for entry in entries
+        ])
+        Seller.objects.filter(id=seller.id).update(credit=F("credit") - sum(entry["amount"] for entry in entries),
+                                                   **ledger_totals_update(ledger))
+
+    register_phone_numbers([entry["phone"] for entry in entries])
+
+
+def flush_reservations(batch_size):
+    """
+    Drains one batch of the journal into Postgres and returns its size. A batch left
+    in the processing list by a crashed flusher is retried before claiming a new one.
+    """
+    client = get_redis_client()
+    raw_entries = client.lrange(PROCESSING_KEY, 0, -1)
+    if not raw_entries:
+        raw_entries = client.eval(CLAIM_BATCH_SCRIPT, 2, JOURNAL_KEY, PROCESSING_KEY, batch_size)
+    if not raw_entries:
+        return 0
+
+    entries_by_seller = {}
+    for entry in load_entries(raw_entries):
+        entries_by_seller.setdefault(entry["seller_id"], []).append(entry)
+
+    failed = []
+    for seller_id in sorted(entries_by_seller):
+        entries = entries_by_seller[seller_id]
+        try:
+            apply_reservations(entries)
+        except IntegrityError:
+            # Applied one by one, so only the entries the ledger refuses fail
+            for entry in entries:
+                try:
+                    apply_reservations([entry])
+                except IntegrityError as e:
+                    failed.append((entry, e))
+        except Seller.DoesNotExist as e:
+            failed.extend((entry, e) for entry in entries)
+
+    pipe = client.pipeline()
+    for entry, e in failed:
+        logger.error(f"Credit reservation {entry['key']} of seller {entry['seller_id']} could not be flushed: {e}")
+        pipe.rpush(FAILED_KEY, json.dumps({**entry, "error": str(e), "failed_at": timezone.now().isoformat()}))
+    pipe.delete(PROCESSING_KEY)
+    pipe.execute()
+    return len(raw_entries)
+
+
+def retry_failed_reservations():
+    """Moves the failed reservations back to the journal, returns how many were moved"""
+    return get_redis_client().eval(RETRY_FAILED_SCRIPT, 2, FAILED_KEY, JOURNAL_KEY)
+
+
+def refund_failed_reservations():
+    """
+    Drops the failed reservations and returns their credit: each seller's mirror is
+    dropped with its entries while holding the seller lock, so prime_credit_mirror
+    reloads it without them. Returns how many were refunded.
+    """
+    client = get_redis_client()
+    raw_entries_by_seller = {}
+    for raw_entry in client.lrange(FAILED_KEY, 0, -1):
+        raw_entries_by_seller.setdefault(json.loads(raw_entry)["seller_id"], []).append(raw_entry)
+
+    for seller_id in sorted(raw_entries_by_seller):
+        with transaction.atomic():
+            list(Seller.objects.select_for_update().filter(id=seller_id))
+            pipe = client.pipeline()
+            for raw_entry in raw_entries_by_seller[seller_id]:
+                pipe.lrem(FAILED_KEY, 1, raw_entry)
+            pipe.delete(mirror_key(seller_id))
+            pipe.execute()
+    return sum(len(raw_entries) for raw_entries in raw_entries_by_seller.values())
@@ -0,0 +1,93 @@
+"""
+Retries of optimistic and serializable ledger transactions.
+
+Seller and CreditRequest rows carry a version a trigger bumps on every update, so a
+compare-and-swap update (WHERE version = the version read) misses when the row
+changed since it was read, whichever path changed it, and raises ConcurrentUpdate.
+Under SERIALIZABLE isolation Postgres aborts transactions with serialization
+failures and deadlocks instead. retry_on_conflict runs the operation again after a
+jittered exponential backoff in both cases, counting retries per operation.
+
+A database error aborts the whole transaction, so it is only retried when the
+operation runs its own; inside an outer atomic block it is raised to its owner.
+"""
+import functools
+import logging
+import random
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, OperationalError
+from psycopg2 import errorcodes
+
+logger = logging.getLogger('elastic_logger')
+
+RETRY_STATS_KEY = "conflict_retry_stats"
+
+RETRYABLE_PGCODES = {errorcodes.SERIALIZATION_FAILURE, errorcodes.DEADLOCK_DETECTED}
+
+# Retries of this process, the ones recorded in Redis add up all processes
+local_retry_stats = Counter()
+
+
+class ConcurrentUpdate(Exception):
+    """A compare-and-swap update found the row changed since it was read"""
+
+
+def get_redis_client():
+    return caches['default'].client.get_client(write=True)
+
+
+def record_retry(operation, outcome):
+    field = f"{operation}:{outcome}"
+    local_retry_stats[field] += 1
+    try:
+        get_redis_client().hincrby(RETRY_STATS_KEY, field, 1)
+    except Exception as e:
+        logger.warning(f"Could not record conflict retry: {e}")
+
+
+def get_retry_stats():
+    return {field: int(count) for field, count in get_redis_client().hgetall(RETRY_STATS_KEY).items()}
+
+
+def reset_retry_stats():
+    get_redis_client().delete(RETRY_STATS_KEY)
+
+
+def is_retryable(error):
+    if isinstance(error, ConcurrentUpdate):
+        return True
+    return getattr(error.__cause__, "pgcode", None) in RETRYABLE_PGCODES and not connection.in_atomic_block
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Full jitter, uniform up to the exponential backoff, so conflicting retries spread out"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def retry_on_conflict(operation, attempts=None):
+    """
+    Runs the decorated function again, up to attempts times in all, when it raises
+    ConcurrentUpdate or a retryable database error; the last error is raised.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            max_attempts = attempts or settings.CONFLICT_RETRY_ATTEMPTS
+            for attempt in range(max_attempts):
+                try:
+                    return func(*args, **kwargs)
+                except (ConcurrentUpdate, OperationalError) as error:
+                    if not is_retryable(error):
+                        raise
+                    if attempt + 1 == max_attempts:
+                        record_retry(operation, "exhausted")
+                        raise
+                    record_retry(operation, "retries")
+                    time.sleep(backoff_delay(attempt, settings.CONFLICT_RETRY_BASE_DELAY,
+                                             settings.CONFLICT_RETRY_MAX_DELAY))
+        return wrapper
+    return decorator
@@ -0,0 +1,95 @@
+"""
+Daily per-seller rollups of the Transaction ledger.
+
+rollup_ledger folds ledger rows into DailySellerRollup in chunks of ledger ids,
+advancing the job's RollupWatermark in the same database transaction as each chunk,
+so an interrupted run, the initial backfill included, resumes where it stopped and
+no row is counted twice. Ledger ids of different sellers may commit out of order,
+so only rows older than the settling lag are rolled up.
+"""
+import datetime
+
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from charging.models import Transaction, DailySellerRollup, RollupWatermark
+
+WATERMARK_NAME = "daily_seller_rollup"
+
+ROLLUP_CHUNK_SQL = f"""
+    INSERT INTO {DailySellerRollup._meta.db_table} AS rollup
+        (seller_id, day, transaction_type, amount_sum, tx_count, updated_at)
+    SELECT seller_id, (timestamp AT TIME ZONE 'UTC')::date, transaction_type, SUM(amount), COUNT(*), now()
+    FROM {Transaction._meta.db_table}
+    WHERE id > %(after_tx_id)s AND id <= %(up_to_tx_id)s
+    GROUP BY 1, 2, 3
+    ON CONFLICT (seller_id, day, transaction_type) DO UPDATE
+    SET amount_sum = rollup.amount_sum + EXCLUDED.amount_sum,
+        tx_count = rollup.tx_count + EXCLUDED.tx_count,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+def get_watermark():
+    return RollupWatermark.objects.get_or_create(name=WATERMARK_NAME)[0]
+
+
+def rolled_up_to_tx_id():
+    return RollupWatermark.objects.filter(name=WATERMARK_NAME).values_list("last_tx_id", flat=True).first() or 0
+
+
+def settled_tx_id(lag):
+    """The highest ledger id among the rows older than lag seconds"""
+    settled_before = timezone.now() - datetime.timedelta(seconds=lag)
+    return Transaction.objects.filter(timestamp__lt=settled_before).aggregate(last=Max("id"))["last"] or 0
+
+
+def rollup_chunk(chunk_size, up_to_tx_id):
+    """Rolls up the next chunk of ledger ids, returns the new watermark or None when caught up"""
+    with transaction.atomic():
+        watermark = RollupWatermark.objects.select_for_update().get(name=WATERMARK_NAME)
+        if watermark.last_tx_id >= up_to_tx_id:
+            return None
+
+        # Skips the gaps of the id space, a backfill doesn't crawl through empty chunks
+        next_tx_id = Transaction.objects.filter(id__gt=watermark.last_tx_id).aggregate(next=Min("id"))["next"]
+        chunk_end = min((next_tx_id or up_to_tx_id) + chunk_size - 1, up_to_tx_id)
+        with connection.cursor() as cursor:
+            cursor.execute(ROLLUP_CHUNK_SQL, {"after_tx_id": watermark.last_tx_id, "up_to_tx_id": chunk_end})
+
+        watermark.last_tx_id = chunk_end
+        watermark.save(update_fields=("last_tx_id", "updated_at"))
+        return chunk_end
+
+
+def rollup_ledger(chunk_size, lag, progress=None):
+    """Rolls up every settled ledger row after the watermark, returns the final watermark"""
+    watermark = get_watermark()
+    up_to_tx_id = settled_tx_id(lag)
+    last_tx_id = watermark.last_tx_id
+    while True:
+        chunk_end = rollup_chunk(chunk_size, up_to_tx_id)
+        if chunk_end is None:
+            return last_tx_id
+        last_tx_id = chunk_end
+        if progress:
+            progress(last_tx_id, up_to_tx_id)
+
+
+def seller_daily_stats(seller_id, first_day, last_day, transaction_type=None):
+    """Per day and type rollups of a seller in [first_day, last_day], with their totals"""
+    rollups = DailySellerRollup.objects.filter(seller_id=seller_id, day__gte=first_day, day__lte=last_day)
+    if transaction_type:
+        rollups = rollups.filter(transaction_type=transaction_type)
+
+    days = list(rollups.order_by("day", "transaction_type").values("day", "transaction_type", "amount_sum",
+                                                                    "tx_count"))
+    totals = {
+        transaction_type: {"amount_sum": 0, "tx_count": 0}
+        for transaction_type in ({transaction_type} if transaction_type else dict(Transaction.TRANSACTION_CHOICES))
+    }
+    for row in days:
+        totals[row["transaction_type"]]["amount_sum"] += row["amount_sum"]
+        totals[row["transaction_type"]]["tx_count"] += row["tx_count"]
+    return {"days": days, "totals": totals}
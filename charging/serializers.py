@@ -1,10 +1,12 @@
 import re
 
+from django.conf import settings
 from rest_framework import serializers, status
 from rest_framework.exceptions import ValidationError
 
 from .models import Seller, Transaction, CreditRequest
-from .services import apply_admin_action_on_seller_request_for_credit
+from .services import apply_admin_action_on_seller_request_for_credit, merge_into_pending_request
+from .tasks import enqueue_admin_action
 
 
 class TransactionSerializer(serializers.ModelSerializer):
@@ -17,7 +19,7 @@ class TransactionSerializer(serializers.ModelSerializer):
 
 class SellerSellingChargeCreateSerializer(serializers.Serializer):
     phone = serializers.CharField()
-    amount = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1)
 
     def validate_phone(self, value):
         if not re.match(r"^09\d{9}$", value):
@@ -27,6 +29,7 @@ class SellerSellingChargeCreateSerializer(serializers.Serializer):
 
 class SellerSerializer(serializers.ModelSerializer):
     user = serializers.CharField(read_only=True)
+    credit = serializers.IntegerField(source="balance", read_only=True)
 
     class Meta:
         model = Seller
@@ -34,32 +37,87 @@ class SellerSerializer(serializers.ModelSerializer):
 
 
 class AdminDepositRequestApprovalListSerializer(serializers.ModelSerializer):
+    seller_national_id = serializers.CharField(source="seller.user.national_id", read_only=True)
+    seller_email = serializers.CharField(source="seller.user.email", read_only=True)
+
     class Meta:
         model = CreditRequest
         fields = "__all__"
 
 
 class AdminDepositRequestApprovalPatchSerializer(serializers.ModelSerializer):
+    # The version the admin saw, the action is refused when the request changed since
+    version = serializers.IntegerField(required=False, min_value=0)
 
     class Meta:
         model = CreditRequest
-        fields = ("status",)
+        fields = ("status", "version")
 
     def validate_status(self, value):
         if value not in [CreditRequest.APPROVED, CreditRequest.REJECT]:
             raise serializers.ValidationError("Only 'Approved' or 'Rejected' status is allowed.")
         return value
 
+    def validate(self, attrs):
+        # Merging raises the amount of pending requests, the admin must act on the amount they saw
+        if settings.MERGE_PENDING_CREDIT_REQUESTS and attrs.get("version") is None:
+            raise serializers.ValidationError({"version": "Required while pending credit requests are merged"})
+        return attrs
 
     def update(self, instance, validated_data):
         request = self.context["request"]
-        validated_data['is_processed'] = True
-        validated_data['admin_user'] = request.user
-        apply_admin_action_on_seller_request_for_credit(instance, validated_data)
-        instance.refresh_from_db()
+        action_status, version = validated_data["status"], validated_data.get("version")
+        if settings.DEPOSIT_APPROVAL_QUEUE:
+            state = enqueue_admin_action(instance, action_status, request.user, version)
+        else:
+            state = apply_admin_action_on_seller_request_for_credit(instance, {
+                "status": action_status,
+                "is_processed": True,
+                "admin_user": request.user,
+                "version": version,
+            })
+        if not state:
+            raise ValidationError({"status": "This request is already queued or processed, or has changed"})
+
+        instance.status, instance.admin_user = action_status, request.user
+        for attr, value in state.items():
+            setattr(instance, attr, value)
         return instance
 
 
+class AdminDepositRequestStateSerializer(serializers.ModelSerializer):
+    state = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = CreditRequest
+        fields = ("id", "state", "status", "is_processed", "queued_at", "change_status_at", "version")
+
+
+class AdminDepositRequestBulkActionSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
+    status = serializers.CharField()
+
+    def validate_ids(self, value):
+        if len(value) > settings.BULK_CREDIT_REQUEST_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f"At most {settings.BULK_CREDIT_REQUEST_MAX_ITEMS} requests are allowed per action")
+        return value
+
+    def validate_status(self, value):
+        if value not in [CreditRequest.APPROVED, CreditRequest.REJECT]:
+            raise serializers.ValidationError("Only 'Approved' or 'Rejected' status is allowed.")
+        return value
+
+
+class AdminDepositRequestApproveAllSerializer(serializers.Serializer):
+    seller_id = serializers.IntegerField(min_value=1)
+
+    def validate_seller_id(self, value):
+        if not Seller.objects.filter(id=value).exists():
+            raise serializers.ValidationError("Seller not found")
+        return value
+
+
 class CreditRequestListSerializer(serializers.ModelSerializer):
     class Meta:
         model = CreditRequest
@@ -74,4 +132,9 @@ class CreditRequestCreateSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data["seller"] = self.context["request"].user.seller
+        # A request with an idempotency key keeps its own row, the key is what recognizes its retries
+        if settings.MERGE_PENDING_CREDIT_REQUESTS and not validated_data.get("idempotency_key"):
+            merged_id = merge_into_pending_request(validated_data["seller"].id, validated_data["amount"])
+            if merged_id:
+                return CreditRequest.objects.get(id=merged_id)
         return super().create(validated_data)
\ No newline at end of file
@@ -1,40 +1,128 @@
+import datetime
 import json
 import logging
 
-from django.db import transaction
-from django.db.models import F
+from django.conf import settings
+from django.db import transaction, connection
+from django.db.models import F, Case, When, Value, BigIntegerField
+from django.db.models.functions import Greatest
 from django.utils import timezone
 
-from charging.models import CreditRequest, Seller, Transaction, PhoneNumber
+from charging.models import CreditRequest, Seller, Transaction, SellerCreditBucket, ledger_totals_update
+from charging.phone_registry import register_phone_numbers
+from charging.reservations import reserve_credit, invalidate_credit_mirror
+from charging.retry import ConcurrentUpdate, retry_on_conflict
 
 logger = logging.getLogger('elastic_logger')
 
 
+class InsufficientCredit(ValueError):
+    """The seller's credit does not cover the charge"""
+
+
 class CreditApproveStrategy:
+    """
+    Transitions a pending request to approved, credits the seller (its buckets when
+    striped, locked in index order like spread_over_buckets) with its ledger totals
+    and writes the ledger row in one statement. The request update is guarded on its
+    pending state, so a concurrent second approval finds nothing to transition and
+    credits nothing. The ledger id is drawn by the seller update, like in
+    ConditionalChargeStrategy.
+    """
+    approve_sql = f"""
+        WITH request AS (
+            UPDATE {CreditRequest._meta.db_table}
+            SET status = %(status)s, is_processed = true, admin_user_id = %(admin_user_id)s,
+                change_status_at = %(timestamp)s
+            WHERE id = %(request_id)s AND status = %(pending)s AND NOT is_processed
+              AND (%(version)s::bigint IS NULL OR version = %(version)s)
+            RETURNING id, seller_id, amount, status, is_processed, change_status_at, version
+        ), credited AS (
+            UPDATE {Seller._meta.db_table} seller
+            SET credit = seller.credit + CASE WHEN seller.credit_stripes > 0 THEN 0 ELSE request.amount END,
+                total_deposit = seller.total_deposit + request.amount,
+                tx_count = seller.tx_count + 1,
+                last_tx_id = nextval(pg_get_serial_sequence('{Transaction._meta.db_table}', 'id'))
+            FROM request
+            WHERE seller.id = request.seller_id
+            RETURNING seller.id, seller.credit_stripes, seller.last_tx_id
+        ), locked AS (
+            SELECT bucket.id
+            FROM {SellerCreditBucket._meta.db_table} bucket, credited
+            WHERE bucket.seller_id = credited.id AND credited.credit_stripes > 0
+            ORDER BY bucket.index
+            FOR UPDATE OF bucket
+        ), spread AS (
+            UPDATE {SellerCreditBucket._meta.db_table} bucket
+            SET credit = bucket.credit + request.amount / credited.credit_stripes
+                + CASE WHEN bucket.index < request.amount %% credited.credit_stripes THEN 1 ELSE 0 END
+            FROM request, credited, locked
+            WHERE bucket.id = locked.id
+        ), ledger AS (
+            INSERT INTO {Transaction._meta.db_table} (id, seller_id, transaction_type, amount, timestamp)
+            SELECT credited.last_tx_id, credited.id, %(transaction_type)s, request.amount, %(timestamp)s
+            FROM credited, request
+        )
+        SELECT request.id, request.status, request.is_processed, request.change_status_at, request.version,
+               request.seller_id, credited.credit_stripes
+        FROM request, credited
+    """
+
     def apply(self, instance, validated_data):
-        with transaction.atomic():
-            instance = instance.__class__.objects.select_for_update().get(id=instance.id)
-            seller = Seller.objects.select_for_update().get(id=instance.seller.id)
-            validated_data["change_status_at"] = timezone.now()
-            for attr, value in validated_data.items():
-                setattr(instance, attr, value)
-            instance.save(update_fields=validated_data.keys())
-            seller.credit = F("credit") + instance.amount
-            seller.save(update_fields=("credit",))
-            Transaction.objects.create(
-                seller=seller,
-                amount=instance.amount,
-                transaction_type=Transaction.DEPOSIT,
-            )
+        if settings.CHARGE_ENGINE == "reserved":
+            # The seller row the statement credited stays locked until the mirror is dropped
+            with transaction.atomic():
+                return self.approve(instance, validated_data, mirror=True)
+        return self.approve(instance, validated_data)
+
+    def approve(self, instance, validated_data, mirror=False):
+        admin_user = validated_data.get("admin_user")
+        with connection.cursor() as cursor:
+            cursor.execute(self.approve_sql, {
+                "request_id": instance.id,
+                "status": CreditRequest.APPROVED,
+                "pending": CreditRequest.PENDING,
+                "version": validated_data.get("version"),
+                "admin_user_id": admin_user.id if admin_user else None,
+                "transaction_type": Transaction.DEPOSIT,
+                "timestamp": timezone.now(),
+            })
+            row = cursor.fetchone()
+        if row is None:
+            return None
+
+        *state, seller_id, credit_stripes = row
+        if mirror and not credit_stripes:
+            invalidate_credit_mirror(seller_id)
+        return dict(zip(("id", "status", "is_processed", "change_status_at", "version"), state))
 
 
 class CreditRejectStrategy:
+    """Transitions a pending request to rejected in one guarded statement"""
+    reject_sql = f"""
+        UPDATE {CreditRequest._meta.db_table}
+        SET status = %(status)s, is_processed = true, admin_user_id = %(admin_user_id)s,
+            change_status_at = %(timestamp)s
+        WHERE id = %(request_id)s AND status = %(pending)s AND NOT is_processed
+          AND (%(version)s::bigint IS NULL OR version = %(version)s)
+        RETURNING id, status, is_processed, change_status_at, version
+    """
+
     def apply(self, instance, validated_data):
-        with transaction.atomic():
-            instance = instance.__class__.objects.select_for_update().get(id=instance.id)
-            for attr, value in validated_data.items():
-                setattr(instance, attr, value)
-            instance.save()
+        admin_user = validated_data.get("admin_user")
+        with connection.cursor() as cursor:
+            cursor.execute(self.reject_sql, {
+                "request_id": instance.id,
+                "status": CreditRequest.REJECT,
+                "pending": CreditRequest.PENDING,
+                "version": validated_data.get("version"),
+                "admin_user_id": admin_user.id if admin_user else None,
+                "timestamp": timezone.now(),
+            })
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "status", "is_processed", "change_status_at", "version"), row))
 
 
 ACTION_STRATEGY = {
@@ -42,30 +130,547 @@ ACTION_STRATEGY = {
     CreditRequest.REJECT: CreditRejectStrategy(),
 }
 
+@retry_on_conflict("credit_request")
 def apply_admin_action_on_seller_request_for_credit(instance, validated_data):
-
+    """
+    Approves or rejects a pending request in one statement, returns its new state or
+    None when it was not pending anymore, or not at the version given in
+    validated_data anymore.
+    """
     action_strategy = ACTION_STRATEGY.get(validated_data['status'])
     if action_strategy:
-        action_strategy.apply(instance, validated_data)
+        return action_strategy.apply(instance, validated_data)
+    return None
+
+
+def credit_approved_requests(requests):
+    """
+    Credits already locked approved requests: their sellers are locked in id order,
+    the amounts written to the ledger with one bulk insert and credited with one
+    UPDATE per seller.
+    """
+    if not requests:
+        return
+    sellers = {seller.id: seller for seller in Seller.objects.select_for_update().
+               filter(id__in={request.seller_id for request in requests}).order_by("id")}
+    ledger = Transaction.objects.bulk_create([
+        Transaction(seller_id=request.seller_id, amount=request.amount, transaction_type=Transaction.DEPOSIT)
+        for request in requests
+    ])
+    for seller_id, seller in sellers.items():
+        seller_ledger = [ledger_row for ledger_row in ledger if ledger_row.seller_id == seller_id]
+        amount = sum(ledger_row.amount for ledger_row in seller_ledger)
+        if seller.credit_stripes:
+            spread_over_buckets(seller, amount)
+            Seller.objects.filter(id=seller_id).update(**ledger_totals_update(seller_ledger))
+        else:
+            Seller.objects.filter(id=seller_id).update(credit=F("credit") + amount,
+                                                       **ledger_totals_update(seller_ledger))
+        if settings.CHARGE_ENGINE == "reserved" and not seller.credit_stripes:
+            invalidate_credit_mirror(seller_id)
+
+
+@retry_on_conflict("bulk_credit_request")
+def apply_admin_action_in_bulk(request_ids, status, admin_user):
+    """
+    Approves or rejects the credit requests in one transaction. Requests and then
+    their sellers are locked in id order, so concurrent bulk and single actions
+    can't deadlock; see credit_approved_requests. Returns the outcome of every id,
+    "approved", "rejected", "queued", "already_processed" or "not_found"; a queued
+    request keeps the action queued for it.
+    """
+    with transaction.atomic():
+        requests = list(CreditRequest.objects.select_for_update().filter(id__in=request_ids).order_by("id"))
+        pending = [request for request in requests if not request.is_processed and request.queued_at is None]
+        outcomes = {request_id: "not_found" for request_id in request_ids}
+        outcomes.update({request.id: request.state if request.state == "queued" else "already_processed"
+                         for request in requests})
+
+        if pending:
+            CreditRequest.objects.filter(id__in=[request.id for request in pending]).update(
+                status=status,
+                is_processed=True,
+                admin_user=admin_user,
+                change_status_at=timezone.now(),
+            )
+            outcome = "approved" if status == CreditRequest.APPROVED else "rejected"
+            outcomes.update({request.id: outcome for request in pending})
+
+        if status == CreditRequest.APPROVED:
+            credit_approved_requests(pending)
+
+    return outcomes
+
+
+@retry_on_conflict("seller_credit_requests")
+def approve_pending_requests_of_seller(seller_id, admin_user):
+    """
+    Approves every pending request of the seller in one transaction, crediting
+    their sum with one seller update and their ledger rows with one bulk insert.
+    Queued requests are left to the deposit workers. Returns the approved requests.
+    """
+    with transaction.atomic():
+        requests = list(CreditRequest.objects.select_for_update().
+                        filter(seller_id=seller_id, is_processed=False, queued_at__isnull=True).order_by("id"))
+        if not requests:
+            return []
+        CreditRequest.objects.filter(id__in=[request.id for request in requests]).update(
+            status=CreditRequest.APPROVED,
+            is_processed=True,
+            admin_user=admin_user,
+            change_status_at=timezone.now(),
+        )
+        credit_approved_requests(requests)
+    return requests
+
 
+MERGE_INTO_PENDING_REQUEST_SQL = f"""
+    UPDATE {CreditRequest._meta.db_table}
+    SET amount = amount + %(amount)s
+    WHERE id = (
+        SELECT id FROM {CreditRequest._meta.db_table}
+        WHERE seller_id = %(seller_id)s AND status = %(pending)s AND NOT is_processed AND queued_at IS NULL
+          AND idempotency_key IS NULL AND amount <= %(max_amount)s - %(amount)s
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id
+"""
 
 
-def perform_charge(seller_id, phone_number, amount):
+def merge_into_pending_request(seller_id, amount):
+    """
+    Adds amount to the seller's oldest pending request, returns its id or None when
+    there is none to merge into. Requests created with an Idempotency-Key are never
+    merged into, their replays must keep matching. A request an admin is acting on
+    is locked and skipped; the merge bumps the request's version, so an admin action
+    at the version read before it is refused.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(MERGE_INTO_PENDING_REQUEST_SQL, {
+            "seller_id": seller_id,
+            "amount": amount,
+            "pending": CreditRequest.PENDING,
+            "max_amount": CreditRequest.MAX_AMOUNT,
+        })
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+QUEUE_ADMIN_ACTION_SQL = f"""
+    UPDATE {CreditRequest._meta.db_table}
+    SET status = %(status)s, admin_user_id = %(admin_user_id)s, queued_at = %(timestamp)s
+    WHERE id = %(request_id)s AND status = %(pending)s AND NOT is_processed AND queued_at IS NULL
+      AND (%(version)s::bigint IS NULL OR version = %(version)s)
+    RETURNING queued_at, version
+"""
+
+
+def queue_admin_action(request_id, status, admin_user, version=None):
+    """
+    Records the action on a pending request for the deposit workers in one guarded
+    statement, returns the request's new queued_at and version, or None when it was
+    already queued or processed, or is not at version anymore.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(QUEUE_ADMIN_ACTION_SQL, {
+            "request_id": request_id,
+            "status": status,
+            "pending": CreditRequest.PENDING,
+            "version": version,
+            "admin_user_id": admin_user.id if admin_user else None,
+            "timestamp": timezone.now(),
+        })
+        row = cursor.fetchone()
+    return dict(zip(("queued_at", "version"), row)) if row else None
+
+
+def stale_queued_seller_ids(older_than):
+    """The sellers with an action queued more than older_than seconds ago and not applied yet"""
+    queued_before = timezone.now() - datetime.timedelta(seconds=older_than)
+    return list(CreditRequest.objects.filter(is_processed=False, queued_at__lt=queued_before).
+                order_by().values_list("seller_id", flat=True).distinct())
+
+
+@retry_on_conflict("queued_credit_request")
+def apply_queued_admin_actions(seller_id):
+    """
+    Applies every queued action on the seller's credit requests in one transaction,
+    returns how many were applied. Requests another worker holds are left to it.
+    """
+    with transaction.atomic():
+        requests = list(CreditRequest.objects.select_for_update(skip_locked=True).
+                        filter(seller_id=seller_id, is_processed=False, queued_at__isnull=False).order_by("id"))
+        if not requests:
+            return 0
+        CreditRequest.objects.filter(id__in=[request.id for request in requests]).update(
+            is_processed=True,
+            change_status_at=timezone.now(),
+        )
+        credit_approved_requests([request for request in requests if request.status == CreditRequest.APPROVED])
+    return len(requests)
+
+
+def perform_bulk_admin_action(request_ids, status, admin_user):
+    request_ids = list(dict.fromkeys(request_ids))
+    outcomes = apply_admin_action_in_bulk(request_ids, status, admin_user)
+    return [
+        {
+            "id": request_id,
+            "outcome": outcomes[request_id],
+            "success": outcomes[request_id] in ("approved", "rejected"),
+        }
+        for request_id in request_ids
+    ]
+
+
+
+class LedgerChargeStrategy:
+    """
+    Debits the seller and writes the ledger row with debit, retried on conflicts,
+    then registers the phone number once the debit has committed; registering is
+    never retried, a retry of it would charge again.
+    """
+
+    def debit(self, seller_id, phone_number, amount, idempotency_key=None):
+        raise NotImplementedError
+
+    def apply(self, seller_id, phone_number, amount, idempotency_key=None):
+        self.debit(seller_id, phone_number, amount, idempotency_key)
+        register_phone_numbers([phone_number])
+
+
+class LockingChargeStrategy(LedgerChargeStrategy):
+    @retry_on_conflict("charge")
+    def debit(self, seller_id, phone_number, amount, idempotency_key=None):
+        with transaction.atomic():
+            seller = Seller.objects.select_for_update().get(id=seller_id)
+
+            if seller.credit < amount:
+                raise InsufficientCredit
+
+            ledger_row = Transaction.objects.create(
+                seller=seller,
+                amount=amount,
+                phone=phone_number,
+                transaction_type=Transaction.SELLING,
+                idempotency_key=idempotency_key,
+            )
+            Seller.objects.filter(id=seller.id).update(credit=F("credit") - amount,
+                                                       **ledger_totals_update([ledger_row]))
+
+
+class ConditionalChargeStrategy(LedgerChargeStrategy):
+    """
+    Debits the seller, adds to its ledger totals and writes the ledger row in one
+    guarded statement, so the seller row is only locked for the duration of that
+    statement. The ledger id is drawn by the seller update, so like on every other
+    path a seller's ledger ids are allocated in order while its row is held.
+    """
+    charge_sql = f"""
+        WITH debited AS (
+            UPDATE {Seller._meta.db_table}
+            SET credit = credit - %(amount)s,
+                total_sell = total_sell + %(amount)s,
+                tx_count = tx_count + 1,
+                last_tx_id = nextval(pg_get_serial_sequence('{Transaction._meta.db_table}', 'id'))
+            WHERE id = %(seller_id)s AND credit >= %(amount)s
+            RETURNING id, credit, last_tx_id
+        ), ledger AS (
+            INSERT INTO {Transaction._meta.db_table}
+                (id, seller_id, phone, transaction_type, amount, timestamp, idempotency_key)
+            SELECT last_tx_id, id, %(phone)s, %(transaction_type)s, %(amount)s, %(timestamp)s, %(idempotency_key)s
+            FROM debited
+            RETURNING id
+        )
+        SELECT debited.credit, ledger.id FROM debited, ledger
+    """
+
+    @retry_on_conflict("charge")
+    def debit(self, seller_id, phone_number, amount, idempotency_key=None):
+        with connection.cursor() as cursor:
+            cursor.execute(self.charge_sql, {
+                "seller_id": seller_id,
+                "phone": phone_number,
+                "amount": amount,
+                "transaction_type": Transaction.SELLING,
+                "timestamp": timezone.now(),
+                "idempotency_key": idempotency_key,
+            })
+            row = cursor.fetchone()
+
+        if row is None:
+            raise InsufficientCredit
+
+
+class OptimisticChargeStrategy(LedgerChargeStrategy):
+    """
+    Reads the seller without locking it, checks its credit and debits it with a
+    compare-and-swap on the version read, writing the ledger row in the same
+    statement. A seller changed in between makes the swap miss and raises
+    ConcurrentUpdate, debit is retried from the read.
+    """
+    charge_sql = f"""
+        WITH debited AS (
+            UPDATE {Seller._meta.db_table}
+            SET credit = credit - %(amount)s,
+                total_sell = total_sell + %(amount)s,
+                tx_count = tx_count + 1,
+                last_tx_id = nextval(pg_get_serial_sequence('{Transaction._meta.db_table}', 'id'))
+            WHERE id = %(seller_id)s AND version = %(version)s
+            RETURNING id, last_tx_id
+        ), ledger AS (
+            INSERT INTO {Transaction._meta.db_table}
+                (id, seller_id, phone, transaction_type, amount, timestamp, idempotency_key)
+            SELECT last_tx_id, id, %(phone)s, %(transaction_type)s, %(amount)s, %(timestamp)s, %(idempotency_key)s
+            FROM debited
+            RETURNING id
+        )
+        SELECT ledger.id FROM ledger
+    """
+
+    def compare_and_swap(self, seller_id, version, phone_number, amount, idempotency_key=None):
+        """Debits the seller if it is still at version, returns the ledger id or None"""
+        with connection.cursor() as cursor:
+            cursor.execute(self.charge_sql, {
+                "seller_id": seller_id,
+                "version": version,
+                "phone": phone_number,
+                "amount": amount,
+                "transaction_type": Transaction.SELLING,
+                "timestamp": timezone.now(),
+                "idempotency_key": idempotency_key,
+            })
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    @retry_on_conflict("charge")
+    def debit(self, seller_id, phone_number, amount, idempotency_key=None):
+        credit, version = Seller.objects.filter(id=seller_id).values_list("credit", "version").get()
+        if credit < amount:
+            raise InsufficientCredit
+
+        if self.compare_and_swap(seller_id, version, phone_number, amount, idempotency_key) is None:
+            raise ConcurrentUpdate(f"Seller {seller_id} changed since version {version}")
+
+
+class StripedChargeStrategy(LedgerChargeStrategy):
+    """
+    Debits one randomly picked bucket of a striped seller, so charges for the same
+    seller only contend when they land on the same bucket. All buckets are locked,
+    in index order, only when no single bucket is big enough.
+    """
+
+    @retry_on_conflict("charge")
+    def debit(self, seller_id, phone_number, amount, idempotency_key=None):
+        with transaction.atomic():
+            bucket = SellerCreditBucket.objects.select_for_update(skip_locked=True). \
+                filter(seller_id=seller_id, credit__gte=amount).order_by("?").first()
+            if bucket is None:
+                # The pick above can't tell a locked bucket from a small one, wait for one big enough instead
+                bucket = SellerCreditBucket.objects.select_for_update(). \
+                    filter(seller_id=seller_id, credit__gte=amount).order_by("?").first()
+            if bucket is not None:
+                SellerCreditBucket.objects.filter(id=bucket.id).update(credit=F("credit") - amount)
+            else:
+                buckets = list(SellerCreditBucket.objects.select_for_update().filter(seller_id=seller_id).
+                               order_by("index"))
+                drain_buckets(buckets, amount)
+                bucket = buckets[0]
+
+            ledger_row = Transaction.objects.create(
+                seller_id=seller_id,
+                amount=amount,
+                phone=phone_number,
+                transaction_type=Transaction.SELLING,
+                idempotency_key=idempotency_key,
+            )
+            # The totals go to a bucket this charge holds locked, the seller row stays untouched
+            SellerCreditBucket.objects.filter(id=bucket.id).update(**ledger_totals_update([ledger_row]))
+
+
+def split_amount(amount, parts):
+    share, remainder = divmod(amount, parts)
+    return [share + 1 if index < remainder else share for index in range(parts)]
+
+
+def spread_over_buckets(seller, amount):
+    share, remainder = divmod(amount, seller.credit_stripes)
+    # Locked in index order first, like every path locking more than one bucket, so they can't deadlock
+    list(SellerCreditBucket.objects.select_for_update().filter(seller_id=seller.id).order_by("index").
+         values_list("id", flat=True))
+    SellerCreditBucket.objects.filter(seller_id=seller.id).update(
+        credit=F("credit") + Case(When(index__lt=remainder, then=Value(share + 1)), default=Value(share))
+    )
+
+
+def drain_buckets(buckets, amount):
+    """Debits amount across already locked buckets, used when no single bucket can cover it."""
+    if sum(bucket.credit for bucket in buckets) < amount:
+        raise InsufficientCredit
+
+    for bucket in buckets:
+        if not amount:
+            break
+        debit = min(bucket.credit, amount)
+        if debit:
+            SellerCreditBucket.objects.filter(id=bucket.id).update(credit=F("credit") - debit)
+            amount -= debit
+
+
+def enable_credit_striping(seller_id, stripes):
     with transaction.atomic():
         seller = Seller.objects.select_for_update().get(id=seller_id)
+        if seller.credit_stripes:
+            raise ValueError("Seller credit is already striped")
 
-        if seller.credit < amount:
-            raise ValueError("Insufficient credit")
+        SellerCreditBucket.objects.bulk_create([
+            SellerCreditBucket(seller=seller, index=index, credit=credit)
+            for index, credit in enumerate(split_amount(seller.credit, stripes))
+        ])
+        Seller.objects.filter(id=seller.id).update(credit=0, credit_stripes=stripes)
 
-        seller.credit = F("credit") - amount
-        seller.save(update_fields=("credit",))
 
-        Transaction.objects.create(
-            seller=seller,
-            amount=amount,
-            phone=phone_number,
-            transaction_type=Transaction.SELLING,
+def disable_credit_striping(seller_id):
+    with transaction.atomic():
+        seller = Seller.objects.select_for_update().get(id=seller_id)
+        if not seller.credit_stripes:
+            raise ValueError("Seller credit is not striped")
+
+        buckets = list(SellerCreditBucket.objects.select_for_update().filter(seller=seller).order_by("index"))
+        SellerCreditBucket.objects.filter(seller=seller).delete()
+        totals = {
+            "total_deposit": F("total_deposit") + sum(bucket.total_deposit for bucket in buckets),
+            "total_sell": F("total_sell") + sum(bucket.total_sell for bucket in buckets),
+            "tx_count": F("tx_count") + sum(bucket.tx_count for bucket in buckets),
+        }
+        bucket_tx_ids = [bucket.last_tx_id for bucket in buckets if bucket.last_tx_id]
+        if bucket_tx_ids:
+            totals["last_tx_id"] = Greatest(F("last_tx_id"), Value(max(bucket_tx_ids)),
+                                              output_field=BigIntegerField())
+        Seller.objects.filter(id=seller.id).update(
+            credit=F("credit") + sum(bucket.credit for bucket in buckets),
+            credit_stripes=0,
+            **totals,
         )
 
-        PhoneNumber.objects.get_or_create(phone_number=phone_number)
 
+class CoalescedChargeStrategy:
+    """Hands the charge to the per-seller group-commit coalescer, see charging.coalescer"""
+
+    def apply(self, seller_id, phone_number, amount, idempotency_key=None):
+        from charging.coalescer import get_charge_coalescer
+
+        charge = {"phone": phone_number, "amount": amount, "idempotency_key": idempotency_key}
+        if not get_charge_coalescer().submit(seller_id, charge):
+            raise InsufficientCredit
+
+
+class ReservedChargeStrategy:
+    """Reserves the credit in Redis, the ledger is written later by the reservation flusher"""
+
+    def apply(self, seller_id, phone_number, amount, idempotency_key=None):
+        if not reserve_credit(seller_id, phone_number, amount, idempotency_key):
+            raise InsufficientCredit
+
+
+STRIPED_CHARGE_STRATEGY = StripedChargeStrategy()
+
+CHARGE_STRATEGY = {
+    "locking": LockingChargeStrategy(),
+    "conditional": ConditionalChargeStrategy(),
+    "coalesced": CoalescedChargeStrategy(),
+    "reserved": ReservedChargeStrategy(),
+    "optimistic": OptimisticChargeStrategy(),
+}
+
+
+def perform_charge(seller_id, phone_number, amount, idempotency_key=None, striped=False):
+    if striped:
+        charge_strategy = STRIPED_CHARGE_STRATEGY
+    else:
+        charge_strategy = CHARGE_STRATEGY[settings.CHARGE_ENGINE]
+    charge_strategy.apply(seller_id, phone_number, amount, idempotency_key)
+
+
+def apply_charges(seller_id, charges):
+    """
+    Applies the charges in order under a single lock of the seller row. Charges
+    exceeding the remaining credit are rejected, the rest are debited with one
+    UPDATE and written to the ledger with one bulk insert. A charge whose
+    idempotency key is already in the ledger counts as applied and is skipped.
+    Returns a list of booleans telling which charges were applied.
+    """
+    applied, ledger = debit_charges(seller_id, charges)
+    register_phone_numbers([ledger_row.phone for ledger_row in ledger])
+    return applied
+
+
+@retry_on_conflict("bulk_charge")
+def debit_charges(seller_id, charges):
+    """The transaction of apply_charges, returns which charges were applied and their new ledger rows"""
+    with transaction.atomic():
+        seller = Seller.objects.select_for_update().get(id=seller_id)
+        buckets = []
+        if seller.credit_stripes:
+            buckets = list(SellerCreditBucket.objects.select_for_update().filter(seller=seller).order_by("index"))
+
+        idempotency_keys = {charge["idempotency_key"] for charge in charges if charge.get("idempotency_key")}
+        charged_keys = set()
+        if idempotency_keys:
+            charged_keys = set(Transaction.objects.filter(seller=seller, idempotency_key__in=idempotency_keys).
+                               values_list("idempotency_key", flat=True))
+
+        available_credit = seller.credit + sum(bucket.credit for bucket in buckets)
+        remaining_credit = available_credit
+        applied = []
+        ledger = []
+        for charge in charges:
+            idempotency_key = charge.get("idempotency_key")
+            if idempotency_key in charged_keys:
+                applied.append(True)
+                continue
+            if charge["amount"] > remaining_credit:
+                applied.append(False)
+                continue
+            remaining_credit -= charge["amount"]
+            applied.append(True)
+            if idempotency_key:
+                charged_keys.add(idempotency_key)
+            ledger.append(Transaction(
+                seller=seller,
+                amount=charge["amount"],
+                phone=charge["phone"],
+                transaction_type=Transaction.SELLING,
+                idempotency_key=idempotency_key,
+            ))
+
+        if ledger:
+            Transaction.objects.bulk_create(ledger)
+            if buckets:
+                drain_buckets(buckets, available_credit - remaining_credit)
+                Seller.objects.filter(id=seller.id).update(**ledger_totals_update(ledger))
+            else:
+                Seller.objects.filter(id=seller.id).update(credit=F("credit") - (available_credit - remaining_credit),
+                                                           **ledger_totals_update(ledger))
+
+    return applied, ledger
+
+
+def perform_bulk_charge(seller_id, charges, striped=False):
+    if settings.CHARGE_ENGINE == "reserved" and not striped:
+        # The mirror is the seller's credit on this engine, Seller.credit lags the unflushed reservations
+        applied = [reserve_credit(seller_id, charge["phone"], charge["amount"], charge.get("idempotency_key"))
+                   for charge in charges]
+    else:
+        applied = apply_charges(seller_id, charges)
+    return [
+        {
+            "phone": charge["phone"],
+            "amount": charge["amount"],
+            "success": is_applied,
+            "message": 'Selling charge has been done successfully' if is_applied else 'Insufficient credit',
+        }
+        for charge, is_applied in zip(charges, applied)
+    ]
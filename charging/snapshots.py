@@ -0,0 +1,129 @@
+"""
+Point-in-time seller balances.
+
+snapshot_balances records, for every UTC midnight since the last run, each seller's
+ledger balance over the rows older than it as a SellerBalanceSnapshot. A snapshot
+is computed backwards, the seller's running ledger totals minus the rows since the
+midnight, in one statement whose snapshot keeps both consistent; so it only reads
+the recent rows and never the archived ones. Midnights younger than the settling
+lag wait for the next run, when no ledger row older than them can still commit.
+
+balance_at answers "the balance at moment T" from the nearest snapshot before T
+plus the ledger rows between the two, or, before the seller's first snapshot,
+backwards from the running totals.
+"""
+import datetime
+
+from django.db import connection
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+
+from charging.archive import iter_archived_rows
+from charging.models import Seller, SellerCreditBucket, Transaction, SellerBalanceSnapshot
+
+BALANCE_AT_SQL = f"""
+    SELECT seller.id AS seller_id,
+           seller.total_deposit + COALESCE(buckets.total_deposit, 0)
+               - seller.total_sell - COALESCE(buckets.total_sell, 0) - COALESCE(later.net, 0) AS balance,
+           seller.tx_count + COALESCE(buckets.tx_count, 0) - COALESCE(later.tx_count, 0) AS tx_count
+    FROM {Seller._meta.db_table} seller
+    LEFT JOIN (
+        SELECT seller_id, SUM(total_deposit) AS total_deposit, SUM(total_sell) AS total_sell,
+               SUM(tx_count) AS tx_count
+        FROM {SellerCreditBucket._meta.db_table}
+        WHERE %(seller_id)s IS NULL OR seller_id = %(seller_id)s
+        GROUP BY seller_id
+    ) buckets ON buckets.seller_id = seller.id
+    LEFT JOIN (
+        SELECT seller_id,
+               SUM(CASE WHEN transaction_type = %(deposit)s THEN amount ELSE -amount END) AS net,
+               COUNT(*) AS tx_count
+        FROM {Transaction._meta.db_table}
+        WHERE timestamp >= %(as_of)s AND (%(seller_id)s IS NULL OR seller_id = %(seller_id)s)
+        GROUP BY seller_id
+    ) later ON later.seller_id = seller.id
+    WHERE %(seller_id)s IS NULL OR seller.id = %(seller_id)s
+"""
+
+SNAPSHOT_SQL = f"""
+    INSERT INTO {SellerBalanceSnapshot._meta.db_table} (seller_id, as_of, balance, tx_count, created_at)
+    SELECT seller_id, %(as_of)s, balance, tx_count, now()
+    FROM ({BALANCE_AT_SQL}) balances
+    WHERE tx_count > 0
+    ON CONFLICT (seller_id, as_of) DO NOTHING
+"""
+
+
+def balance_params(as_of, seller_id=None):
+    return {"as_of": as_of, "seller_id": seller_id, "deposit": Transaction.DEPOSIT}
+
+
+def utc_midnight(moment):
+    return datetime.datetime.combine(moment.astimezone(datetime.timezone.utc).date(), datetime.time.min,
+                                     tzinfo=datetime.timezone.utc)
+
+
+def due_snapshot_times(lag, now=None):
+    """
+    The settled midnights after the latest snapshot, oldest first; only the latest
+    settled one on the first run, older ledger rows may already be archived.
+    """
+    last_settled = utc_midnight((now or timezone.now()) - datetime.timedelta(seconds=lag))
+    latest = SellerBalanceSnapshot.objects.aggregate(latest=Max("as_of"))["latest"]
+    if latest is None:
+        return [last_settled]
+
+    times = []
+    as_of = latest + datetime.timedelta(days=1)
+    while as_of <= last_settled:
+        times.append(as_of)
+        as_of += datetime.timedelta(days=1)
+    return times
+
+
+def take_snapshots(as_of):
+    """Snapshots every seller with ledger rows older than as_of, returns the number of new snapshots"""
+    with connection.cursor() as cursor:
+        cursor.execute(SNAPSHOT_SQL, balance_params(as_of))
+        return cursor.rowcount
+
+
+def snapshot_balances(lag, now=None, progress=None):
+    """Takes the due snapshots, returns the midnights snapshotted"""
+    times = due_snapshot_times(lag, now)
+    for as_of in times:
+        count = take_snapshots(as_of)
+        if progress:
+            progress(as_of, count)
+    return times
+
+
+def archived_net(seller_id, filters):
+    """Deposits minus sells of the seller's archived ledger rows matching the filters"""
+    return sum(row.amount if row.transaction_type == Transaction.DEPOSIT else -row.amount
+               for row in iter_archived_rows(seller_id, filters))
+
+
+def ledger_net(seller_id, filters):
+    """Deposits minus sells of the seller's hot and archived ledger rows matching the filters"""
+    sums = Transaction.objects.filter(seller_id=seller_id, **filters).aggregate(
+        deposit=Sum("amount", filter=Q(transaction_type=Transaction.DEPOSIT)),
+        sell=Sum("amount", filter=Q(transaction_type=Transaction.SELLING)),
+    )
+    return (sums["deposit"] or 0) - (sums["sell"] or 0) + archived_net(seller_id, filters)
+
+
+def balance_at(seller_id, moment):
+    """The seller's ledger balance over its ledger rows older than moment"""
+    snapshot = SellerBalanceSnapshot.objects.filter(seller_id=seller_id, as_of__lte=moment). \
+        order_by("-as_of").values_list("as_of", "balance").first()
+    if snapshot:
+        as_of, balance = snapshot
+        return balance + ledger_net(seller_id, {"timestamp__gte": as_of, "timestamp__lt": moment})
+
+    with connection.cursor() as cursor:
+        cursor.execute(BALANCE_AT_SQL, balance_params(moment, seller_id))
+        _, balance, _ = cursor.fetchone()
+    # Archived rows are gone from the hot table the statement reads
+    return balance - archived_net(seller_id, {"timestamp__gte": moment})
+
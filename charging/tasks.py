@@ -0,0 +1,49 @@
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction, OperationalError
+from kombu.exceptions import OperationalError as BrokerError
+
+from charging.services import queue_admin_action, apply_queued_admin_actions, stale_queued_seller_ids
+
+logger = logging.getLogger('elastic_logger')
+
+
+@shared_task(acks_late=True, autoretry_for=(OperationalError,), retry_backoff=True, max_retries=5)
+def process_deposit_queue(seller_id):
+    """Applies the seller's queued admin actions, a batch of them per transaction"""
+    return apply_queued_admin_actions(seller_id)
+
+
+@shared_task
+def requeue_stale_deposit_actions():
+    """
+    Enqueues the sellers of actions queued longer than DEPOSIT_QUEUE_STALE_AFTER
+    seconds ago, whose message was never published or got lost. Run by celery beat.
+    """
+    seller_ids = stale_queued_seller_ids(settings.DEPOSIT_QUEUE_STALE_AFTER)
+    for seller_id in seller_ids:
+        publish_deposit_queue(seller_id)
+    return len(seller_ids)
+
+
+def publish_deposit_queue(seller_id):
+    """The queued actions are committed already, a broker outage leaves them to the sweeper"""
+    try:
+        process_deposit_queue.apply_async((seller_id,), retry=True)
+    except BrokerError as e:
+        logger.warning(f"Deposit queue of seller {seller_id} could not be published, left to the sweeper: {e}")
+
+
+def enqueue_admin_action(credit_request, status, admin_user, version=None):
+    """
+    Queues the action on the credit request to the deposit workers once the current
+    transaction commits, returns the request's new queued_at and version, or None
+    when it was already queued or processed, or is not at version anymore.
+    """
+    with transaction.atomic():
+        queued = queue_admin_action(credit_request.id, status, admin_user, version)
+        if queued:
+            transaction.on_commit(lambda: publish_deposit_queue(credit_request.seller_id))
+    return queued
@@ -0,0 +1,93 @@
+import datetime
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from charging.archive import archive_ledger, archive_storage, read_part
+from charging.models import Seller, Transaction, CreditRequest, LedgerArchive
+from charging.reconciliation import reconcile_seller
+from charging.rollups import rollup_ledger
+from charging.services import perform_charge, apply_admin_action_on_seller_request_for_credit
+
+User = get_user_model()
+
+
+class LedgerArchiveTest(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        storage_settings = override_settings(LEDGER_ARCHIVE_STORAGE="django.core.files.storage.FileSystemStorage",
+                                             MEDIA_ROOT=self.media_root)
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=10000)
+        apply_admin_action_on_seller_request_for_credit(credit_request, {"status": CreditRequest.APPROVED,
+                                                                         "is_processed": True})
+        for i in range(6):
+            perform_charge(self.seller.id, f"0912345{i:04d}", 100)
+
+        # The deposit and three charges happened two years ago, spread over two months
+        two_years_ago = timezone.now() - datetime.timedelta(days=730)
+        for position, ledger_row in enumerate(Transaction.objects.order_by("id")[:4]):
+            Transaction.objects.filter(id=ledger_row.id).update(
+                timestamp=two_years_ago + datetime.timedelta(days=20 * position))
+
+        self.ledger = list(Transaction.objects.order_by("-timestamp", "-id").values_list("id", flat=True))
+        reconcile_seller(self.seller.id)
+        rollup_ledger(chunk_size=100, lag=0)
+
+    def test_old_reconciled_rows_move_to_the_archive(self):
+        archives = archive_ledger()
+
+        self.assertEqual(sum(archive.row_count for archive in archives), 4)
+        self.assertEqual(len({archive.month for archive in archives}), len(archives))
+        self.assertEqual(Transaction.objects.count(), 3)
+
+        archived = [row for archive in LedgerArchive.objects.order_by("month") for row in read_part(archive)]
+        self.assertEqual([row.id for row in archived], sorted(self.ledger[3:]))
+        self.assertEqual(archived[0].transaction_type, Transaction.DEPOSIT)
+        self.assertTrue(all(archive_storage().exists(archive.path) for archive in archives))
+
+        self.assertTrue(reconcile_seller(self.seller.id)["totals_match"])
+        self.assertEqual(archive_ledger(), [])
+
+    def test_rows_after_the_checkpoint_stay_hot(self):
+        perform_charge(self.seller.id, "09123450099", 100)
+        late_row = Transaction.objects.latest("id")
+        Transaction.objects.filter(id=late_row.id).update(timestamp=timezone.now() - datetime.timedelta(days=700))
+        rollup_ledger(chunk_size=100, lag=0)
+
+        archive_ledger()
+
+        self.assertEqual(list(Transaction.objects.filter(timestamp__lt=timezone.now() - datetime.timedelta(days=365)).
+                              values_list("id", flat=True)), [late_row.id])
+
+    def test_history_pages_read_through_the_archive(self):
+        archive_ledger()
+
+        ids, url = [], reverse("tabdil:charging:show_transaction") + "?page_size=2"
+        while url:
+            response = self.client.get(url)
+            ids += [row["id"] for row in response.data["results"]]
+            url = response.data["next"]
+
+        self.assertEqual(ids, self.ledger)
+
+    def test_export_reads_through_the_archive(self):
+        archive_ledger()
+
+        response = self.client.get(reverse("tabdil:charging:export_transaction"))
+        lines = b"".join(response.streaming_content).decode().splitlines()[1:]
+
+        self.assertEqual([int(line.split(",")[0]) for line in lines], list(reversed(self.ledger)))
@@ -0,0 +1,81 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase, AsyncClient
+from django.urls import reverse
+from rest_framework import status
+
+from charging.models import Seller, Transaction
+from charging.utils import idempotency_cache_key
+
+User = get_user_model()
+
+
+class AsyncChargingViewTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user, credit=10000)
+
+        response = self.client.post(reverse("tabdil:accounts:login"), {
+            "user_identifier": "2700110595",
+            "password": "testpassword1"
+        })
+        self.headers = {"Authorization": f"Token {response.data['data']['access']}"}
+        self.async_client = AsyncClient()
+
+    async def test_sell_charge(self):
+        response = await self.async_client.post(reverse("tabdil:charging:async_sell_charge"),
+                                                {"phone": "09123456789", "amount": 4000},
+                                                content_type="application/json", headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()["success"])
+
+        seller = await Seller.objects.aget(id=self.seller.id)
+        self.assertEqual(seller.credit, 6000)
+        self.assertEqual(await Transaction.objects.filter(seller=seller).acount(), 1)
+
+    async def test_sell_charge_insufficient_credit(self):
+        response = await self.async_client.post(reverse("tabdil:charging:async_sell_charge"),
+                                                {"phone": "09123456789", "amount": 20000},
+                                                content_type="application/json", headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()["message"], "Insufficient credit")
+
+    async def test_unexpected_charge_failures_are_not_stored(self):
+        self.async_client.raise_request_exception = False
+        with mock.patch("charging.async_views.perform_charge", side_effect=ValueError("Credit mirror not loaded")):
+            response = await self.async_client.post(reverse("tabdil:charging:async_sell_charge"),
+                                                    {"phone": "09123456789", "amount": 4000},
+                                                    content_type="application/json", headers=self.headers,
+                                                    HTTP_IDEMPOTENCY_KEY="charge-1")
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertIsNone(await caches['default'].aget(idempotency_cache_key("sell_charge", self.user.id,
+                                                                              "charge-1")))
+
+    async def test_sell_charge_invalid_phone(self):
+        response = await self.async_client.post(reverse("tabdil:charging:async_sell_charge"),
+                                                {"phone": "123456", "amount": 1000},
+                                                content_type="application/json", headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("phone", response.json())
+
+    async def test_sell_charge_malformed_json(self):
+        response = await self.async_client.post(reverse("tabdil:charging:async_sell_charge"), '{"phone": ',
+                                                content_type="application/json", headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(response.json()["detail"].startswith("JSON parse error"))
+
+    async def test_show_credit(self):
+        response = await self.async_client.get(reverse("tabdil:charging:async_show_credit"), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"user": "testemail1@yahoo.com", "credit": 10000})
+
+    async def test_missing_token_is_rejected(self):
+        response = await self.async_client.get(reverse("tabdil:charging:async_show_credit"))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_wrong_method_is_rejected(self):
+        response = await self.async_client.get(reverse("tabdil:charging:async_sell_charge"), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -0,0 +1,189 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+
+from charging.coalescer import get_batch_size_histogram, reset_batch_size_histogram, get_charge_coalescer
+from charging.models import Seller, Transaction, PhoneNumber
+from charging.phone_registry import phone_number_registry
+from charging.services import perform_charge
+
+User = get_user_model()
+
+
+@override_settings(CHARGE_ENGINE="conditional")
+class ConditionalChargeEngineTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user, credit=10000)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("tabdil:charging:sell_charge")
+
+    def test_successful_sell_charge(self):
+        response = self.client.post(self.url, {"phone": "09123456789", "amount": 4000})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 6000)
+
+        transaction = Transaction.objects.get(seller=self.seller)
+        self.assertEqual(transaction.amount, 4000)
+        self.assertEqual(transaction.phone, "09123456789")
+        self.assertEqual(transaction.transaction_type, Transaction.SELLING)
+        self.assertTrue(PhoneNumber.objects.filter(phone_number="09123456789").exists())
+
+    def test_insufficient_credit(self):
+        response = self.client.post(self.url, {"phone": "09123456789", "amount": 20000})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["message"], "Insufficient credit")
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 10000)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_exact_credit_is_allowed(self):
+        perform_charge(self.seller.id, "09123456789", 10000)
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 0)
+        with self.assertRaises(ValueError):
+            perform_charge(self.seller.id, "09123456789", 1)
+
+
+def threaded_charge(seller_id, index, amount):
+    try:
+        perform_charge(seller_id, f'0912{index:07d}', amount)
+        return True
+    except ValueError:
+        return False
+    finally:
+        connection.close()
+
+
+@override_settings(CHARGE_ENGINE="coalesced", CHARGE_COALESCE_WINDOW=0.05)
+class CoalescedChargeEngineTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            national_id="2700110595",
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.seller = Seller.objects.create(user=self.user, credit=1000)
+        reset_batch_size_histogram()
+        phone_number_registry.clear()
+
+    def run_concurrent_charges(self, num_charges, amount):
+        with ThreadPoolExecutor(max_workers=num_charges) as executor:
+            futures = [executor.submit(threaded_charge, self.seller.id, i, amount) for i in range(num_charges)]
+            return [future.result() for future in as_completed(futures)]
+
+    def assert_batches_coalesced(self, num_charges, results):
+        self.seller.refresh_from_db()
+        self.assertEqual(results.count(True), 10)
+        self.assertEqual(self.seller.credit, 0)
+        self.assertEqual(Transaction.objects.filter(seller=self.seller).count(), 10)
+
+        histogram = get_batch_size_histogram()
+        self.assertEqual(sum(size * count for size, count in histogram.items()), num_charges)
+        self.assertLess(sum(histogram.values()), num_charges)
+
+    def test_local_backend_rejects_charges_beyond_credit(self):
+        with override_settings(CHARGE_COALESCER_BACKEND="local"):
+            results = self.run_concurrent_charges(20, 100)
+        self.assert_batches_coalesced(20, results)
+
+    def test_redis_backend_rejects_charges_beyond_credit(self):
+        with override_settings(CHARGE_COALESCER_BACKEND="redis"):
+            results = self.run_concurrent_charges(20, 100)
+        self.assert_batches_coalesced(20, results)
+
+
+class ChargeCoalescerSettingsTest(SimpleTestCase):
+    def test_coalescer_follows_the_window_setting(self):
+        with override_settings(CHARGE_COALESCER_BACKEND="local", CHARGE_COALESCE_WINDOW=0.01):
+            self.assertEqual(get_charge_coalescer().window, 0.01)
+        with override_settings(CHARGE_COALESCER_BACKEND="local", CHARGE_COALESCE_WINDOW=0.02):
+            self.assertEqual(get_charge_coalescer().window, 0.02)
+
+
+def timed_charge_worker(args):
+    """Worker function measuring the latency of one sell_charge request"""
+    process_id, user_id, amount, url = args
+
+    connection.close()
+
+    user = User.objects.get(id=user_id)
+    client = APIClient()
+    client.force_authenticate(user=user)
+
+    start_time = time.monotonic()
+    response = client.post(url, {'phone': f'0912{process_id:07d}', 'amount': amount}, format='json')
+    elapsed = time.monotonic() - start_time
+
+    return {
+        'process_id': process_id,
+        'success': response.data.get('success', False) if hasattr(response, 'data') else False,
+        'elapsed': elapsed,
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class ChargeEngineLatencyTestCase(TransactionTestCase):
+    """
+    Runs the same hot-seller scenario against every charge engine and prints
+    p50/p99 latency so the engines can be compared on the same machine.
+    """
+
+    num_requests = 300
+    max_workers = 30
+    request_amount = 100
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            national_id="2700110595",
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.seller = Seller.objects.create(user=self.user)
+        self.url = reverse('tabdil:charging:sell_charge')
+        phone_number_registry.clear()
+
+    def run_scenario(self):
+        Seller.objects.filter(id=self.seller.id).update(credit=self.num_requests * self.request_amount // 2)
+        Transaction.objects.all().delete()
+
+        process_args = [(i, self.user.id, self.request_amount, self.url) for i in range(self.num_requests)]
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(timed_charge_worker, args) for args in process_args]
+            results = [future.result() for future in as_completed(futures)]
+
+        connection.close()
+        return results
+
+    def test_hot_seller_latency_per_engine(self):
+        for engine in ("locking", "conditional", "coalesced"):
+            with self.subTest(engine=engine), override_settings(CHARGE_ENGINE=engine):
+                results = self.run_scenario()
+                latencies = [r['elapsed'] for r in results]
+                successful = [r for r in results if r['success']]
+
+                print(f"{engine} engine:")
+                print(f"  Successful: {len(successful)} / {len(results)}")
+                print(f"  p50: {percentile(latencies, 0.50) * 1000:.1f} ms")
+                print(f"  p99: {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+                self.seller.refresh_from_db()
+                self.assertEqual(len(successful), self.num_requests // 2)
+                self.assertEqual(self.seller.credit, 0)
+                self.assertEqual(Transaction.objects.filter(seller=self.seller).count(), len(successful))
@@ -0,0 +1,83 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Max
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from charging.models import Seller, Transaction, CreditRequest, ReconciliationCheckpoint
+from charging.reservations import apply_reservations
+from charging.services import perform_charge, apply_charges, enable_credit_striping, disable_credit_striping, \
+    apply_admin_action_on_seller_request_for_credit
+
+User = get_user_model()
+
+
+class LedgerTotalsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.admin_user = User.objects.create_user(email='testemail2@yahoo.com', national_id="2700110596",
+                                                   password='testpassword2')
+        self.seller = Seller.objects.create(user=self.user)
+        self.client.force_authenticate(user=self.user)
+        self.deposit(10000)
+
+    def deposit(self, amount):
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=amount)
+        apply_admin_action_on_seller_request_for_credit(credit_request, {
+            "status": CreditRequest.APPROVED, "is_processed": True, "admin_user": self.admin_user})
+
+    def check_transaction(self):
+        response = self.client.get(reverse("tabdil:charging:check_transaction"), {"deep": "true"})
+        self.assertTrue(response.data["equal"])
+        self.assertTrue(response.data["data"]["totals_match"])
+        self.assertEqual(response.data["data"]["last_tx_id"],
+                         Transaction.objects.filter(seller=self.seller).aggregate(last=Max("id"))["last"])
+        return response.data["data"]
+
+    def test_totals_follow_every_charge_engine(self):
+        for engine in ("locking", "conditional"):
+            with override_settings(CHARGE_ENGINE=engine):
+                perform_charge(self.seller.id, "09123456789", 1000)
+        apply_charges(self.seller.id, [{"phone": "09123456788", "amount": 500},
+                                       {"phone": "09123456787", "amount": 50000}])
+        apply_reservations([{"key": "rsv-1", "seller_id": self.seller.id, "phone": "09123456786", "amount": 250}])
+
+        data = self.check_transaction()
+        self.assertEqual(data["charge"], 10000)
+        self.assertEqual(data["sell"], 2750)
+        self.assertEqual(data["tx_count"], 5)
+        self.assertEqual(data["seller_credit"], 7250)
+
+    def test_totals_follow_striped_credit(self):
+        enable_credit_striping(self.seller.id, 4)
+        perform_charge(self.seller.id, "09123456789", 1000, striped=True)
+        perform_charge(self.seller.id, "09123456789", 6000, striped=True)
+        self.deposit(100)
+        self.assertEqual(self.check_transaction()["tx_count"], 4)
+
+        disable_credit_striping(self.seller.id)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.total_sell, 7000)
+        self.assertEqual(self.seller.total_deposit, 10100)
+        self.assertEqual(self.check_transaction()["seller_credit"], 3100)
+
+    def test_check_transaction_reads_no_ledger_by_default(self):
+        self.seller.refresh_from_db()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("tabdil:charging:check_transaction"))
+        self.assertNotIn("ledger", response.data["data"])
+        self.assertEqual(response.data["data"]["transaction_balance"], 10000)
+
+    def test_deep_mode_reports_diverged_totals(self):
+        Transaction.objects.create(seller=self.seller, amount=5, transaction_type=Transaction.SELLING)
+
+        response = self.client.get(reverse("tabdil:charging:check_transaction"), {"deep": "1"})
+        self.assertFalse(response.data["data"]["totals_match"])
+        self.assertEqual(response.data["data"]["ledger"]["sell"], 5)
+
+    def test_deep_mode_records_no_checkpoint(self):
+        perform_charge(self.seller.id, "09123456789", 1000)
+
+        self.assertEqual(self.check_transaction()["tx_count"], 2)
+        self.assertFalse(ReconciliationCheckpoint.objects.filter(seller=self.seller).exists())
@@ -0,0 +1,141 @@
+from django.contrib.auth import get_user_model
+from django.db import OperationalError
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from psycopg2 import errorcodes
+
+from charging.models import Seller, Transaction, CreditRequest
+from charging.retry import ConcurrentUpdate, retry_on_conflict, get_retry_stats, reset_retry_stats
+from charging.services import perform_charge, OptimisticChargeStrategy, apply_admin_action_on_seller_request_for_credit
+
+User = get_user_model()
+
+
+class SerializationFailure(Exception):
+    pgcode = errorcodes.SERIALIZATION_FAILURE
+
+
+@override_settings(CHARGE_ENGINE="optimistic", CONFLICT_RETRY_BASE_DELAY=0, CONFLICT_RETRY_MAX_DELAY=0)
+class OptimisticChargeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user, credit=1000)
+        reset_retry_stats()
+
+    def test_charge_swaps_the_seller_version(self):
+        version = Seller.objects.get(id=self.seller.id).version
+
+        perform_charge(self.seller.id, "09123456789", 300)
+
+        self.seller.refresh_from_db()
+        ledger_row = Transaction.objects.get(seller=self.seller)
+        self.assertEqual((self.seller.credit, self.seller.total_sell, self.seller.tx_count), (700, 300, 1))
+        self.assertEqual(self.seller.last_tx_id, ledger_row.id)
+        self.assertEqual(self.seller.version, version + 1)
+
+    def test_stale_version_misses(self):
+        version = self.seller.version
+        Seller.objects.filter(id=self.seller.id).update(credit=500)
+
+        self.assertIsNone(OptimisticChargeStrategy().compare_and_swap(self.seller.id, version, "09123456789", 300))
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 500)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_insufficient_credit(self):
+        with self.assertRaises(ValueError):
+            perform_charge(self.seller.id, "09123456789", 5000)
+
+    def test_every_update_bumps_the_version(self):
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=100)
+
+        apply_admin_action_on_seller_request_for_credit(credit_request, {"status": CreditRequest.APPROVED})
+
+        self.assertEqual(Seller.objects.get(id=self.seller.id).version, self.seller.version + 1)
+        self.assertEqual(CreditRequest.objects.get(id=credit_request.id).version, credit_request.version + 1)
+
+    def test_approval_at_a_stale_version_is_refused(self):
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=100)
+        CreditRequest.objects.filter(id=credit_request.id).update(amount=200)
+
+        state = apply_admin_action_on_seller_request_for_credit(
+            credit_request, {"status": CreditRequest.APPROVED, "version": credit_request.version})
+
+        self.assertIsNone(state)
+        self.assertEqual(Seller.objects.get(id=self.seller.id).credit, 1000)
+
+
+@override_settings(CONFLICT_RETRY_ATTEMPTS=3, CONFLICT_RETRY_BASE_DELAY=0, CONFLICT_RETRY_MAX_DELAY=0)
+class RetryOnConflictTest(TestCase):
+    def setUp(self):
+        reset_retry_stats()
+
+    def test_conflicts_are_retried_and_counted(self):
+        calls = []
+
+        @retry_on_conflict("test")
+        def operation():
+            calls.append(None)
+            if len(calls) < 3:
+                raise ConcurrentUpdate()
+            return "done"
+
+        self.assertEqual(operation(), "done")
+        self.assertEqual(get_retry_stats(), {"test:retries": 2})
+
+    def test_gives_up_after_the_last_attempt(self):
+        @retry_on_conflict("test")
+        def operation():
+            raise ConcurrentUpdate()
+
+        with self.assertRaises(ConcurrentUpdate):
+            operation()
+        self.assertEqual(get_retry_stats(), {"test:retries": 2, "test:exhausted": 1})
+
+    def test_database_errors_inside_an_outer_transaction_are_not_retried(self):
+        calls = []
+
+        @retry_on_conflict("test")
+        def operation():
+            calls.append(None)
+            error = OperationalError("could not serialize access")
+            error.__cause__ = SerializationFailure()
+            raise error
+
+        # TestCase runs every test in a transaction, a serialization failure aborts it whole
+        with self.assertRaises(OperationalError):
+            operation()
+        self.assertEqual(len(calls), 1)
+
+    def test_other_errors_are_not_retried(self):
+        calls = []
+
+        @retry_on_conflict("test")
+        def operation():
+            calls.append(None)
+            raise ValueError("Insufficient credit")
+
+        with self.assertRaises(ValueError):
+            operation()
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(CHARGE_ENGINE="locking", CONFLICT_RETRY_BASE_DELAY=0, CONFLICT_RETRY_MAX_DELAY=0)
+class CommittedChargeTest(TransactionTestCase):
+    def test_a_conflict_after_the_debit_committed_is_not_retried(self):
+        user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                        password='testpassword1')
+        seller = Seller.objects.create(user=user, credit=1000)
+        error = OperationalError("deadlock detected")
+        error.__cause__ = SerializationFailure()
+
+        with mock.patch("charging.services.register_phone_numbers", side_effect=error):
+            with self.assertRaises(OperationalError):
+                perform_charge(seller.id, "09123456789", 300)
+
+        seller.refresh_from_db()
+        self.assertEqual(seller.credit, 700)
+        self.assertEqual(Transaction.objects.count(), 1)
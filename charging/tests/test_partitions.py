@@ -0,0 +1,71 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase
+
+from charging.models import Seller, Transaction
+from charging.partitions import create_partition, create_upcoming_partitions, list_partitions, partition_name, \
+    DEFAULT_PARTITION
+
+User = get_user_model()
+
+
+def rows_in(table):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT id FROM {table}")
+        return [row[0] for row in cursor.fetchall()]
+
+
+class LedgerPartitionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user, credit=10000)
+        self.old_month = datetime.datetime(2001, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def create_transaction(self, timestamp=None, **kwargs):
+        ledger_row = Transaction.objects.create(seller=self.seller, amount=100, phone="09123456789",
+                                                transaction_type=Transaction.SELLING, **kwargs)
+        if timestamp:
+            Transaction.objects.filter(id=ledger_row.id).update(timestamp=timestamp)
+        return ledger_row
+
+    def test_current_month_has_a_partition(self):
+        ledger_row = self.create_transaction()
+
+        self.assertIn(partition_name(ledger_row.timestamp), list_partitions())
+        self.assertEqual(rows_in(partition_name(ledger_row.timestamp)), [ledger_row.id])
+        self.assertEqual(list(Transaction.objects.filter(seller=self.seller)), [ledger_row])
+
+    def test_creating_a_partition_moves_its_rows_out_of_the_default_partition(self):
+        old_row = self.create_transaction(timestamp=self.old_month + datetime.timedelta(days=3))
+        self.assertEqual(rows_in(DEFAULT_PARTITION), [old_row.id])
+
+        self.assertTrue(create_partition(self.old_month))
+        self.assertFalse(create_partition(self.old_month))
+
+        self.assertEqual(rows_in(DEFAULT_PARTITION), [])
+        self.assertEqual(rows_in(partition_name(self.old_month)), [old_row.id])
+        self.assertTrue(Transaction.objects.filter(id=old_row.id).exists())
+
+    def test_upcoming_partitions_are_created(self):
+        now = datetime.datetime(2001, 11, 15, tzinfo=datetime.timezone.utc)
+
+        created = create_upcoming_partitions(2, now=now)
+
+        self.assertEqual(created, ["charging_transaction_y2001m11", "charging_transaction_y2001m12",
+                                   "charging_transaction_y2002m01"])
+
+    def test_idempotency_key_is_unique_per_seller_across_partitions(self):
+        self.create_transaction(timestamp=self.old_month, idempotency_key="charge-1")
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.create_transaction(idempotency_key="charge-1")
+
+        other_user = User.objects.create_user(email='testemail2@yahoo.com', national_id="2700110596",
+                                              password='testpassword2')
+        other_seller = Seller.objects.create(user=other_user)
+        Transaction.objects.create(seller=other_seller, amount=100, transaction_type=Transaction.DEPOSIT,
+                                   idempotency_key="charge-1")
+        self.assertEqual(Transaction.objects.filter(idempotency_key="charge-1").count(), 2)
@@ -0,0 +1,51 @@
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TestCase
+
+from charging.models import PhoneNumber
+from charging.phone_registry import PhoneNumberRegistry
+
+
+class PhoneNumberRegistryTest(TestCase):
+    def setUp(self):
+        self.registry = PhoneNumberRegistry(max_size=2, stats_interval=0)
+
+    def test_known_numbers_cost_no_query(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(1):
+                self.registry.register(["09123456789", "09123456788"])
+
+        with self.assertNumQueries(0):
+            self.registry.register(["09123456789"])
+
+        self.assertEqual(PhoneNumber.objects.count(), 2)
+        self.assertEqual(self.registry.stats(), {"hits": 1, "misses": 2, "hit_rate": 1 / 3, "size": 2})
+
+    def test_existing_number_does_not_conflict(self):
+        PhoneNumber.objects.create(phone_number="09123456789")
+
+        self.registry.register(["09123456789"])
+
+        self.assertEqual(PhoneNumber.objects.filter(phone_number="09123456789").count(), 1)
+
+    def test_least_recently_used_number_is_evicted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.registry.register(["09123456781"])
+            self.registry.register(["09123456782"])
+            self.registry.register(["09123456781"])
+            self.registry.register(["09123456783"])
+
+        self.assertEqual(list(self.registry.known), ["09123456781", "09123456783"])
+
+    def test_rolled_back_number_is_not_remembered(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            self.registry.register(["09123456789"])
+
+        self.assertEqual(self.registry.stats()["size"], 0)
+
+    def test_failed_registration_is_logged_not_raised(self):
+        with mock.patch.object(PhoneNumber.objects, "bulk_create", side_effect=OperationalError("deadlock detected")):
+            self.registry.register(["09123456789"])
+
+        self.assertEqual(self.registry.stats()["size"], 0)
@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command, CommandError
+from django.test import TestCase, TransactionTestCase
+
+from charging.models import Seller, Transaction, CreditRequest, ReconciliationCheckpoint
+from charging.reconciliation import reconcile_seller, reconcile_seller_range
+from charging.services import perform_charge, apply_admin_action_on_seller_request_for_credit
+
+User = get_user_model()
+
+
+class ReconciliationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user)
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=10000)
+        apply_admin_action_on_seller_request_for_credit(credit_request, {"status": CreditRequest.APPROVED,
+                                                                         "is_processed": True})
+
+    def test_matching_ledger_advances_the_checkpoint(self):
+        perform_charge(self.seller.id, "09123456789", 1000)
+
+        report = reconcile_seller(self.seller.id)
+        self.assertTrue(report["equal"])
+        self.assertEqual(report["summed_rows"], 2)
+        self.assertIsNone(report["diverged_tx_ids"])
+
+        checkpoint = ReconciliationCheckpoint.objects.get(seller=self.seller)
+        self.assertEqual(checkpoint.balance, 9000)
+        self.assertEqual(checkpoint.last_tx_id, Transaction.objects.latest("id").id)
+
+        perform_charge(self.seller.id, "09123456789", 500)
+        report = reconcile_seller(self.seller.id)
+        self.assertEqual(report["summed_rows"], 1)
+        self.assertEqual(report["checkpoint_tx_id"], checkpoint.last_tx_id)
+        self.assertEqual(ReconciliationCheckpoint.objects.filter(seller=self.seller).count(), 2)
+
+    def test_only_rows_after_the_checkpoint_are_summed(self):
+        reconcile_seller(self.seller.id)
+        # A row the checkpoint already covers is not looked at again
+        Transaction.objects.filter(seller=self.seller).update(amount=1)
+
+        with self.assertNumQueries(5):
+            report = reconcile_seller(self.seller.id)
+        self.assertTrue(report["totals_match"])
+        self.assertEqual(report["summed_rows"], 0)
+
+    def test_mismatch_reports_diverged_range_and_keeps_the_checkpoint(self):
+        reconcile_seller(self.seller.id)
+        checkpoint_tx_id = Transaction.objects.latest("id").id
+        perform_charge(self.seller.id, "09123456789", 1000)
+        stray = Transaction.objects.create(seller=self.seller, amount=5, transaction_type=Transaction.SELLING)
+
+        report = reconcile_seller(self.seller.id)
+        self.assertFalse(report["equal"])
+        self.assertEqual(report["diverged_tx_ids"], (checkpoint_tx_id + 1, stray.id))
+        self.assertEqual(ReconciliationCheckpoint.objects.filter(seller=self.seller).count(), 1)
+
+        with self.assertRaises(CommandError):
+            call_command("reconcile_ledger", stdout=StringIO())
+
+    def test_command_reconciles_all_sellers(self):
+        out = StringIO()
+        call_command("reconcile_ledger", stdout=out)
+
+        self.assertIn("All sellers reconciled", out.getvalue())
+        self.assertTrue(ReconciliationCheckpoint.objects.filter(seller=self.seller).exists())
+
+
+class SellerRangeReconciliationTest(TransactionTestCase):
+    def setUp(self):
+        self.sellers = []
+        for i in range(6):
+            user = User.objects.create_user(email=f'testemail{i}@yahoo.com', national_id=f"27001105{i:02d}",
+                                            password='testpassword1')
+            seller = Seller.objects.create(user=user)
+            credit_request = CreditRequest.objects.create(seller=seller, amount=1000)
+            apply_admin_action_on_seller_request_for_credit(credit_request, {"status": CreditRequest.APPROVED,
+                                                                             "is_processed": True})
+            perform_charge(seller.id, "09123456789", 100 * (i + 1))
+            self.sellers.append(seller)
+
+        self.broken = self.sellers[3]
+        Seller.objects.filter(id=self.broken.id).update(credit=1)
+
+    def test_range_matches_per_seller_reconciliation(self):
+        result = reconcile_seller_range(self.sellers[0].id, self.sellers[-1].id, advance=True)
+
+        self.assertEqual(result["sellers"], 6)
+        self.assertEqual(result["summed_rows"], 12)
+        self.assertEqual([mismatch["seller_id"] for mismatch in result["mismatches"]], [self.broken.id])
+        self.assertEqual(result["mismatches"][0]["diverged_tx_ids"],
+                         reconcile_seller(self.broken.id)["diverged_tx_ids"])
+        self.assertEqual(ReconciliationCheckpoint.objects.count(), 5)
+
+        result = reconcile_seller_range(self.sellers[0].id, self.sellers[-1].id)
+        self.assertEqual(result["summed_rows"], 2)
+
+    def test_command_fans_out_over_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            report_path = os.path.join(directory, "report.json")
+            out = StringIO()
+            with self.assertRaises(CommandError):
+                call_command("reconcile_all_sellers", workers=2, range_size=2, report=report_path, stdout=out)
+
+            with open(report_path) as file:
+                report = json.load(file)
+
+        self.assertEqual(report["sellers"], 6)
+        self.assertEqual(report["ranges"], 3)
+        self.assertEqual([mismatch["seller_id"] for mismatch in report["mismatches"]], [self.broken.id])
+        self.assertIn("[3/3]", out.getvalue())
@@ -0,0 +1,246 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from psycopg2 import errorcodes
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from charging.models import Seller, Transaction, CreditRequest, PhoneNumber, TransactionIdempotencyKey
+from charging.reservations import get_redis_client, mirror_key, flush_reservations, JOURNAL_KEY, PROCESSING_KEY, \
+    reservation_marker_key, prime_credit_mirror, invalidate_credit_mirror, reserve_credit, credit_mirror_snapshot, \
+    FAILED_KEY
+from charging.reconciliation import reconcile_seller
+from charging.services import apply_admin_action_in_bulk, apply_admin_action_on_seller_request_for_credit
+
+User = get_user_model()
+
+
+class SerializationFailure(Exception):
+    pgcode = errorcodes.SERIALIZATION_FAILURE
+
+
+@override_settings(CHARGE_ENGINE="reserved")
+class ReservedChargeEngineTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user, credit=10000)
+        self.redis = get_redis_client()
+
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("tabdil:charging:sell_charge")
+
+    def tearDown(self):
+        self.redis.delete(mirror_key(self.seller.id), JOURNAL_KEY, PROCESSING_KEY, FAILED_KEY,
+                          reservation_marker_key(self.seller.id, "charge-1"))
+
+    def test_charge_reserves_credit_and_flush_writes_ledger(self):
+        response = self.client.post(self.url, {"phone": "09123456789", "amount": 4000})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(int(self.redis.get(mirror_key(self.seller.id))), 6000)
+        self.assertFalse(Transaction.objects.exists())
+
+        self.assertEqual(flush_reservations(100), 1)
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 6000)
+        transaction = Transaction.objects.get(seller=self.seller)
+        self.assertEqual(transaction.amount, 4000)
+        self.assertEqual(transaction.phone, "09123456789")
+        self.assertTrue(PhoneNumber.objects.filter(phone_number="09123456789").exists())
+
+    def test_insufficient_credit_is_rejected_by_mirror(self):
+        self.client.post(self.url, {"phone": "09123456789", "amount": 7000})
+        response = self.client.post(self.url, {"phone": "09123456789", "amount": 7000})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        flush_reservations(100)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 3000)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_crashed_flush_is_not_applied_twice(self):
+        self.client.post(self.url, {"phone": "09123456789", "amount": 1000})
+        flush_reservations(100)
+        processed = Transaction.objects.get().idempotency_key
+        self.redis.rpush(PROCESSING_KEY, '{"key": "%s", "seller_id": %d, "phone": "09123456789", "amount": 1000}'
+                         % (processed, self.seller.id))
+
+        flush_reservations(100)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 9000)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_only_the_entry_the_ledger_refuses_fails(self):
+        # The claim of a charge whose ledger row was archived, its reservation marker expired since
+        TransactionIdempotencyKey.objects.create(seller=self.seller, idempotency_key="charge-1", transaction_id=1)
+        reserve_credit(self.seller.id, "09123456789", 1000)
+        reserve_credit(self.seller.id, "09123456789", 2000, idempotency_key="charge-1")
+
+        self.assertEqual(flush_reservations(100), 2)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 9000)
+        self.assertEqual(Transaction.objects.get().amount, 1000)
+        self.assertEqual(self.redis.llen(FAILED_KEY), 1)
+
+        # The failed entry holds its credit until it is refunded
+        invalidate_credit_mirror(self.seller.id)
+        prime_credit_mirror(self.seller.id)
+        self.assertEqual(int(self.redis.get(mirror_key(self.seller.id))), 7000)
+
+        call_command("flush_credit_reservations", "--refund-failed", stdout=StringIO())
+        self.assertEqual(self.redis.llen(FAILED_KEY), 0)
+        prime_credit_mirror(self.seller.id)
+        self.assertEqual(int(self.redis.get(mirror_key(self.seller.id))), 9000)
+
+    def test_failed_entries_can_be_retried(self):
+        TransactionIdempotencyKey.objects.create(seller=self.seller, idempotency_key="charge-1", transaction_id=1)
+        reserve_credit(self.seller.id, "09123456789", 2000, idempotency_key="charge-1")
+        flush_reservations(100)
+        TransactionIdempotencyKey.objects.all().delete()
+
+        call_command("flush_credit_reservations", "--retry-failed", "--once", stdout=StringIO())
+        self.assertEqual(self.redis.llen(FAILED_KEY), 0)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 8000)
+
+    def test_bulk_charges_reserve_from_the_mirror(self):
+        self.client.post(self.url, {"phone": "09123456789", "amount": 6000})
+
+        response = self.client.post(reverse("tabdil:charging:bulk_sell_charge"),
+                                    [{"phone": "09123456780", "amount": 3000},
+                                     {"phone": "09123456781", "amount": 3000}], format="json")
+        self.assertEqual([result["success"] for result in response.data["results"]], [True, False])
+        self.assertEqual(int(self.redis.get(mirror_key(self.seller.id))), 1000)
+        self.assertFalse(Transaction.objects.exists())
+
+        flush_reservations(100)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 1000)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_replayed_idempotency_key_is_reserved_once(self):
+        data = {"phone": "09123456789", "amount": 1000}
+        self.client.post(self.url, data, HTTP_IDEMPOTENCY_KEY="charge-1")
+        self.client.post(self.url, data, HTTP_IDEMPOTENCY_KEY="charge-1")
+
+        self.assertEqual(int(self.redis.get(mirror_key(self.seller.id))), 9000)
+
+    def test_approved_deposit_reloads_the_mirror(self):
+        self.client.post(self.url, {"phone": "09123456789", "amount": 1000})
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=500)
+
+        url = reverse("tabdil:charging:admin_deposit_request_action-detail", args=[credit_request.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {"status": "A"}, format="json")
+
+        self.assertIsNone(self.redis.get(mirror_key(self.seller.id)))
+        prime_credit_mirror(self.seller.id)
+        self.assertEqual(int(self.redis.get(mirror_key(self.seller.id))), 9500)
+        flush_reservations(100)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 9500)
+
+    @override_settings(DEPOSIT_APPROVAL_QUEUE=False)
+    def test_inline_approval_reloads_the_mirror(self):
+        self.client.post(self.url, {"phone": "09123456789", "amount": 1000})
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=500)
+
+        url = reverse("tabdil:charging:admin_deposit_request_action-detail", args=[credit_request.id])
+        self.client.patch(url, {"status": "A"}, format="json")
+
+        self.assertIsNone(self.redis.get(mirror_key(self.seller.id)))
+        prime_credit_mirror(self.seller.id)
+        self.assertEqual(int(self.redis.get(mirror_key(self.seller.id))), 9500)
+        flush_reservations(100)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 9500)
+
+
+@override_settings(CHARGE_ENGINE="reserved")
+class ReconcileCreditMirrorTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user)
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=10000)
+        apply_admin_action_on_seller_request_for_credit(credit_request, {"status": CreditRequest.APPROVED,
+                                                                         "is_processed": True})
+        self.redis = get_redis_client()
+        reserve_credit(self.seller.id, "09123456789", 1000)
+
+    def tearDown(self):
+        self.redis.delete(mirror_key(self.seller.id), JOURNAL_KEY, PROCESSING_KEY)
+
+    def repair(self):
+        out = StringIO()
+        call_command("reconcile_credit_mirror", "--repair", stdout=out)
+        return out.getvalue()
+
+    def test_repair_resets_a_drifted_mirror(self):
+        self.redis.set(mirror_key(self.seller.id), 5000)
+
+        self.assertIn("mirror reset to 9000", self.repair())
+        self.assertEqual(int(self.redis.get(mirror_key(self.seller.id))), 9000)
+
+    def test_repair_keeps_a_reservation_made_while_checking(self):
+        self.redis.set(mirror_key(self.seller.id), 5000)
+
+        def snapshot_then_reserve(client, seller_id):
+            snapshot = credit_mirror_snapshot(client, seller_id)
+            reserve_credit(seller_id, "09123456789", 500)
+            return snapshot
+
+        with mock.patch("charging.management.commands.reconcile_credit_mirror.credit_mirror_snapshot",
+                        side_effect=snapshot_then_reserve):
+            self.assertIn("not reset", self.repair())
+        self.assertEqual(int(self.redis.get(mirror_key(self.seller.id))), 4500)
+
+        self.assertIn("mirror reset to 8500", self.repair())
+
+    def test_archived_ledger_rows_are_covered_by_the_checkpoint(self):
+        reconcile_seller(self.seller.id)
+        # As archive_ledger leaves it, the checkpoint covers rows no longer in the hot table
+        Transaction.objects.filter(seller=self.seller).delete()
+
+        self.assertIn("0 mismatches", self.repair())
+
+
+@override_settings(CHARGE_ENGINE="reserved", CONFLICT_RETRY_BASE_DELAY=0, CONFLICT_RETRY_MAX_DELAY=0)
+class RetriedDepositMirrorTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user, credit=10000)
+        self.redis = get_redis_client()
+
+    def tearDown(self):
+        self.redis.delete(mirror_key(self.seller.id), JOURNAL_KEY, PROCESSING_KEY)
+
+    def test_a_retried_deposit_is_counted_once(self):
+        reserve_credit(self.seller.id, "09123456789", 1000)
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=500)
+        calls = []
+
+        def invalidate_then_conflict(seller_id):
+            invalidate_credit_mirror(seller_id)
+            calls.append(seller_id)
+            if len(calls) == 1:
+                error = OperationalError("could not serialize access")
+                error.__cause__ = SerializationFailure()
+                raise error
+
+        with mock.patch("charging.services.invalidate_credit_mirror", side_effect=invalidate_then_conflict):
+            apply_admin_action_in_bulk([credit_request.id], CreditRequest.APPROVED, self.user)
+        self.assertEqual(len(calls), 2)
+
+        prime_credit_mirror(self.seller.id)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 10500)
+        self.assertEqual(int(self.redis.get(mirror_key(self.seller.id))), self.seller.credit - 1000)
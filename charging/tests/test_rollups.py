@@ -0,0 +1,88 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from charging.models import Seller, Transaction, DailySellerRollup
+from charging.rollups import rollup_ledger, get_watermark
+
+User = get_user_model()
+
+
+class DailySellerRollupTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+        self.day = datetime.date(2024, 3, 10)
+        self.add_rows(self.day, [(Transaction.DEPOSIT, 1000), (Transaction.SELLING, 100), (Transaction.SELLING, 50)])
+        self.add_rows(self.day + datetime.timedelta(days=1), [(Transaction.SELLING, 10)])
+
+    def add_rows(self, day, rows):
+        for transaction_type, amount in rows:
+            ledger_row = Transaction.objects.create(seller=self.seller, amount=amount, transaction_type=transaction_type)
+            Transaction.objects.filter(id=ledger_row.id).update(
+                timestamp=datetime.datetime.combine(day, datetime.time(23, 59), tzinfo=datetime.timezone.utc))
+
+    def rollups(self):
+        return set(DailySellerRollup.objects.values_list("day", "transaction_type", "amount_sum", "tx_count"))
+
+    def test_rollup_is_chunked_and_incremental(self):
+        progress = []
+        rollup_ledger(chunk_size=2, lag=0, progress=lambda last, up_to: progress.append(last))
+
+        self.assertEqual(len(progress), 2)
+        self.assertEqual(self.rollups(), {
+            (self.day, "C", 1000, 1),
+            (self.day, "S", 150, 2),
+            (self.day + datetime.timedelta(days=1), "S", 10, 1),
+        })
+
+        self.add_rows(self.day, [(Transaction.SELLING, 5)])
+        last_tx_id = rollup_ledger(chunk_size=2, lag=0)
+
+        self.assertEqual(last_tx_id, Transaction.objects.latest("id").id)
+        self.assertIn((self.day, "S", 155, 3), self.rollups())
+
+    def test_rows_newer_than_the_lag_wait_for_the_next_run(self):
+        rollup_ledger(chunk_size=100, lag=0)
+        Transaction.objects.create(seller=self.seller, amount=7, transaction_type=Transaction.SELLING)
+
+        watermark = rollup_ledger(chunk_size=100, lag=3600)
+
+        self.assertLess(watermark, Transaction.objects.latest("id").id)
+        self.assertEqual(DailySellerRollup.objects.filter(day=datetime.date.today()).count(), 0)
+
+    def test_interrupted_backfill_resumes_from_the_watermark(self):
+        watermark = get_watermark()
+        watermark.last_tx_id = Transaction.objects.order_by("id")[1].id
+        watermark.save()
+
+        rollup_ledger(chunk_size=100, lag=0)
+
+        self.assertEqual(self.rollups(), {
+            (self.day, "S", 50, 1),
+            (self.day + datetime.timedelta(days=1), "S", 10, 1),
+        })
+
+    def test_stats_endpoint_serves_the_rollups(self):
+        rollup_ledger(chunk_size=100, lag=0)
+        url = reverse("tabdil:charging:stats")
+
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {"from": "2024-03-01", "to": "2024-03-10"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["days"]), 2)
+        self.assertEqual(response.data["totals"], {"C": {"amount_sum": 1000, "tx_count": 1},
+                                                   "S": {"amount_sum": 150, "tx_count": 2}})
+        self.assertEqual(response.data["rolled_up_to_tx_id"], Transaction.objects.latest("id").id)
+
+        response = self.client.get(url, {"from": "2024-03-01", "to": "2024-03-31", "transaction_type": "S"})
+        self.assertEqual(response.data["totals"], {"S": {"amount_sum": 160, "tx_count": 3}})
+
+        response = self.client.get(url, {"from": "March"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,94 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from charging.models import Seller, Transaction, CreditRequest, SellerBalanceSnapshot
+from charging.services import perform_charge, apply_admin_action_on_seller_request_for_credit
+from charging.snapshots import balance_at, due_snapshot_times, take_snapshots, utc_midnight
+
+User = get_user_model()
+
+
+class SellerBalanceSnapshotTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+        self.today = utc_midnight(timezone.now())
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=10000)
+        apply_admin_action_on_seller_request_for_credit(credit_request, {"status": CreditRequest.APPROVED,
+                                                                         "is_processed": True})
+        self.move_latest_row(self.day(-3))
+        perform_charge(self.seller.id, "09123456789", 1000)
+        self.move_latest_row(self.day(-2))
+        perform_charge(self.seller.id, "09123456789", 500)
+        self.move_latest_row(self.day(-1))
+        perform_charge(self.seller.id, "09123456789", 200)
+
+    def day(self, days, hour=12):
+        return self.today + datetime.timedelta(days=days, hours=hour)
+
+    def move_latest_row(self, timestamp):
+        Transaction.objects.filter(id=Transaction.objects.latest("id").id).update(timestamp=timestamp)
+
+    def test_snapshots_count_the_rows_before_midnight(self):
+        take_snapshots(self.day(-2, hour=0))
+        take_snapshots(self.day(-1, hour=0))
+
+        self.assertEqual(list(SellerBalanceSnapshot.objects.order_by("as_of").values_list("balance", "tx_count")),
+                         [(10000, 1), (9000, 2)])
+
+        take_snapshots(self.day(-1, hour=0))
+        self.assertEqual(SellerBalanceSnapshot.objects.count(), 2)
+
+    def test_sellers_without_earlier_rows_are_not_snapshotted(self):
+        take_snapshots(self.day(-4, hour=0))
+
+        self.assertFalse(SellerBalanceSnapshot.objects.exists())
+
+    def test_balance_at_adds_the_rows_after_the_nearest_snapshot(self):
+        take_snapshots(self.day(-2, hour=0))
+        # Only the snapshot and the rows after it are read
+        SellerBalanceSnapshot.objects.update(balance=10001)
+
+        self.assertEqual(balance_at(self.seller.id, self.day(-1, hour=13)), 8501)
+        self.assertEqual(balance_at(self.seller.id, self.day(-2, hour=0)), 10001)
+
+    def test_balance_at_before_the_first_snapshot_counts_back_from_the_totals(self):
+        take_snapshots(self.day(-1, hour=0))
+
+        self.assertEqual(balance_at(self.seller.id, self.day(-3, hour=13)), 10000)
+        self.assertEqual(balance_at(self.seller.id, self.day(-3, hour=11)), 0)
+        self.assertEqual(balance_at(self.seller.id, timezone.now() + datetime.timedelta(seconds=1)), 8300)
+
+    def test_due_times_catch_up_from_the_latest_snapshot(self):
+        now = self.day(0, hour=0) + datetime.timedelta(minutes=30)
+        self.assertEqual(due_snapshot_times(lag=3600, now=now), [self.day(-1, hour=0)])
+
+        take_snapshots(self.day(-3, hour=0))
+        take_snapshots(self.day(-2, hour=0))
+        self.assertEqual(due_snapshot_times(lag=60, now=now), [self.day(-1, hour=0), self.day(0, hour=0)])
+
+    def test_show_credit_as_of(self):
+        take_snapshots(self.day(-2, hour=0))
+        url = reverse("tabdil:charging:show_credit")
+
+        response = self.client.get(url, {"as_of": self.day(-1, hour=13).isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["credit"], 8500)
+
+        response = self.client.get(url, {"as_of": (self.today - datetime.timedelta(days=1)).date().isoformat()})
+        self.assertEqual(response.data["credit"], 9000)
+
+        self.assertEqual(self.client.get(url).data["credit"], 8300)
+
+    def test_show_credit_as_of_must_be_a_date(self):
+        response = self.client.get(reverse("tabdil:charging:show_credit"), {"as_of": "yesterday"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
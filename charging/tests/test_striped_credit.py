@@ -0,0 +1,99 @@
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from charging.models import Seller, SellerCreditBucket, Transaction, CreditRequest
+from charging.services import enable_credit_striping, disable_credit_striping, perform_charge, apply_charges, \
+    apply_admin_action_on_seller_request_for_credit
+
+User = get_user_model()
+
+
+class StripedCreditTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user, credit=10003)
+        enable_credit_striping(self.seller.id, 4)
+        self.seller.refresh_from_db()
+
+        self.client.force_authenticate(user=self.user)
+
+    def bucket_credits(self):
+        return list(SellerCreditBucket.objects.filter(seller=self.seller).order_by("index").
+                    values_list("credit", flat=True))
+
+    def test_enable_striping_splits_credit(self):
+        self.assertEqual(self.seller.credit, 0)
+        self.assertEqual(self.seller.credit_stripes, 4)
+        self.assertEqual(self.bucket_credits(), [2501, 2501, 2501, 2500])
+        self.assertEqual(self.seller.balance, 10003)
+
+    def test_sell_charge_debits_one_bucket(self):
+        response = self.client.post(reverse("tabdil:charging:sell_charge"), {"phone": "09123456789", "amount": 1000})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        bucket_credits = self.bucket_credits()
+        self.assertEqual(sum(bucket_credits), 9003)
+        self.assertEqual(len([credit for credit in bucket_credits if credit < 2500]), 1)
+        self.assertEqual(Transaction.objects.filter(seller=self.seller).count(), 1)
+
+    def test_charge_larger_than_any_bucket_drains_several(self):
+        perform_charge(self.seller.id, "09123456789", 6000, striped=True)
+
+        self.assertEqual(self.bucket_credits(), [0, 0, 1503, 2500])
+        with self.assertRaises(ValueError):
+            perform_charge(self.seller.id, "09123456789", 5000, striped=True)
+
+    def test_bulk_charge_uses_buckets(self):
+        applied = apply_charges(self.seller.id, [{"phone": "09123456789", "amount": 9000},
+                                                 {"phone": "09123456788", "amount": 2000}])
+        self.assertEqual(applied, [True, False])
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.balance, 1003)
+
+    def test_deposit_spreads_over_buckets(self):
+        admin_user = User.objects.create_user(email='testemail2@yahoo.com', national_id="2700110596",
+                                              password='testpassword2')
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=10)
+        self.client.force_authenticate(user=admin_user)
+
+        url = reverse("tabdil:charging:admin_deposit_request_action-detail", args=[credit_request.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, {"status": "A"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        self.assertEqual(self.bucket_credits(), [2504, 2504, 2503, 2502])
+
+    def test_single_statement_approval_spreads_over_buckets(self):
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=10)
+
+        with self.assertNumQueries(1):
+            apply_admin_action_on_seller_request_for_credit(credit_request, {"status": CreditRequest.APPROVED})
+
+        self.assertEqual(self.bucket_credits(), [2504, 2504, 2503, 2502])
+        self.seller.refresh_from_db()
+        self.assertEqual((self.seller.credit, self.seller.total_deposit, self.seller.tx_count), (0, 10, 1))
+
+    def test_show_credit_and_check_transaction_sum_stripes(self):
+        response = self.client.get(reverse("tabdil:charging:show_credit"))
+        self.assertEqual(response.data["credit"], 10003)
+
+        perform_charge(self.seller.id, "09123456789", 3, striped=True)
+        Transaction.objects.create(seller=self.seller, amount=10003, transaction_type=Transaction.DEPOSIT)
+        Seller.objects.filter(id=self.seller.id).update(total_deposit=10003, tx_count=1)
+        response = self.client.get(reverse("tabdil:charging:check_transaction"), {"deep": "true"})
+        self.assertTrue(response.data["equal"])
+        self.assertTrue(response.data["data"]["totals_match"])
+        self.assertEqual(response.data["data"]["seller_credit"], 10000)
+        self.assertEqual(response.data["data"]["tx_count"], 2)
+
+    def test_disable_striping_collapses_buckets(self):
+        disable_credit_striping(self.seller.id)
+        self.seller.refresh_from_db()
+
+        self.assertEqual(self.seller.credit, 10003)
+        self.assertEqual(self.seller.credit_stripes, 0)
+        self.assertEqual(self.seller.total_sell, 0)
+        self.assertFalse(SellerCreditBucket.objects.filter(seller=self.seller).exists())
@@ -1,6 +1,6 @@
 from rest_framework.test import APITestCase, APITransactionTestCase
 from django.contrib.auth import get_user_model
-from django.test import TestCase, TransactionTestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 
 from charging.models import CreditRequest, Seller, Transaction, PhoneNumber
 from concurrent.futures import ProcessPoolExecutor, as_completed
@@ -8,9 +8,21 @@ from concurrent.futures import ProcessPoolExecutor, as_completed
 from django.urls import reverse
 
 from rest_framework import status
+from django.core.cache import caches
 from django.db import connection
 from rest_framework.test import APIClient
 
+from charging.services import apply_admin_action_on_seller_request_for_credit
+from charging.tasks import enqueue_admin_action, process_deposit_queue, requeue_stale_deposit_actions
+from charging.utils import idempotency_cache_key, get_stored_response
+from django.utils import timezone
+from datetime import timedelta
+import gzip
+import json
+from unittest import mock
+
+import brotli
+
 User = get_user_model()
 
 
@@ -42,11 +54,39 @@ class CreditRequestAPITest(APITestCase):
         self.assertEqual(CreditRequest.objects.first().amount, 5000)
         self.assertEqual(CreditRequest.objects.first().seller, self.seller)
 
+    @override_settings(MERGE_PENDING_CREDIT_REQUESTS=True)
+    def test_create_merges_into_the_pending_request(self):
+        first = self.client.post(self.url, {"amount": 5000})
+        second = self.client.post(self.url, {"amount": 700})
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data, {"id": first.data["id"], "amount": 5700})
+        self.assertEqual(CreditRequest.objects.count(), 1)
+
+        CreditRequest.objects.update(is_processed=True, status="A")
+        third = self.client.post(self.url, {"amount": 300})
+        self.assertNotEqual(third.data["id"], first.data["id"])
+
+        # Requests with an idempotency key keep their own row
+        self.client.post(self.url, {"amount": 100}, HTTP_IDEMPOTENCY_KEY="deposit-1")
+        self.assertEqual(CreditRequest.objects.filter(is_processed=False).count(), 2)
+
+    @override_settings(MERGE_PENDING_CREDIT_REQUESTS=True)
+    def test_requests_with_an_idempotency_key_are_not_merged_into(self):
+        self.addCleanup(caches['default'].delete, idempotency_cache_key("deposit_request", self.user.id, "deposit-1"))
+        keyed = self.client.post(self.url, {"amount": 5000}, HTTP_IDEMPOTENCY_KEY="deposit-1")
+
+        unkeyed = self.client.post(self.url, {"amount": 700})
+        self.assertNotEqual(unkeyed.data["id"], keyed.data["id"])
+        self.assertEqual(CreditRequest.objects.get(id=keyed.data["id"]).amount, 5000)
+
+        replay = self.client.post(self.url, {"amount": 5000}, HTTP_IDEMPOTENCY_KEY="deposit-1")
+        self.assertEqual(replay.data, keyed.data)
+
 
 class AdminCreditApprovalViewTest(APITestCase):
     def setUp(self):
-        self.admin_user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
-                                                   password='testpassword1')
+        self.admin_user = User.objects.create_superuser(email='testemail1@yahoo.com', national_id="2700110595",
+                                                        password='testpassword1')
 
         self.seller_user = User.objects.create_user(email='testemail2@yahoo.com', national_id="2700110596",
                                                     password='testpassword2')
@@ -70,8 +110,10 @@ class AdminCreditApprovalViewTest(APITestCase):
         self.detail_url = reverse("tabdil:charging:admin_deposit_request_action-detail", args=[self.credit_request.id])
 
     def test_approve_credit_request(self):
-        response = self.client.patch(self.detail_url, {"status": "A"}, format="json")
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.detail_url, {"status": "A"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["state"], "queued")
 
         self.credit_request.refresh_from_db()
         self.seller.refresh_from_db()
@@ -83,8 +125,9 @@ class AdminCreditApprovalViewTest(APITestCase):
         self.assertTrue(Transaction.objects.filter(seller=self.seller, amount=5000).exists())
 
     def test_reject_credit_request(self):
-        response = self.client.patch(self.detail_url, {"status": "R"}, format="json")
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.detail_url, {"status": "R"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
 
         self.credit_request.refresh_from_db()
         self.assertTrue(self.credit_request.is_processed)
@@ -100,6 +143,227 @@ class AdminCreditApprovalViewTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("status", response.data)
 
+    @override_settings(DEPOSIT_APPROVAL_QUEUE=False)
+    def test_inline_approval_is_one_guarded_statement(self):
+        response = self.client.patch(self.detail_url, {"status": "A"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["state"], "approved")
+
+        with self.assertNumQueries(1):
+            state = apply_admin_action_on_seller_request_for_credit(self.credit_request, {"status": "A"})
+        self.assertIsNone(state)
+        with self.assertNumQueries(1):
+            state = apply_admin_action_on_seller_request_for_credit(self.credit_request, {"status": "R"})
+        self.assertIsNone(state)
+
+        self.seller.refresh_from_db()
+        self.assertEqual((self.seller.credit, self.seller.total_deposit, self.seller.tx_count), (5000, 5000, 1))
+        self.assertEqual(self.seller.last_tx_id, Transaction.objects.get(seller=self.seller).id)
+        self.credit_request.refresh_from_db()
+        self.assertEqual((self.credit_request.status, self.credit_request.admin_user), ("A", self.admin_user))
+
+    @override_settings(DEPOSIT_APPROVAL_QUEUE=False)
+    def test_inline_rejection(self):
+        response = self.client.patch(self.detail_url, {"status": "R"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["state"], "rejected")
+        self.assertEqual(self.client.patch(self.detail_url, {"status": "A"}, format="json").status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_approval_is_queued_until_a_worker_applies_it(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.patch(self.detail_url, {"status": "A"}, format="json")
+        self.assertEqual(len(callbacks), 1)
+
+        response = self.client.get(response.data["status_url"])
+        self.assertEqual(response.data["state"], "queued")
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 0)
+        self.assertNotIn(self.credit_request.id, [row["id"] for row in self.client.get(self.list_url).data["results"]])
+        self.assertEqual(self.client.patch(self.detail_url, {"status": "R"}, format="json").status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+        callbacks[0]()
+
+        response = self.client.get(reverse("tabdil:charging:admin_deposit_request_action-state",
+                                           args=[self.credit_request.id]))
+        self.assertEqual(response.data["state"], "approved")
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 5000)
+
+    def test_worker_applies_a_sellers_queued_actions_in_one_batch(self):
+        requests = [self.credit_request] + [CreditRequest.objects.create(seller=self.seller, amount=amount)
+                                            for amount in (100, 200)]
+        for credit_request, action_status in zip(requests, ("A", "R", "A")):
+            enqueue_admin_action(credit_request, action_status, self.admin_user)
+
+        self.assertEqual(process_deposit_queue(self.seller.id), 3)
+        self.assertEqual(process_deposit_queue(self.seller.id), 0)
+
+        self.seller.refresh_from_db()
+        self.assertEqual((self.seller.credit, self.seller.tx_count), (5200, 2))
+        self.assertEqual([credit_request.state for credit_request in CreditRequest.objects.order_by("id")],
+                         ["approved", "rejected", "approved"])
+        self.assertFalse(enqueue_admin_action(self.credit_request, "R", self.admin_user))
+
+    def test_sweeper_requeues_actions_whose_message_was_lost(self):
+        # Queued without publishing, as when the broker was down at commit
+        enqueue_admin_action(self.credit_request, "A", self.admin_user)
+        self.assertEqual(requeue_stale_deposit_actions(), 0)
+
+        CreditRequest.objects.filter(id=self.credit_request.id).update(
+            queued_at=timezone.now() - timedelta(seconds=120))
+        self.assertEqual(requeue_stale_deposit_actions(), 1)
+
+        self.assertEqual(CreditRequest.objects.get(id=self.credit_request.id).state, "approved")
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 5000)
+        self.assertEqual(requeue_stale_deposit_actions(), 0)
+
+    def test_pending_queue_is_oldest_first_and_keyset_paginated(self):
+        requests = [self.credit_request] + [CreditRequest.objects.create(seller=self.seller, amount=amount)
+                                            for amount in (100, 200, 300)]
+        CreditRequest.objects.create(seller=self.seller, amount=1, is_processed=True)
+        CreditRequest.objects.filter(id=requests[2].id).update(created_at=timezone.now() - timedelta(days=1))
+
+        ids, url = [], self.list_url + "?page_size=3"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", response.data)
+            ids += [row["id"] for row in response.data["results"]]
+            url = response.data["next"]
+
+        self.assertEqual(ids, [requests[2].id, requests[0].id, requests[1].id, requests[3].id])
+        self.assertEqual(response.data["results"][0]["seller_national_id"], "2700110596")
+
+    def test_pending_queue_filters(self):
+        other_seller = Seller.objects.create(user=User.objects.create_user(
+            email='testemail3@yahoo.com', national_id="2700110597", password='testpassword3'))
+        CreditRequest.objects.create(seller=other_seller, amount=100)
+        CreditRequest.objects.create(seller=other_seller, amount=9000)
+
+        response = self.client.get(self.list_url, {"seller_id": other_seller.id, "max_amount": 5000})
+        self.assertEqual([row["amount"] for row in response.data["results"]], [100])
+
+        response = self.client.get(self.list_url, {"min_amount": 1000})
+        self.assertEqual([row["amount"] for row in response.data["results"]], [5000, 9000])
+
+        response = self.client.get(self.list_url, {"min_amount": "a lot"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_approve_credit_requests(self):
+        other_seller = Seller.objects.create(user=User.objects.create_user(
+            email='testemail3@yahoo.com', national_id="2700110597", password='testpassword3'))
+        requests = [self.credit_request,
+                    CreditRequest.objects.create(seller=self.seller, amount=700),
+                    CreditRequest.objects.create(seller=other_seller, amount=300)]
+        processed = CreditRequest.objects.create(seller=self.seller, amount=1, is_processed=True, status="R")
+        ids = [request.id for request in reversed(requests)] + [processed.id, 999999]
+
+        response = self.client.post(reverse("tabdil:charging:admin_deposit_request_action-bulk"),
+                                    {"ids": ids, "status": "A"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data["success"])
+        self.assertEqual([(result["id"], result["outcome"]) for result in response.data["results"]],
+                         [(requests[2].id, "approved"), (requests[1].id, "approved"), (requests[0].id, "approved"),
+                          (processed.id, "already_processed"), (999999, "not_found")])
+
+        self.seller.refresh_from_db()
+        other_seller.refresh_from_db()
+        self.assertEqual((self.seller.credit, self.seller.total_deposit, self.seller.tx_count), (5700, 5700, 2))
+        self.assertEqual(other_seller.credit, 300)
+        self.assertEqual(Transaction.objects.filter(transaction_type=Transaction.DEPOSIT).count(), 3)
+        self.assertFalse(CreditRequest.objects.filter(id__in=ids[:3], is_processed=False).exists())
+        self.assertEqual(CreditRequest.objects.get(id=processed.id).status, "R")
+
+    def test_bulk_reject_credit_requests(self):
+        response = self.client.post(reverse("tabdil:charging:admin_deposit_request_action-bulk"),
+                                    {"ids": [self.credit_request.id], "status": "R"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"][0]["outcome"], "rejected")
+
+        self.credit_request.refresh_from_db()
+        self.assertEqual((self.credit_request.status, self.credit_request.admin_user), ("R", self.admin_user))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_approve_all_pending_requests_of_a_seller(self):
+        other_seller = Seller.objects.create(user=User.objects.create_user(
+            email='testemail3@yahoo.com', national_id="2700110597", password='testpassword3'))
+        second = CreditRequest.objects.create(seller=self.seller, amount=700)
+        queued = CreditRequest.objects.create(seller=self.seller, amount=50, status="A", queued_at=timezone.now())
+        other = CreditRequest.objects.create(seller=other_seller, amount=300)
+
+        response = self.client.post(reverse("tabdil:charging:admin_deposit_request_action-approve-all"),
+                                    {"seller_id": self.seller.id}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"approved_ids": [self.credit_request.id, second.id], "amount": 5700})
+
+        self.seller.refresh_from_db()
+        self.assertEqual((self.seller.credit, self.seller.total_deposit, self.seller.tx_count), (5700, 5700, 2))
+        self.assertEqual(Transaction.objects.filter(seller=self.seller).count(), 2)
+        self.assertFalse(CreditRequest.objects.get(id=queued.id).is_processed)
+        self.assertFalse(CreditRequest.objects.get(id=other.id).is_processed)
+
+        response = self.client.post(reverse("tabdil:charging:admin_deposit_request_action-approve-all"),
+                                    {"seller_id": self.seller.id}, format="json")
+        self.assertEqual(response.data, {"approved_ids": [], "amount": 0})
+
+        response = self.client.post(reverse("tabdil:charging:admin_deposit_request_action-approve-all"),
+                                    {"seller_id": 999999}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_action_leaves_queued_requests_to_their_queued_action(self):
+        enqueue_admin_action(self.credit_request, "R", self.admin_user)
+
+        response = self.client.post(reverse("tabdil:charging:admin_deposit_request_action-bulk"),
+                                    {"ids": [self.credit_request.id], "status": "A"}, format="json")
+        self.assertEqual(response.data["results"][0]["outcome"], "queued")
+        self.assertFalse(response.data["results"][0]["success"])
+
+        process_deposit_queue(self.seller.id)
+        self.assertEqual(CreditRequest.objects.get(id=self.credit_request.id).state, "rejected")
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 0)
+
+    @override_settings(MERGE_PENDING_CREDIT_REQUESTS=True, DEPOSIT_APPROVAL_QUEUE=False)
+    def test_merging_requires_the_version_the_admin_saw(self):
+        url = reverse("tabdil:charging:admin_deposit_request_action-detail", args=[self.credit_request.id])
+        response = self.client.patch(url, {"status": "A"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("version", response.data)
+
+        version = self.client.get(self.list_url).data["results"][0]["version"]
+        CreditRequest.objects.filter(id=self.credit_request.id).update(amount=9000)
+        response = self.client.patch(url, {"status": "A", "version": version}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.patch(url, {"status": "A", "version": version + 1}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 9000)
+
+    def test_only_superusers_may_act_in_bulk(self):
+        response = self.client.post(reverse("tabdil:accounts:login"),
+                                    {"user_identifier": "2700110596", "password": "testpassword2"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {response.data['data']['access']}")
+
+        response = self.client.post(reverse("tabdil:charging:admin_deposit_request_action-bulk"),
+                                    {"ids": [self.credit_request.id], "status": "A"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(reverse("tabdil:charging:admin_deposit_request_action-approve-all"),
+                                    {"seller_id": self.seller.id}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(CreditRequest.objects.get(id=self.credit_request.id).is_processed)
+
+    def test_bulk_action_validates_its_input(self):
+        url = reverse("tabdil:charging:admin_deposit_request_action-bulk")
+        self.assertEqual(self.client.post(url, {"ids": [], "status": "A"}, format="json").status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(url, {"ids": [self.credit_request.id], "status": "P"},
+                                          format="json").status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class SellChargeViewTest(APITestCase):
     def setUp(self):
@@ -155,6 +419,291 @@ class SellChargeViewTest(APITestCase):
         self.assertFalse(Transaction.objects.exists())
 
 
+class IdempotencyKeyTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user, credit=10000)
+
+        self.client.force_authenticate(user=self.user)
+
+        self.sell_charge_url = reverse("tabdil:charging:sell_charge")
+        self.deposit_request_url = reverse("tabdil:charging:deposit_request-list")
+
+    def tearDown(self):
+        caches['default'].delete(idempotency_cache_key("sell_charge", self.user.id, "charge-1"))
+        caches['default'].delete(idempotency_cache_key("deposit_request", self.user.id, "deposit-1"))
+
+    def test_sell_charge_replay_is_charged_once(self):
+        data = {"phone": "09123456789", "amount": 3000}
+        first_response = self.client.post(self.sell_charge_url, data, HTTP_IDEMPOTENCY_KEY="charge-1")
+        second_response = self.client.post(self.sell_charge_url, data, HTTP_IDEMPOTENCY_KEY="charge-1")
+
+        self.assertEqual(first_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(second_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(first_response.data, second_response.data)
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 7000)
+        self.assertEqual(Transaction.objects.filter(seller=self.seller).count(), 1)
+
+    def test_sell_charge_replay_after_cache_eviction_uses_ledger(self):
+        data = {"phone": "09123456789", "amount": 3000}
+        self.client.post(self.sell_charge_url, data, HTTP_IDEMPOTENCY_KEY="charge-1")
+        caches['default'].delete(idempotency_cache_key("sell_charge", self.user.id, "charge-1"))
+
+        response = self.client.post(self.sell_charge_url, data, HTTP_IDEMPOTENCY_KEY="charge-1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["success"])
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 7000)
+        self.assertEqual(Transaction.objects.filter(seller=self.seller).count(), 1)
+
+    def test_sell_charge_key_reused_with_a_different_request_is_refused(self):
+        self.client.post(self.sell_charge_url, {"phone": "09123456789", "amount": 3000},
+                         HTTP_IDEMPOTENCY_KEY="charge-1")
+
+        response = self.client.post(self.sell_charge_url, {"phone": "09123456789", "amount": 4000},
+                                    HTTP_IDEMPOTENCY_KEY="charge-1")
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        caches['default'].delete(idempotency_cache_key("sell_charge", self.user.id, "charge-1"))
+        response = self.client.post(self.sell_charge_url, {"phone": "09123456780", "amount": 3000},
+                                    HTTP_IDEMPOTENCY_KEY="charge-1")
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 7000)
+
+    def test_unexpected_charge_failures_are_not_stored(self):
+        data = {"phone": "09123456789", "amount": 3000}
+        self.client.raise_request_exception = False
+        with mock.patch("charging.views.perform_charge",
+                        side_effect=ValueError(f"Credit mirror of seller {self.seller.id} could not be loaded")):
+            response = self.client.post(self.sell_charge_url, data, HTTP_IDEMPOTENCY_KEY="charge-1")
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertIsNone(get_stored_response("sell_charge", self.user.id, "charge-1"))
+
+        response = self.client.post(self.sell_charge_url, data, HTTP_IDEMPOTENCY_KEY="charge-1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 7000)
+
+    def test_deposit_request_key_reused_with_a_different_amount_is_refused(self):
+        self.client.post(self.deposit_request_url, {"amount": 5000}, HTTP_IDEMPOTENCY_KEY="deposit-1")
+        response = self.client.post(self.deposit_request_url, {"amount": 6000}, HTTP_IDEMPOTENCY_KEY="deposit-1")
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(CreditRequest.objects.get().amount, 5000)
+
+    def test_deposit_request_key_reused_after_cache_eviction_is_refused(self):
+        self.client.post(self.deposit_request_url, {"amount": 5000}, HTTP_IDEMPOTENCY_KEY="deposit-1")
+        caches['default'].delete(idempotency_cache_key("deposit_request", self.user.id, "deposit-1"))
+
+        response = self.client.post(self.deposit_request_url, {"amount": 6000}, HTTP_IDEMPOTENCY_KEY="deposit-1")
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(CreditRequest.objects.get().amount, 5000)
+
+    def test_deposit_request_replay_returns_same_request(self):
+        first_response = self.client.post(self.deposit_request_url, {"amount": 5000},
+                                          HTTP_IDEMPOTENCY_KEY="deposit-1")
+        caches['default'].delete(idempotency_cache_key("deposit_request", self.user.id, "deposit-1"))
+        second_response = self.client.post(self.deposit_request_url, {"amount": 5000},
+                                           HTTP_IDEMPOTENCY_KEY="deposit-1")
+
+        self.assertEqual(first_response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second_response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(first_response.data["id"], second_response.data["id"])
+        self.assertEqual(CreditRequest.objects.count(), 1)
+
+
+class BulkSellChargeViewTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user, credit=10000)
+        PhoneNumber.objects.create(phone_number="09123456789")
+
+        self.client.force_authenticate(user=self.user)
+
+        self.url = reverse("tabdil:charging:bulk_sell_charge")
+
+    def test_bulk_sell_charge_applies_items_in_order(self):
+        data = [
+            {"phone": "09123456789", "amount": 4000},
+            {"phone": "09123456788", "amount": 7000},
+            {"phone": "09123456787", "amount": 6000},
+        ]
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data["success"])
+        self.assertEqual([item["success"] for item in response.data["results"]], [True, False, True])
+        self.assertEqual(response.data["results"][1]["message"], "Insufficient credit")
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 0)
+
+        self.assertEqual(Transaction.objects.filter(seller=self.seller).count(), 2)
+        self.assertEqual(PhoneNumber.objects.count(), 2)
+
+    def test_bulk_sell_charge_rejects_invalid_item(self):
+        data = [
+            {"phone": "09123456789", "amount": 1000},
+            {"phone": "123456", "amount": 1000},
+        ]
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, 10000)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_bulk_sell_charge_rejects_empty_list(self):
+        response = self.client.post(self.url, [], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(BULK_CHARGE_MAX_ITEMS=2)
+    def test_bulk_sell_charge_rejects_oversized_list_before_validating(self):
+        data = [{"phone": "09123456789", "amount": 1000}, {"phone": "123456", "amount": 1000},
+                {"phone": "09123456788", "amount": 1000}]
+        with mock.patch("charging.views.BulkSellChargeView.serializer_class") as serializer_class:
+            response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["message"], "At most 2 charges are allowed per request")
+        serializer_class.assert_not_called()
+
+    def test_bulk_sell_charge_rejects_a_non_list_body(self):
+        response = self.client.post(self.url, {"phone": "09123456789", "amount": 1000}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Transaction.objects.exists())
+
+
+class ShowSellerTransactionViewTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+        same_moment = timezone.now() - timedelta(days=1)
+        for i in range(25):
+            Transaction.objects.create(seller=self.seller, amount=i + 1, phone=f"0912345{i:04d}",
+                                       transaction_type=Transaction.SELLING if i % 2 else Transaction.DEPOSIT)
+        # Rows sharing a timestamp must be paged by id without skipping or repeating any
+        Transaction.objects.filter(amount__lte=12).update(timestamp=same_moment)
+
+        self.url = reverse("tabdil:charging:show_transaction")
+
+    def collect_pages(self, params):
+        ids, url, pages = [], self.url, 0
+        while url:
+            response = self.client.get(url, params if pages == 0 else None)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", response.data)
+            ids += [row["id"] for row in response.data["results"]]
+            url, pages = response.data["next"], pages + 1
+        return ids, pages
+
+    def test_pages_cover_history_newest_first(self):
+        ids, pages = self.collect_pages({"page_size": 10})
+
+        expected = list(Transaction.objects.order_by("-timestamp", "-id").values_list("id", flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+    def test_deep_page_costs_one_query(self):
+        response = self.client.get(self.url, {"page_size": 10})
+        with self.assertNumQueries(1):
+            self.client.get(response.data["next"])
+
+    def test_filters(self):
+        ids, _ = self.collect_pages({"transaction_type": Transaction.SELLING, "page_size": 5})
+        self.assertEqual(len(ids), 12)
+        self.assertTrue(all(tx.transaction_type == Transaction.SELLING for tx in Transaction.objects.filter(id__in=ids)))
+
+        ids, _ = self.collect_pages({"to": (timezone.now() - timedelta(hours=1)).isoformat()})
+        self.assertEqual(len(ids), 12)
+
+        ids, _ = self.collect_pages({"from": timezone.now().date().isoformat()})
+        self.assertEqual(len(ids), 13)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {"transaction_type": "X"}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {"from": "yesterday"}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {"cursor": "not-a-cursor"}).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ExportSellerTransactionViewTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail1@yahoo.com', national_id="2700110595",
+                                             password='testpassword1')
+        self.seller = Seller.objects.create(user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+        for i in range(5):
+            Transaction.objects.create(seller=self.seller, amount=i + 1, phone=f"0912345{i:04d}",
+                                       transaction_type=Transaction.SELLING)
+        Transaction.objects.create(seller=self.seller, amount=100, transaction_type=Transaction.DEPOSIT)
+
+        self.url = reverse("tabdil:charging:export_transaction")
+
+    def export(self, params=None, **headers):
+        response = self.client.get(self.url, params, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content)
+
+    def test_csv_export(self):
+        response, content = self.export()
+        lines = content.decode().splitlines()
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(lines[0], "id,timestamp,transaction_type,amount,phone")
+        self.assertEqual(len(lines), 7)
+        self.assertTrue(lines[1].endswith(",S,1,09123450000"))
+        self.assertTrue(lines[-1].endswith(",C,100,"))
+
+    def test_ndjson_export_with_filters(self):
+        _, content = self.export({"export_format": "ndjson", "transaction_type": "S"})
+        records = [json.loads(line) for line in content.decode().splitlines()]
+
+        self.assertEqual([record["amount"] for record in records], [1, 2, 3, 4, 5])
+
+        _, content = self.export({"export_format": "ndjson", "to": "2000-01-01"})
+        self.assertEqual(content, b"")
+
+    def test_compressed_exports(self):
+        _, plain = self.export()
+
+        response, content = self.export(HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(content), plain)
+
+        response, content = self.export(HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(content), plain)
+
+    def test_only_staff_exports_other_sellers(self):
+        other_user = User.objects.create_user(email='testemail2@yahoo.com', national_id="2700110596",
+                                              password='testpassword2')
+        other_seller = Seller.objects.create(user=other_user)
+
+        _, content = self.export({"seller_id": other_seller.id})
+        self.assertEqual(len(content.decode().splitlines()), 7)
+
+        self.user.is_staff = True
+        self.user.save()
+        _, content = self.export({"seller_id": other_seller.id})
+        self.assertEqual(len(content.decode().splitlines()), 1)
+
+    def test_invalid_format(self):
+        response = self.client.get(self.url, {"export_format": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 def credit_increase_worker(args):
     """Worker function for credit increase operations"""
     process_id, seller_id, admin_user_id, amount = args
@@ -183,7 +732,7 @@ def credit_increase_worker(args):
         'process_id': process_id,
         'seller_id': seller_id,
         'status_code': response.status_code,
-        'success': response.status_code == status.HTTP_200_OK,
+        'success': response.status_code == status.HTTP_202_ACCEPTED,
         'amount': amount,
         'credit_request_id': credit_request.id
     }
@@ -1,8 +1,10 @@
 from django.urls import path
 from rest_framework import routers
 
+from charging import async_views
 from charging.views import AdminCreditRequestApprovalView, SellChargeView, ShowSellerCreditView, \
-    ShowSellerTransactionView, CheckTransaction, CreditRequestView
+    ShowSellerTransactionView, CheckTransaction, CreditRequestView, BulkSellChargeView, ExportSellerTransactionView, \
+    SellerStatsView
 
 app_name = "charging"
 
@@ -15,8 +17,14 @@ urlpatterns = router.urls
 
 urlpatterns += [
     path('sell_charge/', SellChargeView.as_view(), name='sell_charge'),
+    path('sell_charge/bulk/', BulkSellChargeView.as_view(), name='bulk_sell_charge'),
     path('show_credit/', ShowSellerCreditView.as_view(), name='show_credit'),
     path('show_transaction/', ShowSellerTransactionView.as_view(), name='show_transaction'),
+    path('export_transaction/', ExportSellerTransactionView.as_view(), name='export_transaction'),
     path('check_transaction/', CheckTransaction.as_view(), name='check_transaction'),
+    path('stats/', SellerStatsView.as_view(), name='stats'),
+
+    path('async/sell_charge/', async_views.sell_charge, name='async_sell_charge'),
+    path('async/show_credit/', async_views.show_credit, name='async_show_credit'),
 
 ]
@@ -0,0 +1,125 @@
+import datetime
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import Transaction
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+IDEMPOTENCY_KEY_REUSED = {"success": False,
+                          "message": f"{IDEMPOTENCY_HEADER} was already used with a different request"}
+
+
+def get_idempotency_key(request):
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not idempotency_key:
+        return None
+    if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise ValidationError({"message": f"{IDEMPOTENCY_HEADER} must be at most "
+                                          f"{IDEMPOTENCY_KEY_MAX_LENGTH} characters"})
+    return idempotency_key
+
+
+def idempotency_cache_key(scope, user_id, idempotency_key):
+    return f"idempotency_{scope}_{user_id} || {idempotency_key}"
+
+
+def request_fingerprint(**fields):
+    """Identifies the validated request a key was first used with, its replays must match it"""
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def is_same_request(stored_response, fingerprint):
+    # Responses stored without a fingerprint, before they were recorded, match any request
+    return stored_response.get("fingerprint") in (None, fingerprint)
+
+
+def get_stored_response(scope, user_id, idempotency_key):
+    return caches['default'].get(idempotency_cache_key(scope, user_id, idempotency_key))
+
+
+def store_response(scope, user_id, idempotency_key, data, status_code, fingerprint=None):
+    caches['default'].set(
+        idempotency_cache_key(scope, user_id, idempotency_key),
+        {"data": dict(data), "status": status_code, "fingerprint": fingerprint},
+        timeout=settings.IDEMPOTENCY_KEY_TTL,
+    )
+
+
+async def aget_stored_response(scope, user_id, idempotency_key):
+    return await caches['default'].aget(idempotency_cache_key(scope, user_id, idempotency_key))
+
+
+async def astore_response(scope, user_id, idempotency_key, data, status_code, fingerprint=None):
+    await caches['default'].aset(
+        idempotency_cache_key(scope, user_id, idempotency_key),
+        {"data": dict(data), "status": status_code, "fingerprint": fingerprint},
+        timeout=settings.IDEMPOTENCY_KEY_TTL,
+    )
+
+
+def parse_date_bound(value, end=False):
+    """
+    A date or datetime query parameter as an aware datetime. A bare date of an end
+    bound covers its whole day, so it becomes the start of the next day.
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError
+        moment = datetime.datetime.combine(day + datetime.timedelta(days=int(end)), datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def get_transaction_filters(request):
+    """Ledger filters of the transaction_type, from and to query parameters"""
+    filters = {}
+    transaction_type = request.query_params.get("transaction_type")
+    if transaction_type:
+        if transaction_type not in dict(Transaction.TRANSACTION_CHOICES):
+            raise ValidationError({"transaction_type": f"Must be one of {', '.join(dict(Transaction.TRANSACTION_CHOICES))}"})
+        filters["transaction_type"] = transaction_type
+
+    for param, lookup in (("from", "timestamp__gte"), ("to", "timestamp__lt")):
+        value = request.query_params.get(param)
+        if value:
+            try:
+                filters[lookup] = parse_date_bound(value, end=param == "to")
+            except ValueError:
+                raise ValidationError({param: "Must be an ISO 8601 date or datetime"})
+    return filters
+
+
+def get_credit_request_filters(request):
+    """Credit request filters of the seller_id, min_amount and max_amount query parameters"""
+    filters = {}
+    for param, lookup in (("seller_id", "seller_id"), ("min_amount", "amount__gte"), ("max_amount", "amount__lte")):
+        value = request.query_params.get(param)
+        if value:
+            try:
+                filters[lookup] = int(value)
+            except ValueError:
+                raise ValidationError({param: "Must be an integer"})
+    return filters
+
+
+def parse_date_param(request, param, default):
+    value = request.query_params.get(param)
+    if not value:
+        return default
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({param: "Must be an ISO 8601 date"})
+    return day
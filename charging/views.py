@@ -1,6 +1,13 @@
-from django.db.models import Sum, F, Case, When, IntegerField, Avg, Value
-from django.db.models.functions import Cast
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import generics, status
+from rest_framework.decorators import action
 from rest_framework.mixins import ListModelMixin, UpdateModelMixin, CreateModelMixin
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -10,9 +17,23 @@ from rest_framework.viewsets import GenericViewSet
 from .models import Seller, Transaction, CreditRequest
 from .serializers import TransactionSerializer, SellerSerializer, SellerSellingChargeCreateSerializer, \
     AdminDepositRequestApprovalPatchSerializer, AdminDepositRequestApprovalListSerializer, \
-    CreditRequestListSerializer, CreditRequestCreateSerializer
+    CreditRequestListSerializer, CreditRequestCreateSerializer, AdminDepositRequestBulkActionSerializer, \
+    AdminDepositRequestStateSerializer, AdminDepositRequestApproveAllSerializer
 from accounts.authentication import AccessTokenAuthentication
-from .services import perform_charge
+from permissions import IsSuperuser
+from .archive import archive_horizon, archived_page_rows, iter_archived_rows
+from .coalescer import ChargeCoalescingTimeout
+from .exports import EXPORT_FIELDS, EXPORT_FORMATS, negotiate_compression, stream_export
+from .pagination import KeysetPagination, PendingCreditRequestPagination
+from .reconciliation import reconcile_seller
+from .retry import ConcurrentUpdate
+from .rollups import seller_daily_stats, rolled_up_to_tx_id
+from .services import perform_charge, perform_bulk_charge, perform_bulk_admin_action, \
+    approve_pending_requests_of_seller, InsufficientCredit
+from .snapshots import balance_at
+from .utils import get_idempotency_key, get_stored_response, store_response, request_fingerprint, \
+    is_same_request, IDEMPOTENCY_KEY_REUSED, get_transaction_filters, \
+    parse_date_param, parse_date_bound, get_credit_request_filters
 
 
 # Create your views here.
@@ -38,20 +59,114 @@ class CreditRequestView(ListModelMixin, CreateModelMixin, GenericViewSet):
         queryset = self.queryset.filter(seller=seller)
         return queryset
 
+    def create(self, request, *args, **kwargs):
+        idempotency_key = get_idempotency_key(request)
+        if not idempotency_key:
+            return super().create(request, *args, **kwargs)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        fingerprint = request_fingerprint(amount=serializer.validated_data["amount"])
+        stored_response = get_stored_response("deposit_request", request.user.id, idempotency_key)
+        if stored_response:
+            if not is_same_request(stored_response, fingerprint):
+                return Response(IDEMPOTENCY_KEY_REUSED, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return Response(stored_response["data"], status=stored_response["status"])
+
+        credit_request = self.get_queryset().filter(idempotency_key=idempotency_key).first()
+        if credit_request is None:
+            try:
+                with transaction.atomic():
+                    response = super().create(request, *args, **kwargs)
+            except IntegrityError:
+                credit_request = self.get_queryset().get(idempotency_key=idempotency_key)
+
+        if credit_request is not None:
+            if credit_request.amount != serializer.validated_data["amount"]:
+                return Response(IDEMPOTENCY_KEY_REUSED, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            serializer = self.get_serializer(credit_request)
+            response = Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        store_response("deposit_request", request.user.id, idempotency_key, response.data, response.status_code,
+                       fingerprint)
+        return response
+
+    def perform_create(self, serializer):
+        serializer.save(idempotency_key=get_idempotency_key(self.request))
+
 
 class AdminCreditRequestApprovalView(ListModelMixin, UpdateModelMixin, GenericViewSet):
-    queryset = CreditRequest.objects.filter(is_processed=False)
+    """
+    The queue of pending credit requests, oldest first, filtered by ?seller_id=,
+    ?min_amount= and ?max_amount=. Approving or rejecting one queues the action to
+    the deposit workers and answers 202 with the URL of the request's state, or with
+    DEPOSIT_APPROVAL_QUEUE off applies it in one statement. approve_all approves all
+    pending requests of a seller at once.
+    """
+    queryset = CreditRequest.objects.filter(is_processed=False, queued_at__isnull=True).select_related("seller__user")
     authentication_classes = (AccessTokenAuthentication,)
     permission_classes = (IsAuthenticated,) #TODO here need a permission to only accept admins
     serializer_class = {
         "list": AdminDepositRequestApprovalListSerializer,
         "partial_update": AdminDepositRequestApprovalPatchSerializer,
+        "bulk": AdminDepositRequestBulkActionSerializer,
+        "state": AdminDepositRequestStateSerializer,
+        "approve_all": AdminDepositRequestApproveAllSerializer,
     }
-    http_method_names = ('get', 'patch')
+    http_method_names = ('get', 'patch', 'post')
+    pagination_class = PendingCreditRequestPagination
+
+    def get_queryset(self):
+        if self.action == "state":
+            return CreditRequest.objects.all()
+        queryset = super().get_queryset()
+        if self.action == "list":
+            queryset = queryset.filter(**get_credit_request_filters(self.request))
+        return queryset
 
     def get_serializer_class(self):
         return self.serializer_class.get(self.action)
 
+    def partial_update(self, request, *args, **kwargs):
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        state_url = reverse("tabdil:charging:admin_deposit_request_action-state", args=[instance.id])
+        return Response({**AdminDepositRequestStateSerializer(instance).data,
+                         "status_url": request.build_absolute_uri(state_url)},
+                        status=status.HTTP_202_ACCEPTED if settings.DEPOSIT_APPROVAL_QUEUE else status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"])
+    def state(self, request, pk=None):
+        """Whether an action on the request is still queued or was applied"""
+        return Response(self.get_serializer(self.get_object()).data)
+
+    @action(detail=False, methods=["post"], permission_classes=(IsAuthenticated, IsSuperuser))
+    def bulk(self, request):
+        """Approves or rejects a list of requests at once, reporting the outcome of every id"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = perform_bulk_admin_action(serializer.validated_data["ids"], serializer.validated_data["status"],
+                                            request.user)
+
+        return Response({'success': all(result["success"] for result in results), 'results': results},
+                        status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["post"], permission_classes=(IsAuthenticated, IsSuperuser))
+    def approve_all(self, request):
+        """Approves every pending request of a seller with one credit of their sum"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        requests = approve_pending_requests_of_seller(serializer.validated_data["seller_id"], request.user)
+
+        return Response({'approved_ids': [credit_request.id for credit_request in requests],
+                         'amount': sum(credit_request.amount for credit_request in requests)},
+                        status=status.HTTP_200_OK)
+
 
 class SellChargeView(APIView):
     authentication_classes = (AccessTokenAuthentication,)
@@ -62,40 +177,191 @@ class SellChargeView(APIView):
     def post(self, request):
         user = request.user
         data = request.data
+        idempotency_key = get_idempotency_key(request)
+
         serializer = self.serializer_class(data=data)
         serializer.is_valid(raise_exception=True)
         amount = serializer.validated_data["amount"]
         phone = serializer.validated_data["phone"]
-        seller = user.seller
-        if seller.credit < amount:
-            return Response({'success': False, 'message': 'Insufficient credit'},
-                                    status=status.HTTP_400_BAD_REQUEST)
-        try:
-            perform_charge(user.seller.id, phone, amount)
-        except:
-            return Response({'success': False, 'message': 'Insufficient credit'},
+
+        fingerprint = request_fingerprint(phone=phone, amount=amount)
+        if idempotency_key:
+            stored_response = get_stored_response("sell_charge", user.id, idempotency_key)
+            if stored_response:
+                if not is_same_request(stored_response, fingerprint):
+                    return Response(IDEMPOTENCY_KEY_REUSED, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                return Response(stored_response["data"], status=stored_response["status"])
+
+        response = Response({'success': True, 'message': 'Selling charge has been done successfully'},
+                            status=status.HTTP_200_OK)
+        charged = idempotency_key and Transaction.objects.filter(
+            seller__user=user, idempotency_key=idempotency_key).values_list("phone", "amount").first()
+        if charged and charged != (phone, amount):
+            return Response(IDEMPOTENCY_KEY_REUSED, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if not charged:
+            seller = user.seller
+            try:
+                perform_charge(seller.id, phone, amount, idempotency_key, striped=bool(seller.credit_stripes))
+            except IntegrityError:
+                # A concurrent request with the same idempotency key has been charged first
+                pass
+            except ChargeCoalescingTimeout:
+                return Response({'success': False,
+                                 'message': 'Charge result is unknown, retry with the same Idempotency-Key'},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            except ConcurrentUpdate:
+                return Response({'success': False, 'message': 'Seller credit is busy, retry the charge'},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            except InsufficientCredit:
+                response = Response({'success': False, 'message': 'Insufficient credit'},
                                     status=status.HTTP_400_BAD_REQUEST)
 
-        return Response({'success': True, 'message': 'Selling charge has been done successfully'},
+        if idempotency_key:
+            store_response("sell_charge", user.id, idempotency_key, response.data, response.status_code, fingerprint)
+        return response
+
+
+class BulkSellChargeView(APIView):
+    authentication_classes = (AccessTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    serializer_class = SellerSellingChargeCreateSerializer
+
+    def post(self, request):
+        user = request.user
+        # Checked before validating, an oversized payload costs no per item validation
+        if not isinstance(request.data, list):
+            return Response({'success': False, 'message': 'Expected a list of charges'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > settings.BULK_CHARGE_MAX_ITEMS:
+            return Response({'success': False,
+                             'message': f'At most {settings.BULK_CHARGE_MAX_ITEMS} charges are allowed per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.serializer_class(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        charges = serializer.validated_data
+
+        seller = user.seller
+        results = perform_bulk_charge(seller.id, charges, striped=bool(seller.credit_stripes))
+
+        return Response({'success': all(result["success"] for result in results), 'results': results},
                         status=status.HTTP_200_OK)
 
 
 class ShowSellerCreditView(generics.RetrieveAPIView):
+    """
+    The seller's credit, or with ?as_of= (an ISO 8601 date or datetime) its ledger
+    balance over the rows before that moment. Staff may read any seller with ?seller_id=.
+    """
     authentication_classes = (AccessTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = SellerSerializer
 
     def get_object(self):
+        seller_id = self.request.query_params.get("seller_id")
+        if seller_id and self.request.user.is_staff:
+            return generics.get_object_or_404(Seller.objects.select_related("user"), id=seller_id)
         return Seller.objects.get(user=self.request.user)
 
+    def retrieve(self, request, *args, **kwargs):
+        as_of = request.query_params.get("as_of")
+        if not as_of:
+            return super().retrieve(request, *args, **kwargs)
+        try:
+            moment = parse_date_bound(as_of)
+        except ValueError:
+            return Response({"as_of": "Must be an ISO 8601 date or datetime"}, status=status.HTTP_400_BAD_REQUEST)
+
+        seller = self.get_object()
+        return Response({"user": str(seller.user), "credit": balance_at(seller.id, moment), "as_of": moment})
+
 
 class ShowSellerTransactionView(generics.ListAPIView):
     authentication_classes = (AccessTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = TransactionSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return Transaction.objects.select_related("seller__user").filter(seller__user=self.request.user)
+        # Only the columns of the charging_transaction_history index, so pages are index only scans
+        return Transaction.objects.filter(seller__user=self.request.user, **get_transaction_filters(self.request)). \
+            only("id", "phone", "amount", "transaction_type", "timestamp")
+
+    def get_extra_page_rows(self, cursor, rows, limit):
+        """Archived rows belonging on the page, looked up only when the hot rows reach back to the archive"""
+        if len(rows) >= limit and rows[-1].timestamp >= archive_horizon():
+            return []
+        return archived_page_rows(self.request.user.seller.id, get_transaction_filters(self.request), cursor, limit)
+
+
+class ExportSellerTransactionView(APIView):
+    """
+    Streams the whole filtered history as CSV or NDJSON (?export_format=), compressed
+    with brotli or gzip when the client accepts it. Staff may export any seller with
+    ?seller_id=.
+    """
+    authentication_classes = (AccessTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        export_format = request.query_params.get("export_format", "csv")
+        if export_format not in EXPORT_FORMATS:
+            return Response({"export_format": f"Must be one of {', '.join(EXPORT_FORMATS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        seller_id = request.query_params.get("seller_id")
+        if seller_id and request.user.is_staff:
+            seller = generics.get_object_or_404(Seller, id=seller_id)
+        else:
+            seller = request.user.seller
+
+        filters = get_transaction_filters(request)
+        hot_rows = Transaction.objects.filter(seller=seller, **filters). \
+            order_by("timestamp", "id").values_list(*EXPORT_FIELDS). \
+            iterator(chunk_size=settings.LEDGER_EXPORT_CHUNK_SIZE)
+        archived_rows = ((row.id, row.timestamp, row.transaction_type, row.amount, row.phone)
+                         for row in iter_archived_rows(seller.id, filters))
+        rows = heapq.merge(archived_rows, hot_rows, key=lambda row: (row[1], row[0]))
+        compression = negotiate_compression(request.headers.get("Accept-Encoding", ""))
+
+        response = StreamingHttpResponse(
+            stream_export(rows, export_format, compression, settings.LEDGER_EXPORT_CHUNK_SIZE),
+            content_type=EXPORT_FORMATS[export_format],
+        )
+        response["Content-Disposition"] = f'attachment; filename="ledger_{seller.id}.{export_format}"'
+        response["Vary"] = "Accept-Encoding"
+        if compression:
+            response["Content-Encoding"] = compression
+        return response
+
+
+class SellerStatsView(APIView):
+    """
+    Daily sums and counts per transaction type between ?from= and ?to= (inclusive
+    dates, the last 30 days by default), read from the daily rollups. Staff may read
+    any seller with ?seller_id=.
+    """
+    authentication_classes = (AccessTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    default_days = 30
+
+    def get(self, request):
+        seller_id = request.query_params.get("seller_id")
+        if seller_id and request.user.is_staff:
+            seller = generics.get_object_or_404(Seller, id=seller_id)
+        else:
+            seller = request.user.seller
+
+        last_day = parse_date_param(request, "to", default=timezone.now().date())
+        first_day = parse_date_param(request, "from", default=last_day - timedelta(days=self.default_days - 1))
+        transaction_type = get_transaction_filters(request).get("transaction_type")
+
+        stats = seller_daily_stats(seller.id, first_day, last_day, transaction_type)
+        return Response({"seller_id": seller.id,
+                         "from": first_day,
+                         "to": last_day,
+                         "rolled_up_to_tx_id": rolled_up_to_tx_id(),
+                         **stats})
 
 
 class CheckTransaction(APIView):
@@ -103,21 +369,29 @@ class CheckTransaction(APIView):
     permission_classes = (IsAuthenticated,)
 
     def get(self, request):
+        seller = request.user.seller
+        totals = seller.ledger_totals()
 
-        data = Transaction.objects.select_related("seller__user"). \
-            filter(seller__user=request.user).values("amount", "transaction_type"). \
-            aggregate(charge=Sum(Case(When(transaction_type='C', then=F('amount')), default=Value(0))),
-                      sell=Sum(Case(When(transaction_type='S', then=F('amount')), default=Value(0))),
-                      transaction_balance=F("charge") - F("sell"),
-                      seller_credit=Cast(Avg(F("seller__credit")), output_field=IntegerField()),
-                      )
-
-        data = {"charge": data.get("charge") or 0,
-                "sell": data.get("sell") or 0,
-                "transaction_balance": data.get("transaction_balance") or 0,
-                "seller_credit": data.get("seller_credit") or 0,
+        data = {"charge": totals["total_deposit"],
+                "sell": totals["total_sell"],
+                "transaction_balance": totals["total_deposit"] - totals["total_sell"],
+                "seller_credit": totals["credit"],
+                "tx_count": totals["tx_count"],
+                "last_tx_id": totals["last_tx_id"],
                 }
 
+        if request.query_params.get("deep") in ("1", "true"):
+            # Verifies the totals against the ledger rows after the last reconciliation checkpoint,
+            # without locking the seller or recording a checkpoint
+            reconciliation = reconcile_seller(seller.id, advance=False)
+            data["ledger"] = {"charge": reconciliation["ledger"]["total_deposit"],
+                              "sell": reconciliation["ledger"]["total_sell"],
+                              "tx_count": reconciliation["ledger"]["tx_count"],
+                              }
+            data["totals_match"] = reconciliation["totals_match"]
+            data["checkpoint_tx_id"] = reconciliation["checkpoint_tx_id"]
+            data["diverged_tx_ids"] = reconciliation["diverged_tx_ids"]
+
         state = data["seller_credit"] == data["transaction_balance"]
 
         return Response({"equal": state, 'data': data})
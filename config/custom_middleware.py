@@ -4,6 +4,7 @@ import time
 import traceback
 from uuid import uuid4
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from rest_framework import status
 
 api_logger = logging.getLogger("api")
@@ -11,15 +12,19 @@ exception_logger = logging.getLogger("exception")
 
 
 class ElasticAPILoggerMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        correlation_id = request.headers.get("correlation-id")
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
 
-        if not correlation_id:
-            correlation_id = uuid4().hex
-        setattr(request, "correlation_id", correlation_id)
+        self.set_correlation_id(request)
 
         path_whitelist = self.get_whitelist(request)
         start_time = time.monotonic()
@@ -32,6 +37,28 @@ class ElasticAPILoggerMiddleware:
 
         return response
 
+    async def __acall__(self, request):
+        self.set_correlation_id(request)
+
+        path_whitelist = self.get_whitelist(request)
+        start_time = time.monotonic()
+        response = await self.get_response(request)
+        process_time = time.monotonic() - start_time
+        if path_whitelist and response.status_code != 500:
+            user = await sync_to_async(self.find_user)(request)
+            log_data = self.api_log_data(request, response, user, process_time)
+            api_logger.info("api", extra=log_data)
+
+        return response
+
+    @staticmethod
+    def set_correlation_id(request):
+        correlation_id = request.headers.get("correlation-id")
+
+        if not correlation_id:
+            correlation_id = uuid4().hex
+        setattr(request, "correlation_id", correlation_id)
+
     def process_exception(self, request, exception):
         status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         path_whitelist = self.get_whitelist(request)
@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
+import psycopg2.extensions
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -100,6 +102,10 @@ DATABASES = {
     }
 }
 
+# "serializable" runs every transaction under SERIALIZABLE isolation, charging.retry retries its failures
+if os.environ.get('DB_ISOLATION_LEVEL') == 'serializable':
+    DATABASES['default']['OPTIONS'] = {'isolation_level': psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -156,6 +162,9 @@ REDIS_HOST = os.environ.get('REDIS_HOST')
 REDIS_PORT = os.environ.get('REDIS_PORT')
 REDIS_DEFAULT_TTL = 60 * 60 * 24 * 14  # 14 Days
 REDIS_AUTH_TTL = 60 * 60 * 24 * 14  # 14 Day
+TOKEN_CACHE_SIZE = 10000  # validated access tokens remembered per process, see accounts.token_cache
+TOKEN_CACHE_TTL = 30  # seconds, 0 turns the cache off
+TOKEN_CACHE_STATS_INTERVAL = 10000  # log hit/miss stats every N lookups, 0 to disable
 CACHES = {
     'default': {
         'BACKEND': 'django_redis.cache.RedisCache',
@@ -184,6 +193,15 @@ CACHES = {
         },
     },
 
+    'credit': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/4',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        },
+    },
+
 }
 
 RABBITMQ_HOST = os.environ.get('RABBITMQ_HOST')
@@ -196,6 +214,23 @@ CELERY_RESULT_BACKEND = f'redis://{REDIS_HOST}/3'
 CELERY_TIMEZONE = 'Asia/Tehran'
 CELERY_WORKER_CONCURRENCY = 5
 CELERY_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ROUTES = {
+    "charging.tasks.process_deposit_queue": {"queue": "deposit"},
+    "charging.tasks.requeue_stale_deposit_actions": {"queue": "deposit"},
+}
+CELERY_BEAT_SCHEDULE = {
+    "requeue-stale-deposit-actions": {
+        "task": "charging.tasks.requeue_stale_deposit_actions",
+        "schedule": 30,
+    },
+}
+CELERY_TASK_IGNORE_RESULT = True
+
+# Tests run tasks in process, without a broker
+if "test" in sys.argv[1:2]:
+    CELERY_BROKER_URL = "memory://"
+    CELERY_TASK_ALWAYS_EAGER = True
+    CELERY_TASK_EAGER_PROPAGATES = True
 
 ELASTICSEARCH_HOST = os.environ.get("ELASTICSEARCH_HOST")
 ELASTICSEARCH_PORT = os.environ.get("ELASTICSEARCH_PORT")
@@ -258,6 +293,38 @@ MINIO_STORAGE_MEDIA_URL = f'{MINIO_EXTERNAL_STORAGE_ENDPOINT}/{MINIO_STORAGE_MED
 
 QUEUE_NAME_LIST = ["deposit", ]
 
+# "locking": select_for_update on the seller row, "conditional": single guarded UPDATE + ledger insert,
+# "coalesced": concurrent charges of a seller are applied in one transaction by charging.coalescer,
+# "reserved": credit is reserved in Redis and written behind to Postgres by flush_credit_reservations
+# "optimistic": unlocked read and a compare-and-swap on the seller's version, retried on conflicts
+CHARGE_ENGINE = os.environ.get("CHARGE_ENGINE", "locking")
+CHARGE_COALESCER_BACKEND = os.environ.get("CHARGE_COALESCER_BACKEND", "redis")  # "redis" or "local"
+CHARGE_COALESCE_WINDOW = 0.005  # 5 Milliseconds
+CHARGE_COALESCE_MAX_BATCH = 100
+CHARGE_COALESCE_TIMEOUT = 5  # 5 Seconds
+CREDIT_RESERVATION_FLUSH_BATCH = 500
+CREDIT_RESERVATION_FLUSH_INTERVAL = 0.2  # 200 Milliseconds
+PHONE_REGISTRY_CACHE_SIZE = 100000
+PHONE_REGISTRY_STATS_INTERVAL = 10000  # log hit rate every N lookups
+
+LEDGER_EXPORT_CHUNK_SIZE = 2000
+
+LEDGER_ROLLUP_CHUNK_SIZE = 50000  # ledger ids per rollup transaction
+LEDGER_ROLLUP_LAG = 60  # seconds, ledger rows younger than this are left for the next run
+
+LEDGER_ARCHIVE_STORAGE = DEFAULT_FILE_STORAGE
+LEDGER_ARCHIVE_RETENTION_MONTHS = 12  # ledger rows of older months are moved to the archive storage
+BULK_CHARGE_MAX_ITEMS = 500
+BULK_CREDIT_REQUEST_MAX_ITEMS = 500
+DEPOSIT_APPROVAL_QUEUE = True  # False applies admin actions on credit requests inline, in one statement
+DEPOSIT_QUEUE_STALE_AFTER = 60  # seconds an action may stay queued before the sweeper enqueues it again
+# True adds a new request's amount to the seller's pending one, admin actions then require the request version
+MERGE_PENDING_CREDIT_REQUESTS = False
+CONFLICT_RETRY_ATTEMPTS = 5  # per operation, see charging.retry
+CONFLICT_RETRY_BASE_DELAY = 0.002  # seconds, doubled per attempt and jittered
+CONFLICT_RETRY_MAX_DELAY = 0.1  # seconds
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24  # 1 Day
+
 DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL")
 EMAIL_BACKEND = os.environ.get("EMAIL_BACKEND")
 EMAIL_HOST = os.environ.get("EMAIL_HOST")
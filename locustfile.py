@@ -0,0 +1,50 @@
+"""
+Load test of the charging endpoints, run by the master/worker services of docker-compose.
+
+Compare the WSGI app with the async endpoints of the ASGI app at 500 concurrent clients:
+
+    LOCUST_API=sync  locust -f locustfile.py -H http://app:8000 -u 500 -r 50 -t 2m --headless
+    LOCUST_API=async locust -f locustfile.py -H http://app_asgi:8001 -u 500 -r 50 -t 2m --headless
+
+and read requests/s and the latency percentiles from the summary. The seller given by
+LOCUST_USER_IDENTIFIER / LOCUST_PASSWORD needs enough approved credit for the run.
+"""
+import os
+import random
+
+from locust import HttpUser, task, between
+
+API_PATHS = {
+    "sync": {
+        "sell_charge": "/v1/charging/sell_charge/",
+        "show_credit": "/v1/charging/show_credit/",
+    },
+    "async": {
+        "sell_charge": "/v1/charging/async/sell_charge/",
+        "show_credit": "/v1/charging/async/show_credit/",
+    },
+}
+
+
+class SellerUser(HttpUser):
+    wait_time = between(0, 0.1)
+    paths = API_PATHS[os.environ.get("LOCUST_API", "sync")]
+
+    def on_start(self):
+        response = self.client.post("/v1/accounts/login/", json={
+            "user_identifier": os.environ.get("LOCUST_USER_IDENTIFIER"),
+            "password": os.environ.get("LOCUST_PASSWORD"),
+        })
+        access_token = response.json()["data"]["access"]
+        self.client.headers["Authorization"] = f"Token {access_token}"
+
+    @task(4)
+    def sell_charge(self):
+        self.client.post(self.paths["sell_charge"], name="sell_charge", json={
+            "phone": f"0912{random.randint(0, 9999999):07d}",
+            "amount": 1,
+        })
+
+    @task(1)
+    def show_credit(self):
+        self.client.get(self.paths["show_credit"], name="show_credit")